@@ -0,0 +1,305 @@
+"""Parsing helpers for archive.ph pages and Twitter/X URLs."""
+import os
+import re
+import time
+from datetime import datetime
+
+from bs4 import BeautifulSoup
+
+from metrics import PARSE_SECONDS
+from url_classifier import ARCHIVE_PATH, classify_url
+
+try:
+    from lxml import etree
+    import lxml.html
+except ImportError:  # pragma: no cover - lxml is in requirements.txt
+    etree = None
+
+# 'lxml' scans the page with an incremental parser and stops as soon as every
+# field is decided; 'bs4' builds the full BeautifulSoup tree.
+PARSER_CONFIG = {
+    'mode': os.environ.get('ARCHIVE_PARSER_MODE', 'lxml'),
+    'chunk_size': 64 * 1024  # characters fed to the incremental parser at a time
+}
+
+# Attributes BeautifulSoup treats as whitespace-separated lists
+MULTI_VALUED_ATTRIBUTES = {'class', 'rel', 'rev', 'accept-charset', 'headers', 'accesskey', 'dropzone'}
+
+# Each probe is (tag, attrs, attribute) and mirrors ``soup.find(tag, attrs)[attribute]``.
+# attrs is a tuple of (name, expected) pairs so probes can be used as dict keys;
+# a tag of None matches any element and an attribute of None reads the element text.
+ORIGINAL_URL_PROBES = [
+    ('meta', (('property', 'og:url'),), 'content'),
+    ('link', (('rel', 'canonical'),), 'href'),
+    ('input', (('id', 'originalUrl'),), 'value'),
+    ('meta', (('name', 'original-url'),), 'content'),
+]
+
+ARCHIVE_DATE_PROBES = [
+    ('meta', (('property', 'article:modified_time'),), 'content'),
+    ('meta', (('name', 'archive-date'),), 'content'),
+    (None, (('class', 'archive-date'),), None),
+]
+
+TWEET_DATE_PROBES = [
+    ('time', (), 'datetime'),
+    ('span', (('data-time', True),), 'data-time'),
+    (None, (('class', 'tweet-timestamp'),), 'title'),
+]
+
+ALL_PROBES = ORIGINAL_URL_PROBES + ARCHIVE_DATE_PROBES + TWEET_DATE_PROBES
+
+TAG_PROBES = [probe for probe in ALL_PROBES if probe[0] is not None]
+TAG_PROBE_TAGS = {probe[0] for probe in TAG_PROBES}
+
+class OriginalUrlNotFound(ValueError):
+    """The page was fetched but holds no Twitter/X original URL."""
+
+_MISSING = object()
+_PENDING = object()
+
+def _class_xpath(class_name):
+    return etree.XPath(
+        f"//*[contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')]"
+    ) if etree is not None else None
+
+# Text nodes BeautifulSoup's get_text returns: script, style and template
+# contents are kept as separate string types and skipped
+_ELEMENT_TEXT = etree.XPath(
+    './/text()[not(ancestor::script or ancestor::style or ancestor::template)]'
+) if etree is not None else None
+
+CLASS_PROBE_XPATHS = {
+    probe: _class_xpath(dict(probe[1])['class'])
+    for probe in ALL_PROBES if probe[0] is None
+}
+
+BARE_ARCHIVE_ID = re.compile(r'[A-Za-z0-9]+')
+
+# First path segments of the archive service's own pages, which are not captures
+ARCHIVE_SERVICE_PAGES = {'submit', 'newest', 'oldest', 'timegate', 'timemap'}
+
+def extract_tweet_id(url):
+    """Extract tweet ID from various Twitter/X URL formats."""
+    return classify_url(url).tweet_id
+
+def extract_archive_id(url):
+    """Extract the archive ID from an archive.ph/.is/.today URL or a bare ID."""
+    if BARE_ARCHIVE_ID.fullmatch(url):
+        return url
+    return classify_url(url).archive_id
+
+def capture_archive_id(url, base_url=None):
+    """The archive ID if ``url`` is a capture page, else None.
+
+    The page must be on an archive.* host, or on ``base_url``'s host when a
+    mirror is configured, and not the service's own submit or index pages.
+    """
+    info = classify_url(url)
+    if info.kind == 'archive':
+        archive_id = info.archive_id
+    elif base_url and info.host and info.host == classify_url(base_url).host:
+        match = ARCHIVE_PATH.match(info.path)
+        archive_id = match.group('archive_id') if match else None
+    else:
+        return None
+    return None if archive_id in ARCHIVE_SERVICE_PAGES else archive_id
+
+def parse_twitter_date(date_str):
+    """Parse Twitter date formats."""
+    formats = [
+        '%Y-%m-%dT%H:%M:%S.%fZ',
+        '%Y-%m-%dT%H:%M:%SZ',
+        '%a %b %d %H:%M:%S %z %Y',
+        '%Y-%m-%d %H:%M:%S %z',
+    ]
+
+    for fmt in formats:
+        try:
+            return datetime.strptime(date_str, fmt)
+        except ValueError:
+            continue
+    return None
+
+def _attribute_matches(expected, actual, name):
+    """Match one attribute the way BeautifulSoup.find does."""
+    if expected is True:
+        return actual is not None
+    if actual is None:
+        return False
+    if name in MULTI_VALUED_ATTRIBUTES:
+        return expected in actual.split() or expected == ' '.join(actual.split())
+    return expected == actual
+
+def _element_matches(probe, tag, attrib):
+    probe_tag, probe_attrs, _ = probe
+    if probe_tag is not None and probe_tag != tag:
+        return False
+    return all(
+        _attribute_matches(expected, attrib.get(name), name)
+        for name, expected in probe_attrs
+    )
+
+def _element_value(element, attribute):
+    if attribute is None:
+        return ''.join(_ELEMENT_TEXT(element))
+    value = element.get(attribute)
+    return _MISSING if value is None else value
+
+def _valid_original_url(url):
+    return url if url and ('twitter.com' in url or 'x.com' in url) else None
+
+def _valid_date(date_str):
+    try:
+        return parse_twitter_date(date_str)
+    except (TypeError, ValueError):
+        return None
+
+def _resolve(probes, values, validate):
+    """Walk a method chain over probe values.
+
+    Returns ``(decided, result)``; a chain is undecided while a probe ahead
+    of the first valid value has not been seen yet.
+    """
+    for probe in probes:
+        value = values.get(probe, _PENDING)
+        if value is _PENDING:
+            return False, None
+        if value is _MISSING:
+            continue
+        result = validate(value)
+        if result:
+            return True, result
+    return True, None
+
+class _ProbeScanner:
+    """Incremental lxml scan recording the first element matching each probe.
+
+    Tag probes are matched on start events filtered by libxml2, so elements
+    that cannot match never reach Python. Class probes may match any element
+    and are only resolved, by XPath over the finished tree, when a chain
+    actually falls through to them.
+    """
+
+    def __init__(self, html_content):
+        self.values = {}
+        self._scan(html_content)
+
+    def _scan(self, html_content):
+        if isinstance(html_content, bytes):
+            html_content = html_content.decode('utf-8', errors='replace')
+        parser = etree.HTMLPullParser(events=('start',), tag=list(TAG_PROBE_TAGS), huge_tree=True)
+        chunk_size = PARSER_CONFIG['chunk_size']
+        for offset in range(0, len(html_content), chunk_size):
+            parser.feed(html_content[offset:offset + chunk_size])
+            self._consume(parser.read_events())
+            if self._all_decided():
+                return
+        try:
+            root = parser.close()
+        except etree.LxmlError:
+            root = None
+        self._consume(parser.read_events())
+        for probe in TAG_PROBES:
+            self.values.setdefault(probe, _MISSING)
+        for probe, xpath in CLASS_PROBE_XPATHS.items():
+            matches = xpath(root) if root is not None else []
+            self.values[probe] = _element_value(matches[0], probe[2]) if matches else _MISSING
+
+    def _consume(self, events):
+        for _, element in events:
+            for probe in TAG_PROBES:
+                if probe not in self.values and _element_matches(probe, element.tag, element.attrib):
+                    self.values[probe] = _element_value(element, probe[2])
+
+    def _all_decided(self):
+        return all(
+            _resolve(probes, self.values, validate)[0]
+            for probes, validate in (
+                (ORIGINAL_URL_PROBES, _valid_original_url),
+                (ARCHIVE_DATE_PROBES, _valid_date),
+                (TWEET_DATE_PROBES, _valid_date),
+            )
+        )
+
+class ArchivePhParser:
+    def __init__(self, html_content, mode=None):
+        self.mode = mode or PARSER_CONFIG['mode']
+        if self.mode == 'lxml' and etree is None:
+            self.mode = 'bs4'
+
+        started = time.perf_counter()
+        if self.mode == 'lxml':
+            self.soup = None
+            self.values = _ProbeScanner(html_content).values
+        else:
+            self.soup = BeautifulSoup(html_content, 'html.parser')
+            self.values = {probe: self._find(probe) for probe in ALL_PROBES}
+        PARSE_SECONDS.labels(self.mode).observe(time.perf_counter() - started)
+
+    def _find(self, probe):
+        tag, attrs, attribute = probe
+        element = self.soup.find(tag, attrs=dict(attrs))
+        if element is None:
+            return _MISSING
+        if attribute is None:
+            return element.text
+        value = element.get(attribute)
+        return _MISSING if value is None else value
+
+    def get_original_url(self):
+        """Extract original URL from archive.ph page."""
+        return _resolve(ORIGINAL_URL_PROBES, self.values, _valid_original_url)[1]
+
+    def get_archive_date(self):
+        """Extract archive date from archive.ph page."""
+        return _resolve(ARCHIVE_DATE_PROBES, self.values, _valid_date)[1]
+
+    def get_tweet_date(self):
+        """Extract tweet date from archived Twitter/X page."""
+        return _resolve(TWEET_DATE_PROBES, self.values, _valid_date)[1]
+
+def build_archive_metadata(archive_id, html_content):
+    """Parse an archive.ph page into the /archive-metadata response dict."""
+    parser = ArchivePhParser(html_content)
+
+    original_url = parser.get_original_url()
+    if not original_url:
+        raise OriginalUrlNotFound("Could not extract original URL")
+
+    archive_date = parser.get_archive_date()
+    tweet_date = parser.get_tweet_date()
+
+    # Format dates
+    formatted_archive_date = archive_date.strftime('%d %b %Y') if archive_date else None
+    formatted_tweet_date = tweet_date.strftime('%d %b %Y') if tweet_date else None
+
+    return {
+        'originalUrl': original_url,
+        'archiveDate': formatted_archive_date,
+        'tweetDate': formatted_tweet_date,
+        'tweetId': extract_tweet_id(original_url),
+        'metadata': {
+            'archiveId': archive_id,
+            'fetchedAt': datetime.utcnow().isoformat(),
+            'isTwitterUrl': bool(extract_tweet_id(original_url))
+        }
+    }
+
+def html_to_text(html_content):
+    """Visible text of a page (str or bytes) with whitespace collapsed."""
+    if not html_content:
+        return ''
+    if etree is not None:
+        try:
+            document = lxml.html.fromstring(html_content)
+            etree.strip_elements(document, 'script', 'style', 'noscript', 'template', with_tail=False)
+            text = ' '.join(document.itertext())
+        except (etree.ParserError, ValueError):
+            text = ''
+    else:
+        soup = BeautifulSoup(html_content, 'html.parser')
+        for element in soup(['script', 'style', 'noscript', 'template']):
+            element.decompose()
+        text = soup.get_text(' ')
+    return ' '.join(text.split())
@@ -7,7 +7,8 @@ import json
 import signal
 import sys
 import traceback
-import requests
+import http_client
+from metrics import instrument_flask
 from urllib.parse import urlparse, urljoin
 import time
 
@@ -39,6 +40,9 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# Request latency histograms and /metrics (scraped by prometheus.yml as web:5000)
+instrument_flask(app, 'archive_server')
+
 # Server status tracking
 server_status = {
     'status': 'stopped',
@@ -56,7 +60,7 @@ def create_archive(url):
         }
         data = {'url': url}
         
-        response = requests.post(archive_url, headers=headers, data=data, allow_redirects=True)
+        response = http_client.post(archive_url, headers=headers, data=data, allow_redirects=True)
         
         # If we get redirected, that's the archive URL
         if response.history:
@@ -1,17 +1,30 @@
-from flask import Flask, jsonify, request
-from flask_caching import Cache
-from bs4 import BeautifulSoup
+from flask import Flask, Response, jsonify, request, stream_with_context
 import requests
-from datetime import datetime, timedelta
-import re
+import http_client
+from http_client import get_random_user_agent
+from archive_parser import build_archive_metadata, capture_archive_id, html_to_text
+from batch_metadata import (
+    batch_response, cacheable_failure, describe_failure, group_archive_urls, new_batch_stats,
+    resolve_archive_ids, stream_batch_metadata, stream_media_type
+)
+from metadata_cache import CACHE_CONFIG, CachedFailure, MetadataCache
+from batch_progress import BatchProgress
+from single_flight import SingleFlight
+from rate_limiter import RATE_LIMIT, RateLimiter, RateLimitExceeded
+import upstream_governor
+from metrics import instrument_flask
+from upstream_governor import UpstreamThrottled, UpstreamUnavailable, get_governor
+from datetime import datetime
 import time
 import json
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlparse
 import logging
 from logging.handlers import RotatingFileHandler
 import os
+import threading
+import uuid
 from functools import wraps
-import random
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 app = Flask(__name__)
 
@@ -26,232 +39,476 @@ handler.setFormatter(logging.Formatter(
 ))
 app.logger.addHandler(handler)
 
-# Configure caching
-cache_config = {
-    'CACHE_TYPE': 'filesystem',
-    'CACHE_DIR': 'cache',
-    'CACHE_DEFAULT_TIMEOUT': 86400  # 24 hours
+# Request latency histograms and /metrics
+instrument_flask(app, 'archive_server1')
+
+# Configure caching: in-process LRU in front of Redis when USE_REDIS=true.
+# Concurrent misses and duplicate submissions share one archive.ph call.
+metadata_cache = MetadataCache(
+    CACHE_CONFIG['redis_url'],
+    flight=SingleFlight(CACHE_CONFIG['redis_url'], namespace='metadata')
+)
+submit_flight = SingleFlight(CACHE_CONFIG['redis_url'], namespace='submit', lease_ttl=120)
+
+# Rate limiting: sliding-window counters, shared through Redis when USE_REDIS=true
+rate_limiter = RateLimiter(CACHE_CONFIG['redis_url'])
+
+# Upstream archive service; overridable so benchmarks can target a local stub
+ARCHIVE_CONFIG = {
+    'base_url': os.environ.get('ARCHIVE_BASE_URL', 'https://archive.ph').rstrip('/'),
+    'max_retry_wait': 5  # longer upstream backoffs fail the request instead of holding a worker
 }
-app.config.from_mapping(cache_config)
-cache = Cache(app)
-
-# Rate limiting configuration
-RATE_LIMIT = {
-    'requests': {},
-    'window': 60,  # 1 minute window
-    'max_requests': 30  # max requests per window
+
+# Batch metadata configuration
+BATCH_CONFIG = {
+    'max_urls': 500,  # max URLs accepted per /batch-metadata request
+    'max_stream_urls': 5000,  # max URLs per streamed (NDJSON/SSE) /batch-metadata request
+    'max_workers': 16,  # concurrent archive.ph fetches shared by all batches
+    'max_in_flight': 32  # fetches one batch may have queued on the shared pool
 }
 
-class RequestBlockedException(Exception):
-    pass
+batch_executor = ThreadPoolExecutor(
+    max_workers=BATCH_CONFIG['max_workers'],
+    thread_name_prefix='batch-metadata'
+)
+
+# Content analysis: pages are fetched concurrently, then analyzed and stored as one batch
+ANALYZE_CONFIG = {
+    'database_url': os.environ.get('DATABASE_URL', 'sqlite:///url_analyzer.db'),
+    'model_path': os.environ.get('ML_MODEL_PATH', 'models/url_analyzer.joblib'),
+    'max_urls': 100,  # max URLs accepted per /batch-analyze request
+    'max_hosts': 10,  # distinct hosts one /batch-analyze request may make the server fetch from
+    'max_workers': 8,  # concurrent page fetches shared by all batches
+    'max_in_flight': 4,  # fetches one batch may have queued on the shared pool
+    'fetch_timeout': 10,
+    'max_page_bytes': 2 * 1024 * 1024  # larger pages are analyzed from their first 2 MB
+}
+
+analyze_executor = ThreadPoolExecutor(
+    max_workers=ANALYZE_CONFIG['max_workers'],
+    thread_name_prefix='batch-analyze'
+)
+
+# Batch archiving runs on the Celery workers (tasks.batch_archive_urls); the server
+# submits batches and reports the progress the workers record
+BATCH_ARCHIVE_CONFIG = {
+    'broker_url': os.environ.get('CELERY_BROKER_URL') or os.environ.get('REDIS_URL'),
+    'max_urls': 10000,  # max URLs accepted per /batch-archive request
+    'max_concurrent': 32  # ceiling on a batch's requested capture concurrency
+}
+
+batch_progress = BatchProgress(CACHE_CONFIG['redis_url'])
+_celery_client = None
+
+# One analyzer per process, created on first use; requests share its models
+# and each works in its own thread-local session
+_analyzer = None
+_analyzer_lock = threading.Lock()
 
 def rate_limit(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
-        now = time.time()
-        client_ip = request.remote_addr
+        allowed, retry_after = rate_limiter.hit(request.remote_addr)
+        if not allowed:
+            raise RateLimitExceeded(retry_after)
+        return func(*args, **kwargs)
+    return wrapper
+
+@app.errorhandler(RateLimitExceeded)
+def rate_limit_exceeded(e):
+    app.logger.warning(f"Rate limit exceeded for IP: {request.remote_addr}")
+    response = jsonify({
+        'error': 'Rate limit exceeded',
+        'retryAfter': e.retry_after
+    })
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
 
-        # Clean up old entries
-        RATE_LIMIT['requests'] = {
-            ip: timestamps for ip, timestamps in RATE_LIMIT['requests'].items()
-            if timestamps[-1] > now - RATE_LIMIT['window']
+def fetch_archive_metadata(archive_id):
+    """Fetch and parse an archive.ph page, returning its metadata dict."""
+    app.logger.info(f"Processing archive ID: {archive_id}")
+
+    # Fetch the archive.ph page with retries, paced by the shared governor
+    archive_url = f"{ARCHIVE_CONFIG['base_url']}/{archive_id}"
+    governor = get_governor(archive_url)
+    max_retries = 3
+
+    for attempt in range(max_retries):
+        headers = {
+            'User-Agent': get_random_user_agent(),
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+            'Accept-Language': 'en-US,en;q=0.5',
+            'DNT': '1',
         }
 
-        # Initialize client's timestamp list
-        if client_ip not in RATE_LIMIT['requests']:
-            RATE_LIMIT['requests'][client_ip] = []
+        governor.acquire()  # fails fast while archive.ph is degraded
+        retry_after = None
+        try:
+            response = http_client.get(archive_url, headers=headers, timeout=10)
+            governor.observe(response.status_code, response.headers, response.content)
+            response.raise_for_status()
+            break
+        except UpstreamThrottled as e:
+            error = e
+            retry_after = e.retry_after if e.hinted else None
+        except requests.HTTPError as e:
+            if e.response.status_code < 500:
+                raise  # 404 and friends will not change on retry
+            error = e
+        except requests.RequestException as e:
+            governor.record_failure()
+            error = e
+
+        delay = governor.backoff(attempt, retry_after, ARCHIVE_CONFIG['max_retry_wait'])
+        if attempt == max_retries - 1 or delay is None:
+            raise error
+        time.sleep(delay)
+
+    result = build_archive_metadata(archive_id, response.text)
+
+    app.logger.info(f"Successfully processed {archive_id}: {json.dumps(result)}")
+    return result
+
+def failure_response(payload, status_code):
+    response = jsonify(payload)
+    if 'retryAfter' in payload:
+        response.headers['Retry-After'] = str(payload['retryAfter'])
+    return response, status_code
+
+def get_metadata(archive_id):
+    """Metadata for an archive ID from the shared cache, fetching on a miss."""
+    return metadata_cache.get_or_fetch(
+        archive_id, lambda: fetch_archive_metadata(archive_id), cacheable_failure
+    )
+
+def get_cached_metadata(archive_id):
+    """Return cached metadata without waiting on archive.ph, or None on a miss.
+
+    Stale entries are returned while a background refresh runs; cached
+    failures raise CachedFailure.
+    """
+    return metadata_cache.get_cached(
+        archive_id, lambda: fetch_archive_metadata(archive_id), cacheable_failure
+    )
 
-        # Add current timestamp
-        RATE_LIMIT['requests'][client_ip].append(now)
+@app.route('/archive-metadata/<archive_id>', methods=['GET'])
+@rate_limit
+def get_archive_metadata(archive_id):
+    try:
+        return jsonify(get_metadata(archive_id))
 
-        # Remove timestamps outside the window
-        RATE_LIMIT['requests'][client_ip] = [
-            t for t in RATE_LIMIT['requests'][client_ip]
-            if t > now - RATE_LIMIT['window']
-        ]
+    except CachedFailure as e:
+        return failure_response(e.payload, e.status_code)
 
-        # Check if rate limit is exceeded
-        if len(RATE_LIMIT['requests'][client_ip]) > RATE_LIMIT['max_requests']:
-            raise RequestBlockedException("Rate limit exceeded")
+    except requests.RequestException as e:
+        app.logger.error(f"Request error for {archive_id}: {str(e)}")
+        _, status_code, payload = describe_failure(e)
+        return failure_response(payload, status_code)
 
-        return func(*args, **kwargs)
-    return wrapper
+    except Exception as e:
+        kind, status_code, payload = describe_failure(e)
+        if kind:
+            app.logger.warning(f"Could not resolve {archive_id}: {str(e)}")
+        else:
+            app.logger.error(f"Error processing {archive_id}: {str(e)}", exc_info=True)
+        return failure_response(payload, status_code)
+
+@app.route('/batch-metadata', methods=['POST'])
+@rate_limit
+def batch_metadata():
+    try:
+        data = request.get_json(silent=True)
+        if not data or not isinstance(data.get('urls'), list):
+            return jsonify({
+                'error': 'Missing urls parameter',
+                'details': 'Please provide a list of archive URLs'
+            }), 400
 
-def get_random_user_agent():
-    user_agents = [
-        'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:89.0) Gecko/20100101 Firefox/89.0',
-        'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.1.1 Safari/605.1.15',
-    ]
-    return random.choice(user_agents)
-
-def extract_tweet_id(url):
-    """Extract tweet ID from various Twitter/X URL formats."""
-    patterns = [
-        r'(?:twitter|x)\.com/\w+/status/(\d+)',
-        r'(?:twitter|x)\.com/i/status/(\d+)',
-        r'(?:twitter|x)\.com/\w+/statuses/(\d+)',
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, url)
-        if match:
-            return match.group(1)
-    return None
+        # Streaming clients get each URL as it resolves, so they may send larger batches
+        media_type = stream_media_type(request.headers.get('Accept'))
+        max_urls = BATCH_CONFIG['max_stream_urls'] if media_type else BATCH_CONFIG['max_urls']
+        urls = [u.strip() for u in data['urls'] if isinstance(u, str) and u.strip()]
+        if len(urls) > max_urls:
+            return jsonify({
+                'error': 'Too many URLs',
+                'details': f"A batch may contain at most {max_urls} URLs"
+            }), 400
+
+        urls_by_id, invalid_urls = group_archive_urls(urls)
+        stats = new_batch_stats(urls, urls_by_id)
+        outcomes = resolve_archive_ids(
+            urls_by_id, stats, get_cached_metadata, get_metadata,
+            batch_executor, BATCH_CONFIG['max_in_flight']
+        )
+
+        if media_type:
+            response = Response(
+                stream_with_context(stream_batch_metadata(urls_by_id, invalid_urls, stats, outcomes, media_type)),
+                mimetype=media_type
+            )
+            response.headers['Cache-Control'] = 'no-cache'
+            response.headers['X-Accel-Buffering'] = 'no'  # nginx would otherwise hold records back
+            return response
 
-def parse_twitter_date(date_str):
-    """Parse Twitter date formats."""
-    formats = [
-        '%Y-%m-%dT%H:%M:%S.%fZ',
-        '%Y-%m-%dT%H:%M:%SZ',
-        '%a %b %d %H:%M:%S %z %Y',
-        '%Y-%m-%d %H:%M:%S %z',
-    ]
-    
-    for fmt in formats:
+        return jsonify(batch_response(urls_by_id, invalid_urls, stats, outcomes))
+
+    except Exception as e:
+        app.logger.error(f"Error processing batch: {str(e)}", exc_info=True)
+        return jsonify({
+            'error': 'Internal server error',
+            'details': str(e)
+        }), 500
+
+def submit_archive(url):
+    """Submit a URL to archive.ph, returning the archive URL or None."""
+    headers = {
+        'User-Agent': get_random_user_agent(),
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+        'Accept-Language': 'en-US,en;q=0.5',
+        'Content-Type': 'application/x-www-form-urlencoded',
+        'DNT': '1',
+    }
+
+    submit_url = f"{ARCHIVE_CONFIG['base_url']}/submit/"
+    governor = get_governor(submit_url)
+    max_retries = 3
+
+    for attempt in range(max_retries):
+        governor.acquire()
+        error = retry_after = None
         try:
-            return datetime.strptime(date_str, fmt)
-        except ValueError:
-            continue
-    return None
+            response = http_client.post(
+                submit_url,
+                data={'url': url},
+                headers=headers,
+                timeout=30,
+                allow_redirects=True
+            )
+            governor.observe(response.status_code, response.headers, response.content)
+            response.raise_for_status()
+
+            # Check if we were redirected to a capture on the configured archive
+            final_url = response.url
+            if capture_archive_id(final_url, ARCHIVE_CONFIG['base_url']):
+                return final_url
+        except UpstreamThrottled as e:
+            error = e
+            retry_after = e.retry_after if e.hinted else None
+        except requests.RequestException as e:
+            if not isinstance(e, requests.HTTPError):
+                governor.record_failure()
+            error = e
+
+        # Not archived yet, or a transient failure: back off before resubmitting
+        delay = governor.backoff(attempt, retry_after, ARCHIVE_CONFIG['max_retry_wait'])
+        if attempt == max_retries - 1 or delay is None:
+            if error is not None:
+                raise error
+            break
+        time.sleep(delay)
 
-class ArchivePhParser:
-    def __init__(self, html_content):
-        self.soup = BeautifulSoup(html_content, 'html.parser')
-        
-    def get_original_url(self):
-        """Extract original URL from archive.ph page."""
-        # Try multiple methods to find the original URL
-        methods = [
-            lambda: self.soup.find('meta', {'property': 'og:url'})['content'],
-            lambda: self.soup.find('link', {'rel': 'canonical'})['href'],
-            lambda: self.soup.find('input', {'id': 'originalUrl'})['value'],
-            lambda: self.soup.find('meta', {'name': 'original-url'})['content'],
-        ]
-        
-        for method in methods:
-            try:
-                url = method()
-                if url and ('twitter.com' in url or 'x.com' in url):
-                    return url
-            except (TypeError, KeyError, AttributeError):
-                continue
-        
-        return None
-
-    def get_archive_date(self):
-        """Extract archive date from archive.ph page."""
-        methods = [
-            lambda: self.soup.find('meta', {'property': 'article:modified_time'})['content'],
-            lambda: self.soup.find('meta', {'name': 'archive-date'})['content'],
-            lambda: self.soup.find(class_='archive-date').text,
-        ]
-        
-        for method in methods:
-            try:
-                date_str = method()
-                date = parse_twitter_date(date_str)
-                if date:
-                    return date
-            except (TypeError, KeyError, AttributeError, ValueError):
-                continue
-        
-        return None
-
-    def get_tweet_date(self):
-        """Extract tweet date from archived Twitter/X page."""
-        methods = [
-            lambda: self.soup.find('time')['datetime'],
-            lambda: self.soup.find('span', {'data-time': True})['data-time'],
-            lambda: self.soup.find(class_='tweet-timestamp')['title'],
-        ]
-        
-        for method in methods:
-            try:
-                date_str = method()
-                date = parse_twitter_date(date_str)
-                if date:
-                    return date
-            except (TypeError, KeyError, AttributeError, ValueError):
-                continue
-        
-        return None
+    return None
 
-@app.route('/archive-metadata/<archive_id>', methods=['GET'])
-@rate_limit
-@cache.memoize(timeout=86400)  # Cache for 24 hours
-def get_archive_metadata(archive_id):
+def create_analyzer():
+    # The schema comes from init_db.py, not from the request path
+    from database import scoped_sessions
+    from ml_analyzer import MLAnalyzer
+
+    # Each request thread gets its own session, removed when its analyzer call returns
+    return MLAnalyzer(scoped_sessions(ANALYZE_CONFIG['database_url']), model_path=ANALYZE_CONFIG['model_path'])
+
+def get_analyzer():
+    global _analyzer
+    if _analyzer is None:
+        with _analyzer_lock:
+            if _analyzer is None:
+                _analyzer = create_analyzer()
+    return _analyzer
+
+def analyze_contents(batch):
+    """Analyze ``(url, text)`` pairs in one batch, returning ``{url: analysis}``."""
+    analyzer = get_analyzer()
     try:
-        app.logger.info(f"Processing archive ID: {archive_id}")
-        
-        # Fetch the archive.ph page with retries
-        max_retries = 3
-        retry_delay = 1
-        
-        for attempt in range(max_retries):
-            try:
-                headers = {
-                    'User-Agent': get_random_user_agent(),
-                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-                    'Accept-Language': 'en-US,en;q=0.5',
-                    'DNT': '1',
-                }
-                
-                archive_url = f'https://archive.ph/{archive_id}'
-                response = requests.get(archive_url, headers=headers, timeout=10)
-                response.raise_for_status()
-                break
-            except requests.RequestException as e:
-                if attempt == max_retries - 1:
-                    raise
-                time.sleep(retry_delay * (attempt + 1))
-                continue
+        results = analyzer.analyze_urls(batch)
+        return {
+            result['url']: analyzer.content_analysis(text, result)
+            for result, (_, text) in zip(results, batch)
+        }
+    finally:
+        analyzer.session.remove()
 
-        parser = ArchivePhParser(response.text)
-        
-        original_url = parser.get_original_url()
-        if not original_url:
-            raise ValueError("Could not extract original URL")
+def fetch_page_text(url):
+    """Fetch a client-named page for analysis and return its visible text.
 
-        archive_date = parser.get_archive_date()
-        tweet_date = parser.get_tweet_date()
+    Only public addresses are fetched, checked again at every redirect. Each
+    host is paced by its governor; archive.ph shares one with metadata fetches.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise ValueError('Invalid URL')
 
-        # Format dates
-        formatted_archive_date = archive_date.strftime('%d %b %Y') if archive_date else None
-        formatted_tweet_date = tweet_date.strftime('%d %b %Y') if tweet_date else None
+    governor = get_governor(url)
+    governor.acquire()
+    try:
+        response = http_client.get_public(
+            url,
+            headers={'User-Agent': get_random_user_agent()},
+            timeout=ANALYZE_CONFIG['fetch_timeout'],
+            stream=True
+        )
+        try:
+            body = response.raw.read(ANALYZE_CONFIG['max_page_bytes'], decode_content=True)
+        finally:
+            response.close()
+    except requests.RequestException:
+        governor.record_failure()
+        raise
+    governor.observe(response.status_code, response.headers, body)
+    response.raise_for_status()
+    return html_to_text(body)
+
+def url_host(url):
+    try:
+        return (urlparse(url).hostname or '').lower()
+    except ValueError:
+        return ''
+
+def fetch_page_texts(urls):
+    """``(texts, errors)`` by URL, keeping at most ``max_in_flight`` of the batch's fetches queued."""
+    texts = {}
+    errors = {}
+    pending = iter(urls)
+    in_flight = {}
+    while True:
+        for url in pending:
+            in_flight[analyze_executor.submit(fetch_page_text, url)] = url
+            if len(in_flight) >= ANALYZE_CONFIG['max_in_flight']:
+                break
+        if not in_flight:
+            return texts, errors
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            url = in_flight.pop(future)
+            try:
+                texts[url] = future.result()
+            except Exception as e:
+                app.logger.warning(f"Could not fetch {url} for analysis: {str(e)}")
+                errors[url] = describe_fetch_error(e)
+
+def describe_fetch_error(error):
+    if isinstance(error, ValueError):
+        return str(error)
+    if isinstance(error, UpstreamUnavailable):
+        # Every page host is paced, not only archive.ph
+        return 'Page host temporarily unavailable'
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return f"Page returned HTTP {error.response.status_code}"
+    if isinstance(error, requests.RequestException):
+        return 'Failed to fetch page'
+    return 'Internal server error'
+
+@app.route('/batch-analyze', methods=['POST'])
+@rate_limit
+def batch_analyze():
+    try:
+        data = request.get_json(silent=True)
+        if not data or not isinstance(data.get('urls'), list):
+            return jsonify({
+                'error': 'Missing urls parameter',
+                'details': 'Please provide a list of URLs'
+            }), 400
 
-        result = {
-            'originalUrl': original_url,
-            'archiveDate': formatted_archive_date,
-            'tweetDate': formatted_tweet_date,
-            'tweetId': extract_tweet_id(original_url),
-            'metadata': {
-                'archiveId': archive_id,
-                'fetchedAt': datetime.utcnow().isoformat(),
-                'isTwitterUrl': bool(extract_tweet_id(original_url))
-            }
-        }
+        urls = [u.strip() for u in data['urls'] if isinstance(u, str) and u.strip()]
+        if len(urls) > ANALYZE_CONFIG['max_urls']:
+            return jsonify({
+                'error': 'Too many URLs',
+                'details': f"A batch may contain at most {ANALYZE_CONFIG['max_urls']} URLs"
+            }), 400
 
-        app.logger.info(f"Successfully processed {archive_id}: {json.dumps(result)}")
-        return jsonify(result)
+        # Fetch each distinct page once, a few at a time
+        unique_urls = list(dict.fromkeys(urls))
+        hosts = {url_host(url) for url in unique_urls}
+        if len(hosts) > ANALYZE_CONFIG['max_hosts']:
+            return jsonify({
+                'error': 'Too many hosts',
+                'details': f"A batch may fetch from at most {ANALYZE_CONFIG['max_hosts']} hosts"
+            }), 400
+        texts, errors = fetch_page_texts(unique_urls)
 
-    except RequestBlockedException:
-        app.logger.warning(f"Rate limit exceeded for IP: {request.remote_addr}")
-        return jsonify({
-            'error': 'Rate limit exceeded',
-            'retryAfter': RATE_LIMIT['window']
-        }), 429
+        # Analyze and store every fetched page in one batch and one commit
+        batch = [(url, texts[url]) for url in unique_urls if url in texts]
+        analyses = analyze_contents(batch) if batch else {}
 
-    except requests.RequestException as e:
-        app.logger.error(f"Request error for {archive_id}: {str(e)}")
+        app.logger.info(
+            f"Analyzed batch of {len(urls)} URLs: {len(analyses)} analyzed, {len(errors)} failed"
+        )
+        return jsonify([
+            {'url': url, 'analysis': analyses[url]} if url in analyses else {'url': url, 'error': errors[url]}
+            for url in urls
+        ])
+
+    except Exception as e:
+        app.logger.error(f"Error analyzing batch: {str(e)}", exc_info=True)
         return jsonify({
-            'error': 'Failed to fetch archive page',
+            'error': 'Internal server error',
             'details': str(e)
-        }), 503
+        }), 500
+
+def find_near_duplicates(url, limit):
+    """Analyzed URLs whose content nearly matches ``url``'s, or None if it hasn't been analyzed."""
+    from sqlalchemy import select
+    from models import URL
+
+    analyzer = get_analyzer()
+    session = analyzer.session
+    try:
+        url_id = session.scalar(select(URL.id).where(URL.url_key == URL.make_key(url)))
+        if url_id is None:
+            return None
+        matches = analyzer.near_duplicates.find_for_url(session, url_id, limit=limit)
+        rows = {
+            row.id: row for row in session.execute(
+                select(URL.id, URL.original_url, URL.archive_url).where(URL.id.in_([m[0] for m in matches]))
+            )
+        } if matches else {}
+        return {
+            'url': url,
+            'url_id': url_id,
+            'duplicates': [
+                {
+                    'url_id': match_id,
+                    'url': rows[match_id].original_url,
+                    'archiveUrl': rows[match_id].archive_url,
+                    'similarity': round(score, 3)
+                }
+                for match_id, score in matches if match_id in rows
+            ]
+        }
+    finally:
+        analyzer.session.remove()
+
+@app.route('/near-duplicates', methods=['GET'])
+@rate_limit
+def near_duplicates():
+    try:
+        url = (request.args.get('url') or '').strip()
+        if not url:
+            return jsonify({
+                'error': 'Missing url parameter',
+                'details': 'Please provide the URL to find near-duplicates of'
+            }), 400
+        limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+
+        result = find_near_duplicates(url, limit)
+        if result is None:
+            return jsonify({
+                'error': 'URL not analyzed',
+                'details': 'Analyze the URL with /batch-analyze first'
+            }), 404
+        return jsonify(result)
 
     except Exception as e:
-        app.logger.error(f"Error processing {archive_id}: {str(e)}", exc_info=True)
+        app.logger.error(f"Error finding near-duplicates: {str(e)}", exc_info=True)
         return jsonify({
             'error': 'Internal server error',
             'details': str(e)
@@ -282,45 +539,7 @@ def create_archive():
                 'details': str(e)
             }), 400
 
-        # Submit URL to archive.ph
-        headers = {
-            'User-Agent': get_random_user_agent(),
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.5',
-            'Content-Type': 'application/x-www-form-urlencoded',
-            'DNT': '1',
-        }
-
-        # First, try to submit the URL
-        submit_url = 'https://archive.ph/submit/'
-        max_retries = 3
-        retry_delay = 1
-        archive_url = None
-
-        for attempt in range(max_retries):
-            try:
-                response = requests.post(
-                    submit_url,
-                    data={'url': url},
-                    headers=headers,
-                    timeout=30,
-                    allow_redirects=True
-                )
-                response.raise_for_status()
-
-                # Check if we were redirected to an archive page
-                final_url = response.url
-                if 'archive.ph/' in final_url:
-                    archive_url = final_url
-                    break
-
-                time.sleep(2)  # Wait a bit before checking status
-            except requests.RequestException as e:
-                if attempt == max_retries - 1:
-                    raise
-                time.sleep(retry_delay * (attempt + 1))
-                continue
-
+        archive_url = submit_flight.do(url, lambda: submit_archive(url))
         if not archive_url:
             return jsonify({
                 'error': 'Failed to create archive',
@@ -341,12 +560,13 @@ def create_archive():
         app.logger.info(f"Successfully created archive: {json.dumps(result)}")
         return jsonify(result)
 
-    except RequestBlockedException:
-        app.logger.warning(f"Rate limit exceeded for IP: {request.remote_addr}")
-        return jsonify({
-            'error': 'Rate limit exceeded',
-            'retryAfter': RATE_LIMIT['window']
-        }), 429
+    except UpstreamUnavailable as e:
+        app.logger.warning(f"Archive service unavailable while creating archive: {str(e)}")
+        return failure_response({
+            'error': 'Archive service temporarily unavailable',
+            'details': str(e),
+            'retryAfter': e.retry_after
+        }, 503)
 
     except requests.RequestException as e:
         app.logger.error(f"Request error while creating archive: {str(e)}")
@@ -362,6 +582,116 @@ def create_archive():
             'details': str(e)
         }), 500
 
+def celery_client():
+    """Celery app used only to send tasks to the workers, created on first use."""
+    global _celery_client
+    if _celery_client is None:
+        from celery import Celery
+
+        _celery_client = Celery('tasks', broker=BATCH_ARCHIVE_CONFIG['broker_url'])
+    return _celery_client
+
+def format_batch_progress(progress):
+    return {
+        'batchId': progress['batch_id'],
+        'status': progress['status'],
+        'total': progress['total'],
+        'alreadyArchived': progress['already_archived'],
+        'submitted': progress['submitted'],
+        'archived': progress['archived'],
+        'duplicate': progress['duplicate'],
+        'failed': progress['failed'],
+        'done': progress['done'],
+        'percent': progress['percent'],
+        'error': progress.get('error')
+    }
+
+@app.route('/batch-archive', methods=['POST'])
+@rate_limit
+def batch_archive():
+    from models import URL
+
+    try:
+        data = request.get_json(silent=True)
+        if not data or not isinstance(data.get('urls'), list):
+            return jsonify({
+                'error': 'Missing urls parameter',
+                'details': 'Please provide a list of URLs to archive'
+            }), 400
+
+        urls = [u.strip() for u in data['urls'] if isinstance(u, str) and u.strip()]
+        if len(urls) > BATCH_ARCHIVE_CONFIG['max_urls']:
+            return jsonify({
+                'error': 'Too many URLs',
+                'details': f"A batch may contain at most {BATCH_ARCHIVE_CONFIG['max_urls']} URLs"
+            }), 400
+        if not BATCH_ARCHIVE_CONFIG['broker_url']:
+            return jsonify({
+                'error': 'Batch archiving unavailable',
+                'details': 'No Celery broker is configured (CELERY_BROKER_URL or REDIS_URL)'
+            }), 503
+
+        valid_urls, invalid_urls = [], []
+        for url in urls:
+            parsed = urlparse(url)
+            if parsed.scheme in ('http', 'https') and parsed.netloc:
+                valid_urls.append(url)
+            else:
+                invalid_urls.append(url)
+        max_concurrent = data.get('maxConcurrent')
+        if max_concurrent is not None:
+            if not isinstance(max_concurrent, int):
+                return jsonify({
+                    'error': 'Invalid maxConcurrent',
+                    'details': 'maxConcurrent must be an integer'
+                }), 400
+            max_concurrent = min(max(max_concurrent, 1), BATCH_ARCHIVE_CONFIG['max_concurrent'])
+
+        batch_id = uuid.uuid4().hex
+        total = len({URL.make_key(url) for url in valid_urls})
+        # Recorded before dispatch so a fast worker finds it
+        batch_progress.start(batch_id, total)
+        try:
+            celery_client().send_task(
+                'tasks.batch_archive_urls', args=[valid_urls],
+                kwargs={'batch_id': batch_id, 'max_concurrent': max_concurrent}
+            )
+        except Exception as e:
+            app.logger.error(f"Error dispatching batch archive {batch_id}: {str(e)}", exc_info=True)
+            batch_progress.finish(batch_id, status='failed', error=str(e))
+            return jsonify({
+                'error': 'Batch archiving unavailable',
+                'details': str(e),
+                'batchId': batch_id
+            }), 503
+        app.logger.info(f"Submitted batch archive {batch_id} with {len(valid_urls)} URLs")
+
+        return jsonify({
+            'status': 'accepted',
+            'batchId': batch_id,
+            'total': total,
+            'invalidUrls': invalid_urls,
+            'progressUrl': f"/batch-archive/{batch_id}"
+        }), 202
+
+    except Exception as e:
+        app.logger.error(f"Error submitting batch archive: {str(e)}", exc_info=True)
+        return jsonify({
+            'error': 'Internal server error',
+            'details': str(e)
+        }), 500
+
+@app.route('/batch-archive/<batch_id>', methods=['GET'])
+def batch_archive_progress(batch_id):
+    """Poll a batch's progress; not rate limited so the frontend can poll it steadily."""
+    progress = batch_progress.get(batch_id)
+    if progress is None:
+        return jsonify({
+            'error': 'Unknown batch',
+            'details': f"No batch archive {batch_id} (batches are kept for a week)"
+        }), 404
+    return jsonify(format_batch_progress(progress))
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint."""
@@ -369,18 +699,35 @@ def health_check():
         'status': 'healthy',
         'timestamp': datetime.utcnow().isoformat(),
         'cache': {
-            'type': app.config['CACHE_TYPE'],
-            'timeout': app.config['CACHE_DEFAULT_TIMEOUT']
+            'type': metadata_cache.backend,
+            'timeout': CACHE_CONFIG['fresh_ttl'],
+            'stale_timeout': CACHE_CONFIG['stale_ttl'],
+            'stats': metadata_cache.stats
+        },
+        'single_flight': {
+            'metadata': metadata_cache.flight.stats,
+            'submit': submit_flight.stats
         },
         'rate_limit': {
             'window': RATE_LIMIT['window'],
-            'max_requests': RATE_LIMIT['max_requests']
+            'max_requests': RATE_LIMIT['max_requests'],
+            'backend': rate_limiter.backend
+        },
+        'batch': {
+            'max_urls': BATCH_CONFIG['max_urls'],
+            'max_workers': BATCH_CONFIG['max_workers']
+        },
+        'analyze': {
+            'max_urls': ANALYZE_CONFIG['max_urls'],
+            'max_workers': ANALYZE_CONFIG['max_workers']
+        },
+        'upstream': upstream_governor.snapshot(),
+        'http_pool': {
+            'pool_maxsize': http_client.POOL_CONFIG['pool_maxsize'],
+            'max_per_host': http_client.POOL_CONFIG['max_per_host'],
+            'host_limits': http_client.POOL_CONFIG['host_limits']
         }
     })
 
 if __name__ == '__main__':
-    # Create cache directory if it doesn't exist
-    if not os.path.exists('cache'):
-        os.makedirs('cache')
-        
     app.run(port=5000, debug=False) 
\ No newline at end of file
@@ -0,0 +1,403 @@
+"""Asyncio archive service.
+
+Serves the same /archive-metadata, /create-archive, /batch-metadata and
+/health routes as archive_server1.py, but every upstream fetch, retry
+backoff and cache access is non-blocking, so one process can keep thousands
+of archive.ph lookups in flight:
+
+    uvicorn async_server:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from urllib.parse import urlparse
+
+import aiohttp
+from fastapi import Depends, FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+
+import http_client
+from archive_parser import build_archive_metadata, capture_archive_id
+from batch_metadata import (
+    batch_response, cacheable_failure, describe_failure, group_archive_urls, new_batch_stats,
+    resolve_archive_ids_async, stream_batch_metadata_async, stream_media_type, upstream_error_details
+)
+from http_client import get_random_user_agent
+from metadata_cache import CACHE_CONFIG, AsyncMetadataCache, CachedFailure
+import upstream_governor
+from metrics import aiohttp_trace_config, instrument_fastapi
+from rate_limiter import RATE_LIMIT, AsyncRateLimiter, RateLimitExceeded
+from single_flight import AsyncSingleFlight
+from upstream_governor import UpstreamThrottled, UpstreamUnavailable, get_governor
+
+# Configure logging
+if not os.path.exists('logs'):
+    os.makedirs('logs')
+
+logger = logging.getLogger('async_server')
+logger.setLevel(logging.INFO)
+handler = RotatingFileHandler('logs/async_server.log', maxBytes=10000000, backupCount=5)
+handler.setFormatter(logging.Formatter(
+    '[%(asctime)s] %(levelname)s in %(module)s: %(message)s'
+))
+logger.addHandler(handler)
+
+# Upstream archive service; overridable so benchmarks can target a local stub
+ARCHIVE_CONFIG = {
+    'base_url': os.environ.get('ARCHIVE_BASE_URL', 'https://archive.ph').rstrip('/'),
+    'max_retries': 3,
+    'max_retry_wait': 5,  # longer upstream backoffs fail the request instead of holding it open
+    'fetch_timeout': 10,
+    'submit_timeout': 30
+}
+
+BATCH_CONFIG = {
+    'max_urls': 500,  # max URLs accepted per /batch-metadata request
+    'max_stream_urls': 5000,  # max URLs per streamed (NDJSON/SSE) /batch-metadata request
+    'max_concurrency': 64  # in-flight archive.ph fetches per batch
+}
+
+# In-process LRU in front of Redis when USE_REDIS=true, shared with archive_server1.
+# Concurrent misses and duplicate submissions share one archive.ph call.
+cache = AsyncMetadataCache(
+    CACHE_CONFIG['redis_url'],
+    flight=AsyncSingleFlight(CACHE_CONFIG['redis_url'], namespace='metadata')
+)
+submit_flight = AsyncSingleFlight(CACHE_CONFIG['redis_url'], namespace='submit', lease_ttl=120)
+
+# Sliding-window limits, shared with archive_server1 through Redis when USE_REDIS=true
+rate_limiter = AsyncRateLimiter(CACHE_CONFIG['redis_url'])
+
+# Per-host caps mirror http_client so both servers treat archive.ph alike
+_host_semaphores = {}
+
+def host_semaphore(url):
+    host = (urlparse(url).hostname or '').lower()
+    if host not in _host_semaphores:
+        _host_semaphores[host] = asyncio.Semaphore(http_client.host_limit(host))
+    return _host_semaphores[host]
+
+@asynccontextmanager
+async def lifespan(app):
+    connector = aiohttp.TCPConnector(
+        limit=http_client.POOL_CONFIG['pool_maxsize'] * http_client.POOL_CONFIG['pool_connections'],
+        limit_per_host=http_client.POOL_CONFIG['pool_maxsize'],
+        keepalive_timeout=60
+    )
+    app.state.http = aiohttp.ClientSession(connector=connector, trace_configs=[aiohttp_trace_config()])
+    try:
+        yield
+    finally:
+        await app.state.http.close()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=['*'],
+    allow_methods=['GET', 'POST', 'OPTIONS'],
+    allow_headers=['Content-Type', 'Authorization']
+)
+# Request latency histograms and /metrics
+instrument_fastapi(app, 'async_server')
+
+async def rate_limit(request: Request):
+    client = request.client.host if request.client else 'unknown'
+    allowed, retry_after = await rate_limiter.hit(client)
+    if not allowed:
+        raise RateLimitExceeded(retry_after)
+
+@app.exception_handler(RateLimitExceeded)
+async def rate_limit_exceeded(request: Request, e: RateLimitExceeded):
+    logger.warning(f"Rate limit exceeded for IP: {request.client.host if request.client else 'unknown'}")
+    return JSONResponse({
+        'error': 'Rate limit exceeded',
+        'retryAfter': e.retry_after
+    }, status_code=429, headers={'Retry-After': str(e.retry_after)})
+
+def browser_headers(**extra):
+    headers = {
+        'User-Agent': get_random_user_agent(),
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+        'Accept-Language': 'en-US,en;q=0.5',
+        'DNT': '1',
+    }
+    headers.update(extra)
+    return headers
+
+async def fetch_archive_metadata(session, archive_id):
+    """Fetch and parse an archive.ph page, returning its metadata dict."""
+    logger.info(f"Processing archive ID: {archive_id}")
+    archive_url = f"{ARCHIVE_CONFIG['base_url']}/{archive_id}"
+    timeout = aiohttp.ClientTimeout(total=ARCHIVE_CONFIG['fetch_timeout'])
+
+    governor = get_governor(archive_url)
+
+    for attempt in range(ARCHIVE_CONFIG['max_retries']):
+        await governor.acquire_async()  # fails fast while archive.ph is degraded
+        retry_after = None
+        try:
+            async with host_semaphore(archive_url):
+                async with session.get(archive_url, headers=browser_headers(), timeout=timeout) as response:
+                    html = await response.text(errors='replace')
+                    governor.observe(response.status, response.headers, html)
+                    response.raise_for_status()
+            break
+        except UpstreamThrottled as e:
+            error = e
+            retry_after = e.retry_after if e.hinted else None
+        except aiohttp.ClientResponseError as e:
+            if e.status < 500:
+                raise  # 404 and friends will not change on retry
+            error = e
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            governor.record_failure()
+            error = e
+
+        delay = governor.backoff(attempt, retry_after, ARCHIVE_CONFIG['max_retry_wait'])
+        if attempt == ARCHIVE_CONFIG['max_retries'] - 1 or delay is None:
+            raise error
+        await asyncio.sleep(delay)
+
+    # Parsing is CPU-bound; keep it off the event loop
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(None, build_archive_metadata, archive_id, html)
+
+    logger.info(f"Successfully processed {archive_id}: {json.dumps(result)}")
+    return result
+
+def failure_response(payload, status_code):
+    headers = {'Retry-After': str(payload['retryAfter'])} if 'retryAfter' in payload else None
+    return JSONResponse(payload, status_code=status_code, headers=headers)
+
+async def get_metadata(session, archive_id):
+    """Metadata for an archive ID from the shared cache, fetching on a miss."""
+    return await cache.get_or_fetch(
+        archive_id, lambda: fetch_archive_metadata(session, archive_id), cacheable_failure
+    )
+
+async def get_cached_metadata(session, archive_id):
+    """Cached metadata without waiting on archive.ph, or None on a miss."""
+    return await cache.get_cached(
+        archive_id, lambda: fetch_archive_metadata(session, archive_id), cacheable_failure
+    )
+
+@app.get('/archive-metadata/{archive_id}', dependencies=[Depends(rate_limit)])
+async def get_archive_metadata(archive_id: str, request: Request):
+    try:
+        return await get_metadata(request.app.state.http, archive_id)
+
+    except CachedFailure as e:
+        return failure_response(e.payload, e.status_code)
+
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error(f"Request error for {archive_id}: {upstream_error_details(e)}")
+        _, status_code, payload = describe_failure(e)
+        return failure_response(payload, status_code)
+
+    except Exception as e:
+        kind, status_code, payload = describe_failure(e)
+        if kind:
+            logger.warning(f"Could not resolve {archive_id}: {str(e)}")
+        else:
+            logger.error(f"Error processing {archive_id}: {str(e)}", exc_info=True)
+        return failure_response(payload, status_code)
+
+@app.post('/batch-metadata', dependencies=[Depends(rate_limit)])
+async def batch_metadata(request: Request):
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        if not isinstance(data, dict) or not isinstance(data.get('urls'), list):
+            return JSONResponse({
+                'error': 'Missing urls parameter',
+                'details': 'Please provide a list of archive URLs'
+            }, status_code=400)
+
+        # Streaming clients get each URL as it resolves, so they may send larger batches
+        media_type = stream_media_type(request.headers.get('accept'))
+        max_urls = BATCH_CONFIG['max_stream_urls'] if media_type else BATCH_CONFIG['max_urls']
+        urls = [u.strip() for u in data['urls'] if isinstance(u, str) and u.strip()]
+        if len(urls) > max_urls:
+            return JSONResponse({
+                'error': 'Too many URLs',
+                'details': f"A batch may contain at most {max_urls} URLs"
+            }, status_code=400)
+
+        urls_by_id, invalid_urls = group_archive_urls(urls)
+        session = request.app.state.http
+        stats = new_batch_stats(urls, urls_by_id)
+        outcomes = resolve_archive_ids_async(
+            urls_by_id, stats,
+            lambda archive_id: get_cached_metadata(session, archive_id),
+            lambda archive_id: get_metadata(session, archive_id),
+            BATCH_CONFIG['max_concurrency']
+        )
+
+        if media_type:
+            return StreamingResponse(
+                stream_batch_metadata_async(urls_by_id, invalid_urls, stats, outcomes, media_type),
+                media_type=media_type,
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+
+        return batch_response(urls_by_id, invalid_urls, stats, [outcome async for outcome in outcomes])
+
+    except Exception as e:
+        logger.error(f"Error processing batch: {str(e)}", exc_info=True)
+        return JSONResponse({
+            'error': 'Internal server error',
+            'details': str(e)
+        }, status_code=500)
+
+async def submit_archive(session, url):
+    """Submit a URL to archive.ph, returning the archive URL or None."""
+    submit_url = f"{ARCHIVE_CONFIG['base_url']}/submit/"
+    headers = browser_headers(**{'Content-Type': 'application/x-www-form-urlencoded'})
+    timeout = aiohttp.ClientTimeout(total=ARCHIVE_CONFIG['submit_timeout'])
+
+    governor = get_governor(submit_url)
+
+    for attempt in range(ARCHIVE_CONFIG['max_retries']):
+        await governor.acquire_async()
+        error = retry_after = None
+        try:
+            async with host_semaphore(submit_url):
+                async with session.post(submit_url, data={'url': url}, headers=headers,
+                                        timeout=timeout, allow_redirects=True) as response:
+                    body = await response.read()
+                    governor.observe(response.status, response.headers, body)
+                    response.raise_for_status()
+                    final_url = str(response.url)
+
+            # Check if we were redirected to a capture on the configured archive
+            if capture_archive_id(final_url, ARCHIVE_CONFIG['base_url']):
+                return final_url
+        except UpstreamThrottled as e:
+            error = e
+            retry_after = e.retry_after if e.hinted else None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if not isinstance(e, aiohttp.ClientResponseError):
+                governor.record_failure()
+            error = e
+
+        # Not archived yet, or a transient failure: back off before resubmitting
+        delay = governor.backoff(attempt, retry_after, ARCHIVE_CONFIG['max_retry_wait'])
+        if attempt == ARCHIVE_CONFIG['max_retries'] - 1 or delay is None:
+            if error is not None:
+                raise error
+            break
+        await asyncio.sleep(delay)
+
+    return None
+
+@app.post('/create-archive', dependencies=[Depends(rate_limit)])
+async def create_archive(request: Request):
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        if not isinstance(data, dict) or 'url' not in data:
+            return JSONResponse({
+                'error': 'Missing URL parameter',
+                'details': 'Please provide a URL to archive'
+            }, status_code=400)
+
+        url = data['url']
+        logger.info(f"Creating archive for URL: {url}")
+
+        # Validate URL
+        try:
+            parsed = urlparse(url)
+            if not all([parsed.scheme, parsed.netloc]):
+                raise ValueError("Invalid URL format")
+        except Exception as e:
+            return JSONResponse({
+                'error': 'Invalid URL',
+                'details': str(e)
+            }, status_code=400)
+
+        archive_url = await submit_flight.do(url, lambda: submit_archive(request.app.state.http, url))
+        if not archive_url:
+            return JSONResponse({
+                'error': 'Failed to create archive',
+                'details': 'Could not get archive URL after submission'
+            }, status_code=500)
+
+        result = {
+            'status': 'success',
+            'archiveUrl': archive_url,
+            'archiveId': archive_url.split('/')[-1],
+            'originalUrl': url,
+            'timestamp': datetime.utcnow().isoformat()
+        }
+
+        logger.info(f"Successfully created archive: {json.dumps(result)}")
+        return result
+
+    except UpstreamUnavailable as e:
+        logger.warning(f"Archive service unavailable while creating archive: {str(e)}")
+        return failure_response({
+            'error': 'Archive service temporarily unavailable',
+            'details': str(e),
+            'retryAfter': e.retry_after
+        }, 503)
+
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error(f"Request error while creating archive: {upstream_error_details(e)}")
+        return JSONResponse({
+            'error': 'Failed to create archive',
+            'details': upstream_error_details(e)
+        }, status_code=503)
+
+    except Exception as e:
+        logger.error(f"Error creating archive: {str(e)}", exc_info=True)
+        return JSONResponse({
+            'error': 'Internal server error',
+            'details': str(e)
+        }, status_code=500)
+
+@app.get('/health')
+async def health_check():
+    """Health check endpoint."""
+    return {
+        'status': 'healthy',
+        'timestamp': datetime.utcnow().isoformat(),
+        'cache': {
+            'type': cache.backend,
+            'timeout': CACHE_CONFIG['fresh_ttl'],
+            'stale_timeout': CACHE_CONFIG['stale_ttl'],
+            'stats': cache.stats
+        },
+        'single_flight': {
+            'metadata': cache.flight.stats,
+            'submit': submit_flight.stats
+        },
+        'rate_limit': {
+            'window': RATE_LIMIT['window'],
+            'max_requests': RATE_LIMIT['max_requests'],
+            'backend': rate_limiter.backend
+        },
+        'batch': {
+            'max_urls': BATCH_CONFIG['max_urls'],
+            'max_concurrency': BATCH_CONFIG['max_concurrency']
+        },
+        'upstream': upstream_governor.snapshot(),
+        'http_pool': {
+            'pool_maxsize': http_client.POOL_CONFIG['pool_maxsize'],
+            'max_per_host': http_client.POOL_CONFIG['max_per_host'],
+            'host_limits': http_client.POOL_CONFIG['host_limits']
+        }
+    }
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(app, host='0.0.0.0', port=5000)
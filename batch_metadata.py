@@ -0,0 +1,312 @@
+"""/batch-metadata logic shared by archive_server1 and async_server.
+
+Both servers group the submitted URLs by archive ID and resolve each ID
+once: cache hits first, then misses as their fetches complete, with a
+bounded number in flight. The results go out as one JSON body or as a
+stream of per-URL records. Only the fetching differs: archive_server1
+uses a thread pool, async_server uses tasks on the event loop.
+"""
+import asyncio
+import json
+import logging
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import requests
+
+from archive_parser import OriginalUrlNotFound, extract_archive_id
+from metadata_cache import CachedFailure
+from upstream_governor import UpstreamUnavailable
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover - only async_server needs aiohttp
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+# Network failures from either server's HTTP client
+UPSTREAM_ERRORS = (requests.RequestException, asyncio.TimeoutError) + \
+    ((aiohttp.ClientError,) if aiohttp is not None else ())
+
+# Media types /batch-metadata streams per-URL results in, instead of one JSON body
+STREAM_MEDIA_TYPES = ('application/x-ndjson', 'text/event-stream')
+
+def format_batch_entry(url, archive_id, metadata=None, error=None):
+    """Shape a per-URL /batch-metadata result for the frontend."""
+    entry = {
+        'archive_url': url,
+        'archive_id': archive_id,
+        'original_url': None,
+        'archive_date': None,
+        'tweet_date': None,
+        'tweet_id': None,
+    }
+    if metadata:
+        entry.update({
+            'original_url': metadata['originalUrl'],
+            'archive_date': metadata['archiveDate'],
+            'tweet_date': metadata['tweetDate'],
+            'tweet_id': metadata['tweetId'],
+        })
+    if error:
+        entry['error'] = error
+    return entry
+
+def stream_media_type(accept):
+    """The streaming media type an Accept header asks for, or None for plain JSON."""
+    accept = (accept or '').lower()
+    for media_type in STREAM_MEDIA_TYPES:
+        if media_type in accept:
+            return media_type
+    return None
+
+def format_stream_event(media_type, event, data):
+    """One /batch-metadata stream record: an NDJSON line or an SSE event.
+
+    NDJSON lines carry the event name in ``type``; SSE uses its own
+    ``event:`` field.
+    """
+    if media_type == 'text/event-stream':
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps({'type': event, **data}) + '\n'
+
+def upstream_error_details(error):
+    # aiohttp timeouts stringify to ''
+    return str(error) or error.__class__.__name__
+
+def _upstream_status(error):
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code
+    if aiohttp is not None and isinstance(error, aiohttp.ClientResponseError):
+        return error.status
+    return None
+
+def describe_failure(error):
+    """Map a metadata fetch failure to (cache kind, HTTP status, response body).
+
+    The kind is 'not_found' for definitive misses, 'error' for transient
+    upstream failures and None for failures that must not be cached.
+    """
+    if isinstance(error, CachedFailure):
+        return error.kind, error.status_code, error.payload
+    if _upstream_status(error) in (404, 410):
+        return 'not_found', 404, {
+            'error': 'Archive not found',
+            'details': upstream_error_details(error)
+        }
+    if isinstance(error, UpstreamUnavailable):
+        return 'error', 503, {
+            'error': 'Archive service temporarily unavailable',
+            'details': str(error),
+            'retryAfter': error.retry_after
+        }
+    if isinstance(error, UPSTREAM_ERRORS):
+        return 'error', 503, {
+            'error': 'Failed to fetch archive page',
+            'details': upstream_error_details(error)
+        }
+    if isinstance(error, OriginalUrlNotFound):
+        return 'not_found', 404, {
+            'error': 'Could not extract original URL',
+            'details': str(error)
+        }
+    return None, 500, {
+        'error': 'Internal server error',
+        'details': str(error)
+    }
+
+def cacheable_failure(error):
+    kind, status_code, payload = describe_failure(error)
+    return (kind, status_code, payload) if kind else None
+
+def group_archive_urls(urls):
+    """``({archive_id: [url, ...]}, invalid_urls)`` so each ID is resolved once."""
+    urls_by_id = {}
+    invalid_urls = []
+    for url in urls:
+        archive_id = extract_archive_id(url)
+        if archive_id:
+            urls_by_id.setdefault(archive_id, []).append(url)
+        else:
+            invalid_urls.append(url)
+    return urls_by_id, invalid_urls
+
+def new_batch_stats(urls, urls_by_id):
+    return {'total': len(urls), 'unique': len(urls_by_id), 'cached': 0, 'fetched': 0, 'failed': 0}
+
+def _cached_outcome(archive_id, cached, failure, stats):
+    """``(archive_id, metadata, error)`` from a cache lookup, or None on a miss."""
+    if failure is not None:
+        stats['failed'] += 1
+        return archive_id, None, failure.payload['error']
+    if cached is None:
+        return None
+    stats['cached'] += 1
+    return archive_id, cached, None
+
+def _fetched_outcome(archive_id, fetch_result, stats):
+    try:
+        metadata = fetch_result()
+    except Exception as e:
+        logger.error(f"Error processing {archive_id}: {upstream_error_details(e)}")
+        stats['failed'] += 1
+        return archive_id, None, describe_failure(e)[2]['error']
+    stats['fetched'] += 1
+    return archive_id, metadata, None
+
+def resolve_archive_ids(archive_ids, stats, get_cached, get_metadata, executor, max_in_flight):
+    """Yield ``(archive_id, metadata, error)`` for each ID as soon as it resolves.
+
+    Cache hits come first, then misses as their fetches complete. At most
+    ``max_in_flight`` fetches per batch are queued on ``executor``, so a
+    large batch neither floods a shared pool ahead of other requests nor
+    holds every pending future at once. ``stats`` counts cached, fetched
+    and failed IDs as they are yielded.
+    """
+    misses = []
+    for archive_id in archive_ids:
+        try:
+            cached, failure = get_cached(archive_id), None
+        except CachedFailure as e:
+            cached, failure = None, e
+        outcome = _cached_outcome(archive_id, cached, failure, stats)
+        if outcome is None:
+            misses.append(archive_id)
+        else:
+            yield outcome
+
+    pending = iter(misses)
+    in_flight = {}
+    try:
+        while True:
+            # Top up the window from the remaining misses
+            for archive_id in pending:
+                in_flight[executor.submit(get_metadata, archive_id)] = archive_id
+                if len(in_flight) >= max_in_flight:
+                    break
+            if not in_flight:
+                return
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield _fetched_outcome(in_flight.pop(future), future.result, stats)
+    finally:
+        # The client went away mid-stream: drop fetches that have not started
+        for future in in_flight:
+            future.cancel()
+
+async def resolve_archive_ids_async(archive_ids, stats, get_cached, get_metadata, max_in_flight):
+    """``resolve_archive_ids`` for coroutine ``get_cached``/``get_metadata``."""
+    misses = []
+    for archive_id in archive_ids:
+        try:
+            cached, failure = await get_cached(archive_id), None
+        except CachedFailure as e:
+            cached, failure = None, e
+        outcome = _cached_outcome(archive_id, cached, failure, stats)
+        if outcome is None:
+            misses.append(archive_id)
+        else:
+            yield outcome
+
+    pending = iter(misses)
+    in_flight = {}
+    try:
+        while True:
+            for archive_id in pending:
+                in_flight[asyncio.ensure_future(get_metadata(archive_id))] = archive_id
+                if len(in_flight) >= max_in_flight:
+                    break
+            if not in_flight:
+                return
+            done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield _fetched_outcome(in_flight.pop(task), task.result, stats)
+    finally:
+        # The client went away mid-stream: stop its outstanding fetches
+        for task in in_flight:
+            task.cancel()
+
+def _invalid_records(invalid_urls, stats, media_type):
+    for url in invalid_urls:
+        stats['failed'] += 1
+        yield format_stream_event(media_type, 'result', format_batch_entry(url, None, error='Not an archive URL'))
+
+def _result_records(urls_by_id, outcome, media_type):
+    archive_id, metadata, error = outcome
+    for url in urls_by_id[archive_id]:
+        yield format_stream_event(
+            media_type, 'result', format_batch_entry(url, archive_id, metadata=metadata, error=error)
+        )
+
+def _error_record(error, media_type):
+    # Headers are already sent; report the failure in-band
+    logger.error(f"Error streaming batch: {str(error)}", exc_info=True)
+    return format_stream_event(media_type, 'error', {'error': 'Internal server error', 'details': str(error)})
+
+def _stats_record(stats, media_type):
+    logger.info(
+        f"Streamed batch of {stats['total']} URLs: {stats['unique']} unique IDs, "
+        f"{stats['cached']} cached, {stats['failed']} failed"
+    )
+    return format_stream_event(media_type, 'stats', {'stats': stats})
+
+def stream_batch_metadata(urls_by_id, invalid_urls, stats, outcomes, media_type):
+    """Per-URL ``result`` records as ``outcomes`` resolve, then a ``stats`` record."""
+    try:
+        yield from _invalid_records(invalid_urls, stats, media_type)
+        for outcome in outcomes:
+            yield from _result_records(urls_by_id, outcome, media_type)
+    except Exception as e:
+        yield _error_record(e, media_type)
+        return
+    yield _stats_record(stats, media_type)
+
+async def stream_batch_metadata_async(urls_by_id, invalid_urls, stats, outcomes, media_type):
+    """``stream_batch_metadata`` over an async iterator of outcomes."""
+    try:
+        for record in _invalid_records(invalid_urls, stats, media_type):
+            yield record
+        async for outcome in outcomes:
+            for record in _result_records(urls_by_id, outcome, media_type):
+                yield record
+    except Exception as e:
+        yield _error_record(e, media_type)
+        return
+    yield _stats_record(stats, media_type)
+
+def batch_response(urls_by_id, invalid_urls, stats, outcomes):
+    """The JSON /batch-metadata body once every outcome is in, in submission order."""
+    metadata_by_id = {}
+    errors_by_id = {}
+    for archive_id, metadata, error in outcomes:
+        if error:
+            errors_by_id[archive_id] = error
+        else:
+            metadata_by_id[archive_id] = metadata
+
+    results = {}
+    archived_urls = []
+    for archive_id, id_urls in urls_by_id.items():
+        for url in id_urls:
+            entry = format_batch_entry(
+                url, archive_id,
+                metadata=metadata_by_id.get(archive_id),
+                error=errors_by_id.get(archive_id)
+            )
+            results[url] = entry
+            archived_urls.append(entry)
+    for url in invalid_urls:
+        entry = format_batch_entry(url, None, error='Not an archive URL')
+        results[url] = entry
+        archived_urls.append(entry)
+    stats['failed'] += len(invalid_urls)
+
+    logger.info(
+        f"Batch of {stats['total']} URLs: {stats['unique']} unique IDs, "
+        f"{stats['cached']} cached, {len(errors_by_id)} failed"
+    )
+    return {
+        'results': results,
+        'archived_urls': archived_urls,
+        'stats': stats
+    }
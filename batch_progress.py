@@ -0,0 +1,120 @@
+"""Progress counters for batch archive jobs.
+
+The web server creates a batch's record when it is submitted. Celery
+workers then count each URL's outcome with HINCRBY as they finish it. So
+``/batch-archive/<batch_id>`` reads one Redis hash, however large the batch
+is and however many workers share it.
+
+Without Redis (or while it is unreachable) the counters are kept per
+process. That only helps when the server and the worker are one process, as
+in development.
+"""
+import logging
+import threading
+import time
+
+from metadata_cache import CACHE_CONFIG, RedisAvailability
+
+logger = logging.getLogger(__name__)
+
+BATCH_PROGRESS_CONFIG = {
+    'key_prefix': 'batch-progress:',
+    'ttl': 7 * 86400  # records outlive their batch by a week
+}
+
+# Outcomes a finished URL is counted under
+OUTCOMES = ('archived', 'duplicate', 'failed')
+COUNTERS = ('total', 'already_archived', 'submitted') + OUTCOMES
+
+class BatchProgress:
+    def __init__(self, redis_url=None):
+        self.redis = None
+        if redis_url:
+            import redis
+
+            self.errors = (redis.RedisError,)
+            self.redis = redis.Redis.from_url(
+                redis_url,
+                socket_timeout=CACHE_CONFIG['redis_timeout'],
+                socket_connect_timeout=CACHE_CONFIG['redis_timeout'],
+                decode_responses=True
+            )
+            self.status = RedisAvailability()
+        self._local = {}
+        self._lock = threading.Lock()
+
+    def _key(self, batch_id):
+        return BATCH_PROGRESS_CONFIG['key_prefix'] + batch_id
+
+    def _redis_ready(self):
+        return self.redis is not None and self.status.available()
+
+    def _write(self, batch_id, fields=None, increments=None):
+        if self._redis_ready():
+            try:
+                pipe = self.redis.pipeline()
+                if fields:
+                    pipe.hset(self._key(batch_id), mapping=fields)
+                for name, amount in (increments or {}).items():
+                    pipe.hincrby(self._key(batch_id), name, amount)
+                pipe.expire(self._key(batch_id), BATCH_PROGRESS_CONFIG['ttl'])
+                pipe.execute()
+                return
+            except self.errors as e:
+                self.status.failed(e)
+        with self._lock:
+            record = self._local.setdefault(batch_id, {})
+            record.update(fields or {})
+            for name, amount in (increments or {}).items():
+                record[name] = int(record.get(name, 0)) + amount
+
+    def start(self, batch_id, total):
+        """Create the record for a batch of ``total`` unique URLs awaiting a worker."""
+        fields = {name: 0 for name in COUNTERS}
+        fields.update(total=total, status='queued', created_at=time.time())
+        self._write(batch_id, fields)
+
+    def running(self, batch_id, already_archived, submitted):
+        """Record how many URLs were already archived and how many were sent for capture."""
+        self._write(batch_id, {
+            'status': 'running' if submitted else 'complete',
+            'already_archived': already_archived,
+            'submitted': submitted,
+            'updated_at': time.time()
+        })
+
+    def record(self, batch_id, outcome, count=1):
+        """Count ``count`` URLs finished with ``outcome`` (one of OUTCOMES)."""
+        self._write(batch_id, {'updated_at': time.time()}, {outcome: count})
+
+    def finish(self, batch_id, status='complete', error=None):
+        """Close the batch as 'complete', or as 'failed' with the reason in ``error``."""
+        fields = {'status': status, 'updated_at': time.time()}
+        if error:
+            fields['error'] = error
+        self._write(batch_id, fields)
+
+    def get(self, batch_id):
+        """The batch's counters with ``done`` and ``percent``, or None if unknown or expired."""
+        record = None
+        if self._redis_ready():
+            try:
+                record = self.redis.hgetall(self._key(batch_id)) or None
+            except self.errors as e:
+                self.status.failed(e)
+        if record is None:
+            with self._lock:
+                record = dict(self._local[batch_id]) if batch_id in self._local else None
+        if record is None:
+            return None
+        progress = {name: int(record.get(name, 0)) for name in COUNTERS}
+        progress['batch_id'] = batch_id
+        progress['status'] = record.get('status', 'queued')
+        progress['done'] = progress['already_archived'] + sum(progress[name] for name in OUTCOMES)
+        progress['percent'] = round(100.0 * progress['done'] / progress['total'], 1) if progress['total'] else 100.0
+        for name in ('created_at', 'updated_at'):
+            if record.get(name):
+                progress[name] = float(record[name])
+        if record.get('error'):
+            progress['error'] = record['error']
+        return progress
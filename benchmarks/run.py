@@ -0,0 +1,339 @@
+"""Benchmarks for the metadata, parsing and ML hot paths.
+
+Reports p50/p99 latency and throughput for each benchmark and compares the
+p50 against a stored baseline so regressions show up as numbers:
+
+    python benchmarks/run.py                      # run all, compare with baseline.json
+    python benchmarks/run.py --filter parser      # only benchmarks whose name matches
+    python benchmarks/run.py --save-baseline      # record the current numbers
+    python benchmarks/run.py --fail-on-regression # exit 1 when p50 regresses
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from stub_server import FIXTURES_DIR, load_fixture, pad_page, start_stub_server
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+
+PARSER_FIXTURES = [
+    'archive_ph_x_status.html',
+    'archive_ph_twitter_legacy.html',
+    'archive_ph_non_twitter.html',
+    'x_com_status.html',
+]
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+def measure(fn, min_iterations=5, max_seconds=2.0, batch_size=1):
+    """Time ``fn`` for at least ``min_iterations`` calls and ``max_seconds``.
+
+    ``batch_size`` is the number of items handled per call, so throughput is
+    reported in items per second.
+    """
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < min_iterations or time.perf_counter() - started < max_seconds:
+        t0 = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - t0)
+    total = sum(timings)
+    timings.sort()
+    return {
+        'iterations': len(timings),
+        'p50_ms': percentile(timings, 0.50) * 1000,
+        'p99_ms': percentile(timings, 0.99) * 1000,
+        'ops_per_sec': (len(timings) * batch_size) / total if total else 0.0,
+    }
+
+def parser_benchmarks(args):
+    from archive_parser import ArchivePhParser, html_to_text
+
+    modes = ['bs4', 'lxml']
+    for fixture in PARSER_FIXTURES:
+        html = load_fixture(fixture)
+        pages = [('', html)]
+        if args.page_kb:
+            pages.append((f'+{args.page_kb}kb', pad_page(html, args.page_kb)))
+        for suffix, page in pages:
+            name = fixture.rsplit('.', 1)[0] + suffix
+            for mode in modes:
+                yield f'parser.{mode}.parse[{name}]', lambda p=page, m=mode: ArchivePhParser(p, mode=m), {}
+            yield f'parser.html_to_text[{name}]', lambda p=page: html_to_text(p), {}
+        parsers = {mode: ArchivePhParser(html, mode=mode) for mode in modes}
+        for mode, parser in parsers.items():
+            for method in ('get_original_url', 'get_archive_date', 'get_tweet_date'):
+                yield (f'parser.{mode}.{method}[{fixture.rsplit(".", 1)[0]}]',
+                       getattr(parser, method), {'min_iterations': 1000, 'max_seconds': 0.5})
+
+def url_benchmarks(args):
+    from archive_parser import extract_tweet_id, parse_twitter_date
+    from url_classifier import classify_text, classify_url, classify_urls
+
+    with open(os.path.join(FIXTURES_DIR, 'urls.txt'), encoding='utf-8') as f:
+        urls = [line.strip() for line in f if line.strip()]
+    dates = [
+        '2021-10-18T16:12:09.000Z',
+        '2023-06-14T09:12:41Z',
+        'Tue Mar 21 20:50:14 +0000 2006',
+        '2019-03-21 18:50:14 +0000',
+        '14 Jun 2023 09:12:41 UTC',  # unparseable: walks every format
+    ]
+    fast = {'min_iterations': 200, 'max_seconds': 1.0}
+    yield 'urls.extract_tweet_id', lambda: [extract_tweet_id(u) for u in urls], dict(fast, batch_size=len(urls))
+    yield 'urls.parse_twitter_date', lambda: [parse_twitter_date(d) for d in dates], dict(fast, batch_size=len(dates))
+
+    # A pasted blob of 10,000 distinct URLs; the uncached run clears the LRU so every URL is parsed
+    blob_urls = [f'{url}{"&" if "?" in url else "?"}n={i}' for i in range(10000 // len(urls) + 1)
+                 for url in urls][:10000]
+    blob = ' '.join(f'{url},' if i % 7 == 0 else url for i, url in enumerate(blob_urls))
+
+    def classify_uncached():
+        classify_url.cache_clear()
+        return classify_text(blob)
+
+    slow = {'min_iterations': 5, 'max_seconds': 2.0}
+    yield 'urls.classify_urls.cached', lambda: classify_urls(urls), dict(fast, batch_size=len(urls))
+    yield 'urls.classify_text.uncached', classify_uncached, dict(slow, batch_size=len(blob_urls))
+    yield 'urls.classify_text.cached', lambda: classify_text(blob), dict(slow, batch_size=len(blob_urls))
+
+def ratelimit_benchmarks(args):
+    from rate_limiter import RATE_LIMIT, RateLimiter
+
+    limiter = RateLimiter()
+    clients = [f'10.0.{i // 256}.{i % 256}' for i in range(5000)]
+    counter = iter(range(10 ** 9))
+    RATE_LIMIT['max_requests'] = 10 ** 9
+    batch = 1000
+
+    def hits():
+        start = next(counter) * batch
+        for i in range(start, start + batch):
+            limiter.hit(clients[i % len(clients)])
+
+    yield 'ratelimit.local.hit[5000_clients]', hits, {'batch_size': batch}
+
+def ml_benchmarks(args):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import StaticPool
+    from models import Base
+    from archive_parser import html_to_text
+    from ml_analyzer import MLAnalyzer
+
+    engine = create_engine('sqlite://', poolclass=StaticPool,
+                           connect_args={'check_same_thread': False})
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    analyzer = MLAnalyzer(session)
+
+    with open(os.path.join(FIXTURES_DIR, 'urls.txt'), encoding='utf-8') as f:
+        urls = [line.strip() for line in f if line.strip()]
+    contents = [html_to_text(load_fixture(name)) for name in PARSER_FIXTURES]
+    samples = [(url, contents[i % len(contents)]) for i, url in enumerate(urls)]
+    counter = iter(range(10 ** 9))
+
+    def analyze():
+        url, content = samples[next(counter) % len(samples)]
+        analyzer.analyze_url(url, content)
+
+    yield 'ml.extract_features', lambda: [analyzer.extract_features(u, c) for u, c in samples], {'batch_size': len(samples)}
+    yield 'ml.compute_embedding', lambda: [analyzer.compute_embedding(c) for c in contents], {'batch_size': len(contents)}
+    pages = [contents[i % len(contents)] for i in range(1000)]
+    yield 'ml.compute_embeddings[batch_1000]', lambda: analyzer.compute_embeddings(pages), {'batch_size': len(pages)}
+
+    from vector_type import decode_vector, encode_vector
+    embeddings = analyzer.compute_embeddings(contents)
+    packed = [encode_vector(vector) for vector in embeddings]
+    yield 'ml.vector.encode', lambda: [encode_vector(vector) for vector in embeddings], {'batch_size': len(embeddings)}
+    yield 'ml.vector.decode', lambda: [decode_vector(data) for data in packed], {'batch_size': len(packed)}
+
+    from near_duplicates import minhash
+    yield 'ml.minhash', lambda: [minhash(c) for c in contents], {'batch_size': len(contents)}
+    large_page = html_to_text(pad_page(load_fixture(PARSER_FIXTURES[0]), args.page_kb)) if args.page_kb else None
+    if large_page:
+        yield f'ml.minhash[+{args.page_kb}kb]', lambda: minhash(large_page), {}
+    yield 'ml.analyze_url', analyze, {'min_iterations': 50}
+
+    batch = samples[:100]
+    yield 'ml.analyze_urls[batch_100]', lambda: analyzer.analyze_urls(batch), {'batch_size': len(batch), 'min_iterations': 10}
+    yield 'ml.update_feature_importance', analyzer.update_feature_importance, {}
+
+    # Pattern similarity: synthetic pattern embeddings around a few hundred topics
+    import numpy as np
+    from pattern_index import PatternIndex
+
+    rng = np.random.default_rng(0)
+    dim = analyzer.embedder.n_features
+    topics = rng.standard_normal((500, dim), dtype=np.float32)
+    queries = topics[rng.integers(0, len(topics), 256)] + rng.standard_normal((256, dim), dtype=np.float32)
+    for mode, size in (('exact', 2000), ('approx', 100000)):
+        index = PatternIndex(dim, mode='exact' if mode == 'exact' else 'auto')
+        vectors = topics[rng.integers(0, len(topics), size)] + rng.standard_normal((size, dim), dtype=np.float32)
+        index.add_many(range(size), vectors)
+        del vectors
+        query_iter = iter(range(10 ** 9))
+        yield (f'ml.pattern_index.search[{mode}_{size // 1000}k]',
+               lambda index=index, query_iter=query_iter: index.search(queries[next(query_iter) % len(queries)]),
+               {})
+
+def endpoint_benchmarks(args):
+    import logging
+
+    stub, base_url = start_stub_server(page_kb=args.page_kb, latency_ms=args.latency_ms)
+    os.environ['ARCHIVE_BASE_URL'] = base_url
+    # archive_server1 writes logs/ and cache/ relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix='archive-bench-'))
+    import archive_server1 as server
+    from upstream_governor import GOVERNOR_CONFIG
+
+    # Measure the governor's bookkeeping, not its pacing of the local stub
+    GOVERNOR_CONFIG['initial_rate'] = GOVERNOR_CONFIG['max_rate'] = 10 ** 9
+
+    server.app.logger.setLevel(logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)
+    server.RATE_LIMIT['max_requests'] = 10 ** 9
+    client = server.app.test_client()
+    counter = iter(range(10 ** 9))
+
+    def uncached():
+        response = client.get(f'/archive-metadata/bench{next(counter)}')
+        assert response.status_code == 200, response.status_code
+
+    def cached():
+        response = client.get('/archive-metadata/benchcached')
+        assert response.status_code == 200, response.status_code
+
+    batch_size = 50
+
+    def batch():
+        start = next(counter) * batch_size
+        urls = [f'https://archive.ph/batch{start + i}' for i in range(batch_size)]
+        response = client.post('/batch-metadata', json={'urls': urls})
+        assert response.status_code == 200, response.status_code
+
+    def batch_stream():
+        start = next(counter) * batch_size
+        urls = [f'https://archive.ph/stream{start + i}' for i in range(batch_size)]
+        response = client.post('/batch-metadata', json={'urls': urls}, headers={'Accept': 'application/x-ndjson'})
+        assert response.status_code == 200, response.status_code
+        assert response.get_data().count(b'\n') == batch_size + 1
+
+    yield 'endpoint.archive_metadata.uncached', uncached, {}
+    yield 'endpoint.archive_metadata.cached', cached, {}
+    yield f'endpoint.batch_metadata.{batch_size}_uncached', batch, {'min_iterations': 5, 'batch_size': batch_size}
+    yield f'endpoint.batch_metadata.{batch_size}_streamed', batch_stream, {'min_iterations': 5, 'batch_size': batch_size}
+
+SUITES = [
+    ('parser', parser_benchmarks),
+    ('urls', url_benchmarks),
+    ('ratelimit', ratelimit_benchmarks),
+    ('ml', ml_benchmarks),
+    ('endpoint', endpoint_benchmarks),
+]
+
+def run_suites(args):
+    results = {}
+    for suite_name, suite in SUITES:
+        if args.suite and suite_name not in args.suite:
+            continue
+        try:
+            for name, fn, options in suite(args):
+                if args.filter and args.filter not in name:
+                    continue
+                options = dict(options)
+                options.setdefault('max_seconds', args.max_seconds)
+                results[name] = measure(fn, **options)
+                print_result(name, results[name])
+        except ImportError as e:
+            print(f"Skipping {suite_name} benchmarks: {e}")
+    return results
+
+def print_result(name, result):
+    line = (f"{name:<58} p50 {result['p50_ms']:>10.3f} ms  p99 {result['p99_ms']:>10.3f} ms  "
+            f"{result['ops_per_sec']:>12.1f} ops/s")
+    print(line, flush=True)
+
+def compare(results, baseline, threshold):
+    """Print p50 changes against the baseline and return regressed names."""
+    regressions = []
+    print(f"\nComparison with baseline ({baseline.get('meta', {}).get('recorded_at', 'unknown date')}):")
+    for name, result in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous or not previous.get('p50_ms'):
+            print(f"  {name:<58} new")
+            continue
+        ratio = result['p50_ms'] / previous['p50_ms']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            flag = '  improved'
+        print(f"  {name:<58} {previous['p50_ms']:>10.3f} -> {result['p50_ms']:>10.3f} ms ({(ratio - 1) * 100:+.1f}%){flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the hot-path benchmarks')
+    parser.add_argument('--suite', action='append', choices=[name for name, _ in SUITES],
+                        help='run only this suite (repeatable)')
+    parser.add_argument('--filter', help='only run benchmarks whose name contains this string')
+    parser.add_argument('--page-kb', type=int, default=512,
+                        help='also benchmark fixtures padded to this size (0 disables)')
+    parser.add_argument('--latency-ms', type=int, default=0, help='simulated archive.ph latency for endpoint benchmarks')
+    parser.add_argument('--max-seconds', type=float, default=2.0, help='time budget per benchmark')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline JSON to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='write the results to the baseline file')
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative p50 change reported as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+    # The endpoint suite changes directory, so pin the file arguments first
+    args.baseline = os.path.abspath(args.baseline)
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    results = run_suites(args)
+    report = {
+        'meta': {
+            'recorded_at': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'page_kb': args.page_kb,
+            'latency_ms': args.latency_ms,
+        },
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    regressions = []
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"\nBaseline written to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Local stand-in for archive.ph serving the recorded fixture pages.
+
+Every ``GET /<archive_id>`` returns a fixture chosen by the ID prefix, so any
+number of distinct (uncached) IDs can be requested:
+
+    legacy*  -> archive_ph_twitter_legacy.html
+    nontw*   -> archive_ph_non_twitter.html
+    missing* -> 404
+    other    -> archive_ph_x_status.html
+
+Run standalone and point the server at it with ARCHIVE_BASE_URL:
+
+    python benchmarks/stub_server.py --port 8081 --latency-ms 50
+    ARCHIVE_BASE_URL=http://127.0.0.1:8081 python archive_server1.py
+"""
+import argparse
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+FIXTURE_PREFIXES = [
+    ('legacy', 'archive_ph_twitter_legacy.html'),
+    ('nontw', 'archive_ph_non_twitter.html'),
+]
+DEFAULT_FIXTURE = 'archive_ph_x_status.html'
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), encoding='utf-8') as f:
+        return f.read()
+
+def pad_page(html, page_kb):
+    """Grow a fixture to roughly ``page_kb`` KB with archived-page style markup."""
+    if not page_kb:
+        return html
+    row = ('<div class="css-175oi2r r-1igl3o0"><a href="https://archive.ph/o/FexMt/https://x.com/explore" '
+           'role="link"><span class="css-1qaijid r-bcqeeo">Trending in your area</span></a>'
+           '<img src="https://archive.ph/FexMt/a1b2c3.png" width="48" height="48"></div>\n')
+    filler = row * max(1, page_kb * 1024 // len(row))
+    return html.replace('</body>', filler + '</body>', 1)
+
+class StubArchiveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like archive.ph
+    pages = {}
+    latency = 0.0
+
+    def do_GET(self):
+        archive_id = self.path.strip('/').split('/')[-1]
+        if self.latency:
+            time.sleep(self.latency)
+        if archive_id.startswith('missing'):
+            self._send(404, b'Not found')
+            return
+        fixture = next((name for prefix, name in FIXTURE_PREFIXES if archive_id.startswith(prefix)), DEFAULT_FIXTURE)
+        self._send(200, self.pages[fixture])
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class StubArchiveServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients routinely drop keep-alive connections mid-benchmark
+        pass
+
+def start_stub_server(port=0, page_kb=0, latency_ms=0):
+    """Start the stub in a daemon thread and return ``(server, base_url)``."""
+    pages = {
+        name: pad_page(load_fixture(name), page_kb).encode('utf-8')
+        for name in [DEFAULT_FIXTURE] + [name for _, name in FIXTURE_PREFIXES]
+    }
+    handler = type('Handler', (StubArchiveHandler,), {'pages': pages, 'latency': latency_ms / 1000.0})
+    server = StubArchiveServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve recorded archive.ph fixtures locally')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--page-kb', type=int, default=0, help='pad pages to roughly this size')
+    parser.add_argument('--latency-ms', type=int, default=0, help='simulated upstream latency')
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(args.port, args.page_kb, args.latency_ms)
+    print(f"Stub archive server on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,99 @@
+"""Clustering of analyzed URLs by content embedding and features.
+
+Each URL becomes one unit vector: its content embedding followed by its
+log-scaled, standardized features (weighted by ``feature_weight``). The
+DBSCAN clusterer is fitted on a random sample rather than on every URL.
+Its core samples go into a ``PatternIndex``. Every other URL, including new
+ones, is then labelled like DBSCAN would label a border point: it takes the
+cluster of its nearest core sample if that sample is within ``eps``, and is
+noise (-1) otherwise. Assigning a URL costs one nearest-neighbour lookup,
+not a refit.
+"""
+import logging
+from datetime import datetime
+
+import numpy as np
+
+from pattern_index import PatternIndex
+
+logger = logging.getLogger(__name__)
+
+CLUSTERING_CONFIG = {
+    'fit_sample': 10000,  # URLs DBSCAN is fitted on; its neighbourhood search is quadratic in this
+    'feature_weight': 0.25,  # share of the vector given to the standardized features
+    'assign_chunk_size': 2000,  # URLs labelled and written per bulk UPDATE
+    'refit_hours': 24,
+    'assign_minutes': 10
+}
+
+NOISE = -1
+
+class ClusterModel:
+    def __init__(self, clusterer, scaler):
+        self.clusterer = clusterer
+        self.scaler = scaler
+        self.index = None  # core samples, ids are rows of core_vectors
+        self.core_vectors = None
+        self.core_labels = np.zeros(0, dtype=np.int64)
+        self.fitted_at = None
+
+    @property
+    def fitted(self):
+        return self.index is not None
+
+    def vectors(self, embeddings, features, fit_scaler=False):
+        """Unit vectors combining ``(n, dim)`` embeddings and ``(n, n_features)`` raw features."""
+        scaled = np.log1p(np.clip(np.nan_to_num(features), 0, None))
+        if fit_scaler:
+            self.scaler.fit(scaled)
+        scaled = np.nan_to_num(self.scaler.transform(scaled)) * CLUSTERING_CONFIG['feature_weight']
+        combined = np.hstack([embeddings, scaled]).astype(np.float32)
+        norms = np.linalg.norm(combined, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return combined / norms
+
+    def fit(self, embeddings, features):
+        """Fit DBSCAN on a sample and index its core samples; returns the sample's labels."""
+        vectors = self.vectors(embeddings, features, fit_scaler=True)
+        labels = self.clusterer.fit_predict(vectors)
+        core = self.clusterer.core_sample_indices_
+        self._index_core(vectors[core], labels[core].astype(np.int64))
+        self.fitted_at = datetime.utcnow()
+        clusters = len(set(labels.tolist()) - {NOISE})
+        logger.info(f"Fitted {clusters} clusters on {len(vectors)} URLs ({len(core)} core samples)")
+        return labels
+
+    def predict(self, embeddings, features):
+        """Cluster of each URL's nearest core sample within eps, else NOISE."""
+        if not self.fitted or not len(embeddings):
+            return np.full(len(embeddings), NOISE, dtype=np.int64)
+        vectors = self.vectors(embeddings, features)
+        # Unit vectors: euclidean distance <= eps is cosine >= 1 - eps**2 / 2
+        min_cosine = 1 - self.clusterer.eps ** 2 / 2
+        labels = np.full(len(vectors), NOISE, dtype=np.int64)
+        for i, vector in enumerate(vectors):
+            nearest = self.index.search(vector, k=1)
+            if nearest and nearest[0][1] >= min_cosine:
+                labels[i] = self.core_labels[nearest[0][0]]
+        return labels
+
+    def _index_core(self, vectors, labels):
+        # Core vectors are already unit rows; a memory-mapped matrix is indexed in place
+        self.index = PatternIndex.from_normalized(vectors)
+        self.core_vectors = vectors
+        self.core_labels = labels
+
+    def state_dict(self):
+        if not self.fitted:
+            return None
+        return {
+            'core_vectors': self.core_vectors,
+            'core_labels': self.core_labels,
+            'fitted_at': self.fitted_at
+        }
+
+    def load_state(self, state):
+        if not state:
+            return
+        self._index_core(state['core_vectors'], state['core_labels'])
+        self.fitted_at = state['fitted_at']
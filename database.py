@@ -0,0 +1,142 @@
+"""Shared database engines and session lifecycle.
+
+One engine per database URL per process. Pool sizing comes from
+``DATABASE_CONFIG``. The pool is LIFO, so idle connections age out instead
+of all staying warm. Connections are pre-pinged and recycled before server
+or proxy timeouts can leave them stale.
+
+Forked children (Celery prefork workers, gunicorn workers) must not share
+the parent's sockets. Each engine's pool is replaced in the child with
+``dispose(close=False)``, which leaves the parent's connections open for
+the parent. Children then connect lazily on first use, not all at once on
+startup.
+
+Sessions come from ``scoped_sessions``: one per thread, removed when the
+task or request ends (``session_scope``, or the Celery/Flask hooks that
+call ``remove()``).
+
+``insert_ignoring_conflicts`` is the dialect-aware bulk INSERT that skips
+rows already present, shared by the stores that upsert by unique key.
+"""
+import logging
+import os
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from metrics import DB_POOL_CONNECTIONS, DB_POOL_EVENTS
+
+logger = logging.getLogger(__name__)
+
+DATABASE_CONFIG = {
+    'url': os.environ.get('DATABASE_URL', 'sqlite:///url_analyzer.db'),
+    'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),  # connections kept per process
+    'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),  # extra connections under bursts
+    'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),  # seconds to wait for a connection
+    'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),  # below typical server/proxy idle timeouts
+    'pool_pre_ping': True
+}
+
+_engines = {}
+
+def _pool_options(url):
+    options = {'pool_pre_ping': DATABASE_CONFIG['pool_pre_ping']}
+    if not url.startswith('sqlite'):
+        # SQLite uses file locks, not a server; its default pools are kept
+        options.update(
+            pool_size=DATABASE_CONFIG['pool_size'],
+            max_overflow=DATABASE_CONFIG['max_overflow'],
+            pool_timeout=DATABASE_CONFIG['pool_timeout'],
+            pool_recycle=DATABASE_CONFIG['pool_recycle'],
+            pool_use_lifo=True
+        )
+    return options
+
+def _instrument_pool(engine):
+    database = engine.url.get_backend_name()
+    opened = DB_POOL_CONNECTIONS.labels(database, 'open')
+    checked_out = DB_POOL_CONNECTIONS.labels(database, 'checked_out')
+    connects = DB_POOL_EVENTS.labels(database, 'connect')
+    invalidations = DB_POOL_EVENTS.labels(database, 'invalidate')
+
+    @event.listens_for(engine, 'connect')
+    def _connected(dbapi_connection, connection_record):
+        connects.inc()
+        opened.inc()
+
+    @event.listens_for(engine, 'close')
+    def _closed(dbapi_connection, connection_record):
+        opened.dec()
+
+    @event.listens_for(engine, 'checkout')
+    def _checked_out(dbapi_connection, connection_record, connection_proxy):
+        checked_out.inc()
+
+    @event.listens_for(engine, 'checkin')
+    def _checked_in(dbapi_connection, connection_record):
+        checked_out.dec()
+
+    @event.listens_for(engine, 'invalidate')
+    def _invalidated(dbapi_connection, connection_record, exception):
+        invalidations.inc()
+
+def get_engine(url=None):
+    """The process-wide engine for ``url`` (default ``DATABASE_CONFIG['url']``)."""
+    url = url or DATABASE_CONFIG['url']
+    engine = _engines.get(url)
+    if engine is None:
+        engine = create_engine(url, **_pool_options(url))
+        _instrument_pool(engine)
+        engine = _engines.setdefault(url, engine)
+    return engine
+
+def scoped_sessions(url=None):
+    """A new thread-scoped session registry on ``url``'s engine.
+
+    Calling it returns the current thread's session; ``remove()`` closes it.
+    """
+    return scoped_session(sessionmaker(bind=get_engine(url)))
+
+@contextmanager
+def session_scope(sessions):
+    """The current session of ``sessions``, removed when the block exits."""
+    try:
+        yield sessions()
+    finally:
+        sessions.remove()
+
+def insert_ignoring_conflicts(session, table, rows):
+    """INSERT ``rows`` into ``table``, skipping rows that hit a unique constraint."""
+    if not rows:
+        return
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        statement = dialect_insert(table).on_conflict_do_nothing()
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        statement = dialect_insert(table).on_conflict_do_nothing()
+    elif dialect in ('mysql', 'mariadb'):
+        statement = insert(table).prefix_with('IGNORE')
+    else:
+        for row in rows:
+            try:
+                with session.begin_nested():
+                    session.execute(insert(table), [row])
+            except IntegrityError:
+                pass
+        return
+    session.execute(statement, rows)
+
+def _dispose_after_fork():
+    for engine in _engines.values():
+        # New pool for the child; the parent's connections stay open for the parent
+        engine.dispose(close=False)
+        database = engine.url.get_backend_name()
+        DB_POOL_CONNECTIONS.labels(database, 'open').set(0)
+        DB_POOL_CONNECTIONS.labels(database, 'checked_out').set(0)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_dispose_after_fork)
@@ -0,0 +1,123 @@
+"""Batch text embeddings in one fixed-dimension space.
+
+Documents are hashed into ``n_features`` buckets by a stateless
+HashingVectorizer, so there is no vocabulary to fit and every vector ever
+produced lives in the same space. Term weighting uses an IDF learned
+incrementally from document frequencies: ``partial_fit`` only adds counts,
+so new pages refine the weights without invalidating stored vectors.
+Lists of documents are embedded with one sparse-matrix product:
+
+    engine = EmbeddingEngine()
+    vectors = engine.embed(pages)  # (len(pages), n_features) float32, rows L2-normalized
+"""
+import threading
+from collections import Counter
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS, HashingVectorizer
+from sklearn.preprocessing import normalize
+
+EMBEDDING_CONFIG = {
+    'n_features': 1024,  # vector dimension; changing it invalidates stored embeddings
+    'ngram_range': (1, 1),
+    'sublinear_tf': True  # 1 + log(tf), so long pages don't drown out short ones
+}
+
+class EmbeddingEngine:
+    def __init__(self, n_features=None, ngram_range=None, sublinear_tf=None):
+        self.n_features = n_features or EMBEDDING_CONFIG['n_features']
+        self.ngram_range = tuple(ngram_range or EMBEDDING_CONFIG['ngram_range'])
+        self.sublinear_tf = EMBEDDING_CONFIG['sublinear_tf'] if sublinear_tf is None else sublinear_tf
+        self.vectorizer = HashingVectorizer(
+            n_features=self.n_features,
+            ngram_range=self.ngram_range,
+            alternate_sign=False,
+            norm=None
+        )
+        self.doc_count = 0
+        self.doc_freq = np.zeros(self.n_features, dtype=np.int64)
+        self._idf = None
+        self._lock = threading.Lock()
+
+    @property
+    def idf(self):
+        """Smoothed IDF, ``log((1 + n) / (1 + df)) + 1`` as in TfidfVectorizer."""
+        idf = self._idf
+        if idf is None:
+            with self._lock:
+                idf = np.log((1.0 + self.doc_count) / (1.0 + self.doc_freq)) + 1.0
+                self._idf = idf = idf.astype(np.float32)
+        return idf
+
+    def term_counts(self, documents):
+        """Hashed term counts as a CSR matrix, one row per document."""
+        counts = self.vectorizer.transform(['' if d is None else d for d in documents])
+        counts.sum_duplicates()
+        return counts
+
+    def partial_fit(self, documents=None, counts=None):
+        """Add documents to the document-frequency statistics."""
+        if counts is None:
+            counts = self.term_counts(documents)
+        doc_freq = np.bincount(counts.indices, minlength=self.n_features)
+        with self._lock:
+            self.doc_freq += doc_freq
+            self.doc_count += counts.shape[0]
+            self._idf = None
+        return self
+
+    def transform(self, documents=None, counts=None):
+        """TF-IDF weighted, L2-normalized sparse vectors for ``documents``."""
+        if counts is None:
+            counts = self.term_counts(documents)
+        weights = counts.astype(np.float32)
+        if self.sublinear_tf:
+            np.log1p(weights.data, out=weights.data)
+        weights = weights @ sp.diags(self.idf)
+        return normalize(weights, norm='l2', copy=False)
+
+    def embed(self, documents, update=True):
+        """Dense float32 embeddings for a list of documents.
+
+        With ``update`` the documents also feed the IDF first, so a batch is
+        weighted consistently with itself.
+        """
+        if not documents:
+            return np.zeros((0, self.n_features), dtype=np.float32)
+        counts = self.term_counts(documents)
+        if update:
+            self.partial_fit(counts=counts)
+        return self.transform(counts=counts).toarray()
+
+    def top_terms(self, document, n=5):
+        """The ``n`` highest TF-IDF terms of a document, skipping stop words and numbers."""
+        counts = Counter(
+            term for term in self.vectorizer.build_analyzer()(document or '')
+            if len(term) > 2 and not term.isdigit() and term not in ENGLISH_STOP_WORDS
+        )
+        if not counts:
+            return []
+        terms = list(counts)
+        # One term per row, so each row holds exactly that term's bucket
+        buckets = self.vectorizer.transform(terms).indices
+        tf = np.fromiter(counts.values(), dtype=np.float32, count=len(terms))
+        scores = (np.log1p(tf) if self.sublinear_tf else tf) * self.idf[buckets]
+        top = np.argsort(-scores, kind='stable')[:n]
+        return [terms[i] for i in top]
+
+    def state_dict(self):
+        return {
+            'n_features': self.n_features,
+            'ngram_range': self.ngram_range,
+            'sublinear_tf': self.sublinear_tf,
+            'doc_count': self.doc_count,
+            'doc_freq': self.doc_freq
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        engine = cls(state['n_features'], state['ngram_range'], state['sublinear_tf'])
+        engine.doc_count = int(state['doc_count'])
+        engine.doc_freq = np.asarray(state['doc_freq'], dtype=np.int64).copy()
+        return engine
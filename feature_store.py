@@ -0,0 +1,141 @@
+"""Columnar storage and running statistics for URL features.
+
+Each analysis appends one wide ``url_feature_values`` row (a column per
+feature) instead of one row per feature. Per-feature count, mean and M2 (the
+sum of squared deviations) live in ``feature_stats``. Every appended batch
+folds its own Welford statistics into those rows with a single UPDATE, so
+variance-based importance is available without reading the feature rows
+back. ``rebuild`` recomputes the statistics from scratch with SQL aggregates
+and ``feature_matrix`` streams rows into NumPy for model training.
+"""
+import math
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import bindparam, delete, func, insert, select, update
+
+from database import insert_ignoring_conflicts
+from models import FEATURE_NAMES, FeatureStat, URLFeature
+
+FEATURE_STORE_CONFIG = {
+    'read_chunk_size': 10000  # rows per partition when streaming feature_matrix
+}
+
+def importance_from_stats(count, mean, m2):
+    """Variance relative to the mean; None until a feature has two observations."""
+    if count < 2:
+        return None
+    variance = m2 / count
+    return variance / (mean if mean != 0 else 1)
+
+class FeatureStore:
+    def __init__(self, feature_names=FEATURE_NAMES):
+        self.feature_names = tuple(feature_names)
+
+    def append(self, session, url_ids, features):
+        """Insert one wide row per ``(url_id, features dict)`` and fold the batch into the stats."""
+        if not url_ids:
+            return
+        matrix = np.array(
+            [[item.get(name, np.nan) for name in self.feature_names] for item in features], dtype=np.float64
+        )
+        now = datetime.utcnow()
+        session.execute(insert(URLFeature), [
+            {
+                'url_id': url_id,
+                'last_updated': now,
+                **{name: None if math.isnan(value) else value for name, value in zip(self.feature_names, row.tolist())}
+            }
+            for url_id, row in zip(url_ids, matrix)
+        ])
+        self.merge_stats(session, matrix)
+
+    def merge_stats(self, session, matrix):
+        """Combine a batch's per-column statistics into feature_stats (Chan et al. parallel update)."""
+        present = ~np.isnan(matrix)
+        counts = present.sum(axis=0)
+        filled = np.where(present, matrix, 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = filled.sum(axis=0) / counts
+            m2s = np.where(present, (matrix - means) ** 2, 0.0).sum(axis=0)
+        batch = [
+            {'name': name, 'n': int(n), 'batch_mean': float(mean), 'batch_m2': float(m2)}
+            for name, n, mean, m2 in zip(self.feature_names, counts, means, m2s)
+            if n
+        ]
+        if not batch:
+            return
+        insert_ignoring_conflicts(session, FeatureStat.__table__, [
+            {'feature_name': row['name'], 'count': 0, 'mean': 0.0, 'm2': 0.0} for row in batch
+        ])
+        stats = FeatureStat.__table__
+        total = stats.c.count + bindparam('n')
+        delta = bindparam('batch_mean') - stats.c.mean
+        # SET expressions all see the row's old values, so concurrent batches combine atomically
+        session.execute(
+            update(stats)
+            .where(stats.c.feature_name == bindparam('name'))
+            .values(
+                count=total,
+                mean=stats.c.mean + delta * bindparam('n') / total,
+                m2=stats.c.m2 + bindparam('batch_m2') + delta * delta * stats.c.count * bindparam('n') / total,
+                last_updated=bindparam('seen_at')
+            ),
+            [dict(row, seen_at=datetime.utcnow()) for row in batch]
+        )
+
+    def stats(self, session):
+        """``{feature_name: (count, mean, m2)}`` for every tracked feature."""
+        return {
+            name: (count, mean, m2)
+            for name, count, mean, m2 in session.execute(
+                select(FeatureStat.feature_name, FeatureStat.count, FeatureStat.mean, FeatureStat.m2)
+            )
+        }
+
+    def importance(self, session):
+        scores = {}
+        for name, (count, mean, m2) in self.stats(session).items():
+            score = importance_from_stats(count, mean, m2)
+            if score is not None:
+                scores[name] = score
+        return scores
+
+    def rebuild(self, session):
+        """Recompute feature_stats from url_feature_values with two aggregate queries."""
+        columns = [getattr(URLFeature, name) for name in self.feature_names]
+        summary = session.execute(select(
+            *[func.count(column) for column in columns], *[func.avg(column) for column in columns]
+        )).one()
+        counts, means = summary[:len(columns)], summary[len(columns):]
+        # Second pass around the exact mean rather than sum(x*x), which loses precision
+        m2s = session.execute(select(*[
+            func.coalesce(func.sum((column - (mean or 0.0)) * (column - (mean or 0.0))), 0.0)
+            for column, mean in zip(columns, means)
+        ])).one()
+        session.execute(delete(FeatureStat))
+        now = datetime.utcnow()
+        rows = [
+            {'feature_name': name, 'count': count, 'mean': float(mean or 0.0), 'm2': float(m2), 'last_updated': now}
+            for name, count, mean, m2 in zip(self.feature_names, counts, means, m2s)
+            if count
+        ]
+        if rows:
+            session.execute(insert(FeatureStat), rows)
+        return len(rows)
+
+    def feature_matrix(self, session, url_ids=None):
+        """``(url_ids, matrix)`` of stored feature rows, streamed in chunks rather than as ORM objects."""
+        columns = [getattr(URLFeature, name) for name in self.feature_names]
+        query = select(URLFeature.url_id, *columns).order_by(URLFeature.id)
+        if url_ids is not None:
+            query = query.where(URLFeature.url_id.in_(url_ids))
+        ids, blocks = [], []
+        result = session.execute(query.execution_options(yield_per=FEATURE_STORE_CONFIG['read_chunk_size']))
+        for chunk in result.partitions():
+            block = np.array(chunk, dtype=np.float64)
+            ids.append(block[:, 0].astype(np.int64))
+            blocks.append(block[:, 1:])
+        if not blocks:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, len(columns)))
+        return np.concatenate(ids), np.vstack(blocks)
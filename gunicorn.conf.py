@@ -0,0 +1,20 @@
+"""Gunicorn hooks, loaded automatically from the working directory.
+
+With PROMETHEUS_MULTIPROC_DIR set each worker writes its metrics to that
+directory; start from an empty one and drop the files of exited workers so
+/metrics only aggregates live processes.
+"""
+import os
+import shutil
+
+def on_starting(server):
+    path = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,199 @@
+"""Shared, pooled HTTP sessions for outbound traffic.
+
+All outbound calls to archive.ph (and the URLs we validate) go through one
+keep-alive ``requests.Session`` per process so TCP+TLS handshakes are paid
+once per connection instead of once per request. Each host additionally gets
+a concurrency cap so a burst of lookups cannot open an unbounded number of
+connections to the same upstream.
+
+Pages named by clients are fetched with ``get_public``, which refuses hosts
+that resolve to loopback, private, link-local or reserved addresses, and
+checks again at every redirect.
+"""
+import ipaddress
+import os
+import random
+import socket
+import threading
+import time
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import urljoin, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import observe_upstream
+
+logger = logging.getLogger(__name__)
+
+def _parse_host_limits(value):
+    """Parse ``host=limit,host=limit`` into a dict."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        host, _, limit = item.partition('=')
+        try:
+            limits[host.strip().lower()] = int(limit)
+        except ValueError:
+            logger.warning(f"Ignoring invalid host limit: {item}")
+    return limits
+
+# Connection pool configuration
+POOL_CONFIG = {
+    'pool_connections': int(os.environ.get('HTTP_POOL_CONNECTIONS', 10)),  # hosts kept pooled
+    'pool_maxsize': int(os.environ.get('HTTP_POOL_MAXSIZE', 32)),  # keep-alive connections per host
+    'max_per_host': int(os.environ.get('HTTP_MAX_PER_HOST', 16)),  # concurrent requests per host
+    'host_limits': _parse_host_limits(os.environ.get('HTTP_HOST_LIMITS', 'archive.ph=8,archive.is=8,archive.today=8')),
+    'max_hosts': int(os.environ.get('HTTP_MAX_HOSTS', 1024)),  # per-host caps kept, least recently used evicted
+    'max_redirects': 5  # redirects get_public follows, each one checked
+}
+
+class UnsafeURL(ValueError):
+    """A client-supplied URL that is not http(s) or points at an internal address."""
+
+USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:89.0) Gecko/20100101 Firefox/89.0',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.1.1 Safari/605.1.15',
+]
+
+_lock = threading.Lock()
+_session = None
+_host_semaphores = OrderedDict()
+
+def get_random_user_agent():
+    return random.choice(USER_AGENTS)
+
+def host_limit(host):
+    """Concurrency cap configured for a host."""
+    return POOL_CONFIG['host_limits'].get(host, POOL_CONFIG['max_per_host'])
+
+def _build_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=POOL_CONFIG['pool_connections'],
+        pool_maxsize=POOL_CONFIG['pool_maxsize']
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def get_session():
+    """Return the process-wide pooled session, creating it on first use."""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+def _host_semaphore(host):
+    # Validated URLs can name any number of hosts, so only the most recently
+    # used ``max_hosts`` keep a semaphore. Requests still holding an evicted
+    # one release it normally; the host just starts a fresh cap.
+    with _lock:
+        semaphore = _host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(host_limit(host))
+            _host_semaphores[host] = semaphore
+            if len(_host_semaphores) > POOL_CONFIG['max_hosts']:
+                _host_semaphores.popitem(last=False)
+        else:
+            _host_semaphores.move_to_end(host)
+    return semaphore
+
+@contextmanager
+def host_slot(url):
+    """Hold one of the host's concurrency slots for the duration of a request."""
+    semaphore = _host_semaphore((urlparse(url).hostname or '').lower())
+    with semaphore:
+        yield
+
+def request(method, url, **kwargs):
+    """Send a request through the pooled session, respecting per-host caps.
+
+    The slot is held until ``request()`` returns. With ``stream=True`` that
+    is once the headers arrive, so reading the body is not counted against
+    the cap.
+    """
+    with host_slot(url):
+        started = time.perf_counter()
+        status = None
+        try:
+            response = get_session().request(method, url, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            observe_upstream(url, method, status, time.perf_counter() - started)
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+def _is_public(address):
+    address = ipaddress.ip_address(address.split('%', 1)[0])  # drop an IPv6 zone
+    if getattr(address, 'ipv4_mapped', None):
+        address = address.ipv4_mapped
+    return address.is_global and not address.is_multicast
+
+def check_public_url(url):
+    """Raise UnsafeURL unless ``url`` is http(s) and every address its host resolves to is public."""
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise UnsafeURL('Invalid URL')
+    try:
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        addresses = {info[4][0] for info in socket.getaddrinfo(parsed.hostname, port, type=socket.SOCK_STREAM)}
+    except (socket.gaierror, UnicodeError, ValueError):
+        raise UnsafeURL(f"Cannot resolve {parsed.hostname}")
+    if not all(_is_public(address) for address in addresses):
+        raise UnsafeURL(f"{parsed.hostname} is not a public address")
+
+def request_public(method, url, **kwargs):
+    """Request a client-supplied URL, refusing internal addresses before each hop.
+
+    Redirects are followed here rather than by requests, so a public page
+    cannot bounce the server onto an internal one.
+    """
+    kwargs['allow_redirects'] = False
+    for _ in range(POOL_CONFIG['max_redirects'] + 1):
+        check_public_url(url)
+        response = request(method, url, **kwargs)
+        if not response.is_redirect:
+            return response
+        response.close()
+        url = urljoin(url, response.headers['location'])
+    raise requests.TooManyRedirects(f"More than {POOL_CONFIG['max_redirects']} redirects")
+
+def get_public(url, **kwargs):
+    return request_public('GET', url, **kwargs)
+
+def head_public(url, **kwargs):
+    return request_public('HEAD', url, **kwargs)
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+def head(url, **kwargs):
+    return request('HEAD', url, **kwargs)
+
+def reset():
+    """Drop pooled connections, e.g. after fork so children never share sockets."""
+    global _session
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _host_semaphores.clear()
+
+def _reset_after_fork():
+    global _lock, _session
+    # The parent's lock may have been held mid-fork and its sockets must
+    # not be reused by the child, so start from a clean slate.
+    _lock = threading.Lock()
+    _session = None
+    _host_semaphores.clear()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -1,8 +1,8 @@
 import os
 import logging
 from logging.handlers import RotatingFileHandler
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import text
+from database import get_engine
 from models import Base
 from config import Config
 
@@ -29,20 +29,16 @@ def init_db():
     """Initialize the database with proper error handling"""
     try:
         # Create database engine
-        engine = create_engine(Config.SQLALCHEMY_DATABASE_URI)
+        engine = get_engine(Config.SQLALCHEMY_DATABASE_URI)
         logger.info(f"Creating database at {Config.SQLALCHEMY_DATABASE_URI}")
 
         # Create all tables
         Base.metadata.create_all(engine)
         logger.info("Database tables created successfully")
 
-        # Create session factory
-        Session = sessionmaker(bind=engine)
-        
         # Test database connection
-        session = Session()
-        session.execute("SELECT 1")
-        session.close()
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
         
         logger.info("Database connection test successful")
         return True
@@ -1,9 +1,9 @@
 import os
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.preprocessing import StandardScaler
 from sklearn.cluster import DBSCAN
-import joblib
+from model_store import get_model_store
+from embedding_engine import EmbeddingEngine
 
 def init_ml_models():
     """Initialize and save ML models"""
@@ -13,7 +13,7 @@ def init_ml_models():
         print("Created models directory")
 
     # Initialize models
-    vectorizer = TfidfVectorizer(max_features=1000)
+    embedder = EmbeddingEngine()
     scaler = StandardScaler()
     clusterer = DBSCAN(eps=0.3, min_samples=2)
     
@@ -32,13 +32,14 @@ def init_ml_models():
 
     # Save models
     models = {
-        'vectorizer': vectorizer,
+        'embedder': embedder.state_dict(),
         'scaler': scaler,
         'clusterer': clusterer,
         'feature_importance': feature_importance
     }
     
-    joblib.dump(models, 'models/url_analyzer.joblib')
+    # Atomic replace, so running workers never read a half-written file
+    get_model_store('models/url_analyzer.joblib').save(models)
     print("Initialized and saved ML models")
 
 if __name__ == '__main__':
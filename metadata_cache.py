@@ -0,0 +1,444 @@
+"""Tiered archive metadata cache shared by the Flask and async servers.
+
+Lookups hit a small in-process LRU first and then Redis, so every gunicorn
+worker, async process and Celery container sees the same entries. Entries
+carry their own freshness:
+
+* ``ok`` entries are fresh for ``fresh_ttl`` and may then be served stale
+  for ``stale_ttl`` more while one background refresh replaces them.
+* ``not_found`` entries (archive missing, page is not a tweet archive) and
+  ``error`` entries (503s, timeouts, CAPTCHAs) are cached briefly so a hot
+  bad ID does not hammer archive.ph, and replay the original error response.
+
+Without Redis (USE_REDIS unset) the LRU is the only tier.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import CACHE_EVENTS
+
+logger = logging.getLogger(__name__)
+
+CACHE_CONFIG = {
+    'redis_url': os.environ.get('REDIS_URL') if os.environ.get('USE_REDIS', 'false').lower() == 'true' else None,
+    'key_prefix': 'archive-metadata:',
+    'fresh_ttl': int(os.environ.get('METADATA_FRESH_TTL', 86400)),  # 24 hours
+    'stale_ttl': int(os.environ.get('METADATA_STALE_TTL', 6 * 86400)),  # served stale after fresh_ttl
+    'not_found_ttl': int(os.environ.get('METADATA_NOT_FOUND_TTL', 3600)),
+    'error_ttl': int(os.environ.get('METADATA_ERROR_TTL', 30)),
+    'refresh_lease_ttl': 60,  # one refresh per key across processes
+    'lru_max_entries': int(os.environ.get('METADATA_LRU_MAX_ENTRIES', 10000)),
+    'lru_ttl': 60,  # local copies expire quickly so refreshes elsewhere propagate
+    'redis_timeout': 0.5,
+    'redis_retry_after': 5  # seconds to bypass Redis after a connection error
+}
+
+class CachedFailure(Exception):
+    """A cached negative entry; ``payload`` and ``status_code`` replay the original error."""
+
+    def __init__(self, kind, status_code, payload):
+        super().__init__(payload.get('error'))
+        self.kind = kind
+        self.status_code = status_code
+        self.payload = payload
+
+def make_entry(value=None, kind='ok', status_code=200, now=None):
+    """Build a cache entry; ``value`` is the metadata dict or the error payload."""
+    now = now or time.time()
+    if kind == 'ok':
+        fresh_until = now + CACHE_CONFIG['fresh_ttl']
+        stale_until = fresh_until + CACHE_CONFIG['stale_ttl']
+    else:
+        ttl = CACHE_CONFIG['not_found_ttl'] if kind == 'not_found' else CACHE_CONFIG['error_ttl']
+        fresh_until = stale_until = now + ttl
+    return {
+        'kind': kind,
+        'value': value,
+        'status_code': status_code,
+        'fresh_until': fresh_until,
+        'stale_until': stale_until
+    }
+
+def entry_state(entry, now=None):
+    """Return 'fresh', 'stale' or None (expired) for an entry."""
+    if entry is None:
+        return None
+    now = now or time.time()
+    if now < entry['fresh_until']:
+        return 'fresh'
+    if now < entry['stale_until']:
+        return 'stale'
+    return None
+
+def entry_result(entry):
+    """Unwrap an entry into its metadata dict, raising CachedFailure for negatives."""
+    if entry['kind'] != 'ok':
+        raise CachedFailure(entry['kind'], entry['status_code'], entry['value'])
+    return entry['value']
+
+class LRUBackend:
+    """Bounded in-process tier; thread-safe and cheap enough for the event loop."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            entry, expires_at = item
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        expires_at = min(entry['stale_until'], time.time() + self.ttl)
+        with self._lock:
+            self._entries[key] = (entry, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+class RedisAvailability:
+    """Skip Redis for a short while after a failure instead of timing out on every call."""
+
+    def __init__(self):
+        self.down_until = 0.0
+
+    def available(self):
+        return time.monotonic() >= self.down_until
+
+    def failed(self, error):
+        if self.available():
+            logger.warning(f"Metadata cache Redis unavailable, using local tier only: {error}")
+        self.down_until = time.monotonic() + CACHE_CONFIG['redis_retry_after']
+
+class RedisBackend:
+    def __init__(self, url):
+        import redis
+
+        self.errors = (redis.RedisError,)
+        self.client = redis.Redis.from_url(
+            url,
+            socket_timeout=CACHE_CONFIG['redis_timeout'],
+            socket_connect_timeout=CACHE_CONFIG['redis_timeout']
+        )
+        self.status = RedisAvailability()
+
+    def get(self, key):
+        if not self.status.available():
+            return None
+        try:
+            raw = self.client.get(CACHE_CONFIG['key_prefix'] + key)
+        except self.errors as e:
+            self.status.failed(e)
+            return None
+        return json.loads(raw) if raw else None
+
+    def set(self, key, entry):
+        if not self.status.available():
+            return
+        ttl = max(1, int(entry['stale_until'] - time.time()))
+        try:
+            self.client.set(CACHE_CONFIG['key_prefix'] + key, json.dumps(entry), ex=ttl)
+        except self.errors as e:
+            self.status.failed(e)
+
+    def acquire_refresh_lease(self, key):
+        if not self.status.available():
+            return True
+        try:
+            return bool(self.client.set(
+                CACHE_CONFIG['key_prefix'] + 'refresh:' + key, 1,
+                nx=True, ex=CACHE_CONFIG['refresh_lease_ttl']
+            ))
+        except self.errors as e:
+            self.status.failed(e)
+            return True
+
+class AsyncRedisBackend:
+    def __init__(self, url):
+        import redis
+        import redis.asyncio
+
+        self.errors = (redis.RedisError,)
+        self.client = redis.asyncio.Redis.from_url(
+            url,
+            socket_timeout=CACHE_CONFIG['redis_timeout'],
+            socket_connect_timeout=CACHE_CONFIG['redis_timeout']
+        )
+        self.status = RedisAvailability()
+
+    async def get(self, key):
+        if not self.status.available():
+            return None
+        try:
+            raw = await self.client.get(CACHE_CONFIG['key_prefix'] + key)
+        except self.errors as e:
+            self.status.failed(e)
+            return None
+        return json.loads(raw) if raw else None
+
+    async def set(self, key, entry):
+        if not self.status.available():
+            return
+        ttl = max(1, int(entry['stale_until'] - time.time()))
+        try:
+            await self.client.set(CACHE_CONFIG['key_prefix'] + key, json.dumps(entry), ex=ttl)
+        except self.errors as e:
+            self.status.failed(e)
+
+    async def acquire_refresh_lease(self, key):
+        if not self.status.available():
+            return True
+        try:
+            return bool(await self.client.set(
+                CACHE_CONFIG['key_prefix'] + 'refresh:' + key, 1,
+                nx=True, ex=CACHE_CONFIG['refresh_lease_ttl']
+            ))
+        except self.errors as e:
+            self.status.failed(e)
+            return True
+
+def new_stats():
+    return {'hits': 0, 'stale_hits': 0, 'negative_hits': 0, 'misses': 0, 'refreshes': 0}
+
+_CACHE_COUNTERS = {name: CACHE_EVENTS.labels(name) for name in new_stats()}
+
+def count(stats, name):
+    """Bump a /health counter and its Prometheus twin."""
+    stats[name] += 1
+    _CACHE_COUNTERS[name].inc()
+
+class MetadataCache:
+    """Blocking facade used by the Flask server and Celery tasks.
+
+    ``classify(error)`` maps a fetch exception to ``(kind, status_code, payload)``
+    for negative caching, or None when the failure should not be cached.
+    ``flight`` is an optional single_flight.SingleFlight that coalesces
+    concurrent misses for one key into a single fetch.
+    """
+
+    def __init__(self, redis_url=None, flight=None):
+        self.lru = LRUBackend(CACHE_CONFIG['lru_max_entries'], CACHE_CONFIG['lru_ttl'])
+        self.redis = RedisBackend(redis_url) if redis_url else None
+        self.flight = flight
+        self.stats = new_stats()
+        self._refreshing = set()
+        self._refresh_lock = threading.Lock()
+        self._refresh_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='metadata-refresh')
+
+    @property
+    def backend(self):
+        return 'redis+lru' if self.redis else 'lru'
+
+    def lookup(self, key):
+        entry = self.lru.get(key)
+        if entry is None and self.redis is not None:
+            entry = self.redis.get(key)
+            if entry is not None:
+                self.lru.set(key, entry)
+        return entry if entry_state(entry) else None
+
+    def store(self, key, entry):
+        self.lru.set(key, entry)
+        if self.redis is not None:
+            self.redis.set(key, entry)
+
+    def get_cached(self, key, fetch=None, classify=None):
+        """Serve ``key`` without an upstream call if possible, else return None.
+
+        A stale hit schedules one background refresh when ``fetch`` is given.
+        Cached failures raise CachedFailure.
+        """
+        entry = self.lookup(key)
+        state = entry_state(entry)
+        if state is None:
+            return None
+        if entry['kind'] != 'ok':
+            count(self.stats, 'negative_hits')
+        elif state == 'stale':
+            count(self.stats, 'stale_hits')
+            if fetch is not None:
+                self._schedule_refresh(key, fetch, classify)
+        else:
+            count(self.stats, 'hits')
+        return entry_result(entry)
+
+    def get_or_fetch(self, key, fetch, classify=None):
+        cached = self.get_cached(key, fetch, classify)
+        if cached is not None:
+            return cached
+        count(self.stats, 'misses')
+        if self.flight is None:
+            return self.fetch_and_store(key, fetch, classify)
+        # Waiters in other processes read the entry the leader stores
+        return self.flight.do(key, lambda: self._settled_or_fetch(key, fetch, classify), load=lambda: self.settled(key))
+
+    def settled(self, key):
+        """Entry result for ``key`` if one exists, without counting it as a hit."""
+        entry = self.lookup(key)
+        return entry_result(entry) if entry else None
+
+    def _settled_or_fetch(self, key, fetch, classify):
+        # A worker elsewhere may have filled the entry since our miss
+        value = self.settled(key)
+        if value is not None:
+            return value
+        return self.fetch_and_store(key, fetch, classify)
+
+    def fetch_and_store(self, key, fetch, classify=None):
+        try:
+            value = fetch()
+        except Exception as e:
+            failure = classify(e) if classify else None
+            if failure:
+                kind, status_code, payload = failure
+                self.store(key, make_entry(payload, kind=kind, status_code=status_code))
+            raise
+        self.store(key, make_entry(value))
+        return value
+
+    def _schedule_refresh(self, key, fetch, classify):
+        with self._refresh_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        if self.redis is not None and not self.redis.acquire_refresh_lease(key):
+            self._refreshing.discard(key)
+            return
+        count(self.stats, 'refreshes')
+        self._refresh_executor.submit(self._refresh, key, fetch, classify)
+
+    def _refresh(self, key, fetch, classify):
+        try:
+            value = fetch()
+            self.store(key, make_entry(value))
+        except Exception as e:
+            # Keep serving the stale copy; only definitive "not found" replaces it
+            failure = classify(e) if classify else None
+            if failure and failure[0] == 'not_found':
+                kind, status_code, payload = failure
+                self.store(key, make_entry(payload, kind=kind, status_code=status_code))
+            logger.warning(f"Background refresh failed for {key}: {str(e)}")
+        finally:
+            self._refreshing.discard(key)
+
+class AsyncMetadataCache:
+    """Non-blocking facade used by async_server; same entries and semantics."""
+
+    def __init__(self, redis_url=None, flight=None):
+        self.lru = LRUBackend(CACHE_CONFIG['lru_max_entries'], CACHE_CONFIG['lru_ttl'])
+        self.redis = AsyncRedisBackend(redis_url) if redis_url else None
+        self.flight = flight
+        self.stats = new_stats()
+        self._refreshing = set()
+        self._tasks = set()
+
+    @property
+    def backend(self):
+        return 'redis+lru' if self.redis else 'lru'
+
+    async def lookup(self, key):
+        entry = self.lru.get(key)
+        if entry is None and self.redis is not None:
+            entry = await self.redis.get(key)
+            if entry is not None:
+                self.lru.set(key, entry)
+        return entry if entry_state(entry) else None
+
+    async def store(self, key, entry):
+        self.lru.set(key, entry)
+        if self.redis is not None:
+            await self.redis.set(key, entry)
+
+    async def get_cached(self, key, fetch=None, classify=None):
+        entry = await self.lookup(key)
+        state = entry_state(entry)
+        if state is None:
+            return None
+        if entry['kind'] != 'ok':
+            count(self.stats, 'negative_hits')
+        elif state == 'stale':
+            count(self.stats, 'stale_hits')
+            if fetch is not None:
+                await self._schedule_refresh(key, fetch, classify)
+        else:
+            count(self.stats, 'hits')
+        return entry_result(entry)
+
+    async def get_or_fetch(self, key, fetch, classify=None):
+        cached = await self.get_cached(key, fetch, classify)
+        if cached is not None:
+            return cached
+        count(self.stats, 'misses')
+        if self.flight is None:
+            return await self.fetch_and_store(key, fetch, classify)
+        return await self.flight.do(key, lambda: self._settled_or_fetch(key, fetch, classify), load=lambda: self.settled(key))
+
+    async def settled(self, key):
+        entry = await self.lookup(key)
+        return entry_result(entry) if entry else None
+
+    async def _settled_or_fetch(self, key, fetch, classify):
+        # A worker elsewhere may have filled the entry since our miss
+        value = await self.settled(key)
+        if value is not None:
+            return value
+        return await self.fetch_and_store(key, fetch, classify)
+
+    async def fetch_and_store(self, key, fetch, classify=None):
+        try:
+            value = await fetch()
+        except Exception as e:
+            failure = classify(e) if classify else None
+            if failure:
+                kind, status_code, payload = failure
+                await self.store(key, make_entry(payload, kind=kind, status_code=status_code))
+            raise
+        await self.store(key, make_entry(value))
+        return value
+
+    async def _schedule_refresh(self, key, fetch, classify):
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+        if self.redis is not None and not await self.redis.acquire_refresh_lease(key):
+            self._refreshing.discard(key)
+            return
+        count(self.stats, 'refreshes')
+        task = asyncio.get_running_loop().create_task(self._refresh(key, fetch, classify))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refresh(self, key, fetch, classify):
+        try:
+            value = await fetch()
+            await self.store(key, make_entry(value))
+        except Exception as e:
+            failure = classify(e) if classify else None
+            if failure and failure[0] == 'not_found':
+                kind, status_code, payload = failure
+                await self.store(key, make_entry(payload, kind=kind, status_code=status_code))
+            logger.warning(f"Background refresh failed for {key}: {str(e)}")
+        finally:
+            self._refreshing.discard(key)
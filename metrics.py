@@ -0,0 +1,256 @@
+"""Prometheus metrics for the archive servers, Celery workers and ML pipeline.
+
+Metrics are module-level so any module can record into them, and an
+observation is a lock and an add, cheap enough for every request.
+
+With PROMETHEUS_MULTIPROC_DIR set (gunicorn workers, Celery prefork
+children) every process writes its samples to that directory and /metrics
+aggregates them; gunicorn.conf.py and instrument_celery() clean up after
+exited processes. Without it the default in-process registry is served.
+"""
+import os
+import time
+from urllib.parse import urlparse
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest, multiprocess, start_http_server
+)
+from prometheus_client.core import GaugeMetricFamily
+
+MULTIPROCESS = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+METRICS_CONFIG = {
+    'celery_port': int(os.environ.get('CELERY_METRICS_PORT', 5555)),
+    'broker_url': os.environ.get('CELERY_BROKER_URL') or os.environ.get('REDIS_URL'),
+    'queues': [q.strip() for q in os.environ.get('CELERY_QUEUES', 'celery,validate,fetch,capture,analyze,persist').split(',') if q.strip()],
+}
+
+# Upstream hosts get their own label value; anything else (validated target
+# URLs) is folded into "other" to keep cardinality bounded
+UPSTREAM_HOSTS = {'archive.ph', 'archive.is', 'archive.md', 'archive.today'}
+if os.environ.get('ARCHIVE_BASE_URL'):
+    UPSTREAM_HOSTS.add((urlparse(os.environ['ARCHIVE_BASE_URL']).hostname or '').lower())
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+FAST_BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, 1)
+TASK_BUCKETS = (.1, .5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900, 3600)
+
+REQUEST_LATENCY = Histogram(
+    'archive_http_request_duration_seconds', 'Request latency by route',
+    ['server', 'route', 'method'], buckets=LATENCY_BUCKETS
+)
+REQUESTS = Counter(
+    'archive_http_requests', 'Responses by route and status code',
+    ['server', 'route', 'method', 'status']
+)
+UPSTREAM_LATENCY = Histogram(
+    'archive_upstream_request_duration_seconds', 'Outbound request latency',
+    ['host', 'method'], buckets=LATENCY_BUCKETS
+)
+UPSTREAM_RESPONSES = Counter(
+    'archive_upstream_responses', 'Outbound responses by status code, "error" when none arrived',
+    ['host', 'status']
+)
+UPSTREAM_EVENTS = Counter(
+    'archive_upstream_governor_events', 'Governor throttles, fail-fast rejections and circuit opens',
+    ['host', 'event']
+)
+UPSTREAM_RATE = Gauge(
+    'archive_upstream_rate', 'Adaptive request rate per process (requests/second)',
+    ['host'], multiprocess_mode='liveall'
+)
+PARSE_SECONDS = Histogram(
+    'archive_parse_duration_seconds', 'ArchivePhParser parse time',
+    ['mode'], buckets=FAST_BUCKETS
+)
+CACHE_EVENTS = Counter(
+    'archive_metadata_cache_lookups', 'Metadata cache lookups by result', ['result']
+)
+RATE_LIMITED = Counter(
+    'archive_rate_limited', 'Requests rejected by the rate limiter', ['backend']
+)
+CELERY_TASK_SECONDS = Histogram(
+    'archive_celery_task_duration_seconds', 'Celery task run time by final state',
+    ['task', 'state'], buckets=TASK_BUCKETS
+)
+ML_STAGE_SECONDS = Histogram(
+    'archive_ml_stage_duration_seconds', 'MLAnalyzer.analyze_urls time per stage and batch',
+    ['stage'], buckets=FAST_BUCKETS
+)
+DB_POOL_CONNECTIONS = Gauge(
+    'archive_db_pool_connections', 'Database connections per process, open and checked out of the pool',
+    ['database', 'state'], multiprocess_mode='livesum'
+)
+DB_POOL_EVENTS = Counter(
+    'archive_db_pool_events', 'Connections opened, and invalidated as stale or broken',
+    ['database', 'event']
+)
+
+def upstream_host(url):
+    host = (urlparse(url).hostname or '').lower()
+    return host if host in UPSTREAM_HOSTS else 'other'
+
+def observe_upstream(url, method, status, seconds):
+    """Record one outbound call; ``status`` is the HTTP status or None on error."""
+    host = upstream_host(url)
+    UPSTREAM_LATENCY.labels(host, method).observe(seconds)
+    UPSTREAM_RESPONSES.labels(host, 'error' if status is None else str(status)).inc()
+
+def aiohttp_trace_config():
+    """TraceConfig recording every request made through an aiohttp ClientSession."""
+    import aiohttp
+
+    async def on_request_start(session, context, params):
+        context.started = time.perf_counter()
+
+    async def on_request_end(session, context, params):
+        observe_upstream(str(params.url), params.method, params.response.status,
+                         time.perf_counter() - context.started)
+
+    async def on_request_exception(session, context, params):
+        observe_upstream(str(params.url), params.method, None, time.perf_counter() - context.started)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+    return trace_config
+
+class CeleryQueueDepthCollector:
+    """Reports broker queue lengths at scrape time (Redis brokers only)."""
+
+    def __init__(self, broker_url, queues):
+        import redis
+
+        self.errors = (redis.RedisError,)
+        self.client = redis.Redis.from_url(broker_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.queues = queues
+
+    def collect(self):
+        gauge = GaugeMetricFamily('archive_celery_queue_depth', 'Messages waiting in the broker', labels=['queue'])
+        try:
+            for queue in self.queues:
+                gauge.add_metric([queue], self.client.llen(queue))
+        except self.errors:
+            pass
+        yield gauge
+
+_queue_collector = None
+
+def _extra_collectors():
+    global _queue_collector
+    broker_url = METRICS_CONFIG['broker_url']
+    if _queue_collector is None and broker_url and broker_url.startswith(('redis://', 'rediss://')):
+        _queue_collector = CeleryQueueDepthCollector(broker_url, METRICS_CONFIG['queues'])
+        if not MULTIPROCESS:
+            REGISTRY.register(_queue_collector)
+    return [_queue_collector] if _queue_collector is not None else []
+
+def build_registry():
+    """Registry to expose: a per-scrape multiprocess view, or the default registry."""
+    extra = _extra_collectors()
+    if not MULTIPROCESS:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    for collector in extra:
+        registry.register(collector)
+    return registry
+
+def render_latest():
+    """Return ``(body, content_type)`` for a /metrics response."""
+    return generate_latest(build_registry()), CONTENT_TYPE_LATEST
+
+def instrument_flask(app, server):
+    """Time every request by route and serve /metrics on a Flask app."""
+    from flask import Response, g, request
+
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            REQUEST_LATENCY.labels(server, route, request.method).observe(time.perf_counter() - started)
+            REQUESTS.labels(server, route, request.method, str(response.status_code)).inc()
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        body, content_type = render_latest()
+        return Response(body, content_type=content_type)
+
+class PrometheusMiddleware:
+    """Plain ASGI middleware timing requests by matched route template."""
+
+    def __init__(self, app, server):
+        self.app = app
+        self.server = server
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = ['500']
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status[0] = str(message['status'])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = getattr(scope.get('route'), 'path', 'unmatched')
+            REQUEST_LATENCY.labels(self.server, route, scope['method']).observe(time.perf_counter() - started)
+            REQUESTS.labels(self.server, route, scope['method'], status[0]).inc()
+
+def instrument_fastapi(app, server):
+    """Time every request by route and serve /metrics on a FastAPI app."""
+    from fastapi.responses import Response
+
+    app.add_middleware(PrometheusMiddleware, server=server)
+
+    @app.get('/metrics', include_in_schema=False)
+    async def metrics():
+        body, content_type = render_latest()
+        return Response(body, media_type=content_type)
+
+def instrument_celery():
+    """Record task durations and serve worker metrics on ``celery_port``."""
+    from celery.signals import celeryd_init, task_postrun, task_prerun, worker_process_shutdown, worker_ready
+
+    started = {}
+
+    @celeryd_init.connect(weak=False)
+    def _clear_multiprocess_dir(**kwargs):
+        # Files left by a previous run would be aggregated as live workers
+        if MULTIPROCESS:
+            path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+            for name in os.listdir(path):
+                if name.endswith('.db'):
+                    os.remove(os.path.join(path, name))
+
+    @worker_ready.connect(weak=False)
+    def _serve_metrics(**kwargs):
+        start_http_server(METRICS_CONFIG['celery_port'], registry=build_registry())
+
+    @task_prerun.connect(weak=False)
+    def _task_started(task_id=None, **kwargs):
+        started[task_id] = time.perf_counter()
+
+    @task_postrun.connect(weak=False)
+    def _task_finished(task_id=None, task=None, state=None, **kwargs):
+        t0 = started.pop(task_id, None)
+        if t0 is not None and task is not None:
+            CELERY_TASK_SECONDS.labels(task.name, state or 'UNKNOWN').observe(time.perf_counter() - t0)
+
+    @worker_process_shutdown.connect(weak=False)
+    def _mark_process_dead(pid=None, **kwargs):
+        if MULTIPROCESS:
+            multiprocess.mark_process_dead(pid or os.getpid())
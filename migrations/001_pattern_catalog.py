@@ -0,0 +1,134 @@
+"""Collapse duplicate Pattern rows into the deduplicated pattern catalog.
+
+Before the catalog every detection inserted its own Pattern row. This adds
+``patterns.pattern_key`` and ``patterns.usage_count``, keeps the lowest id of
+each (type, value) group with ``usage_count`` set to the group size, points
+``url_patterns`` at the survivors without duplicate links, and adds the
+unique indexes the catalog relies on.
+
+    python migrations/001_pattern_catalog.py --database-url postgresql://...
+
+Safe to re-run; steps that are already done are skipped.
+"""
+import argparse
+import logging
+import os
+import sys
+
+from sqlalchemy import bindparam, create_engine, delete, func, inspect, select, text, update
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Base, Pattern, url_patterns
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 5000
+
+def add_columns(conn):
+    """Add the catalog columns, returning True on the first run."""
+    columns = {column['name'] for column in inspect(conn).get_columns('patterns')}
+    if 'pattern_key' not in columns:
+        conn.execute(text('ALTER TABLE patterns ADD COLUMN pattern_key VARCHAR(64)'))
+    if 'usage_count' not in columns:
+        conn.execute(text('ALTER TABLE patterns ADD COLUMN usage_count INTEGER NOT NULL DEFAULT 0'))
+    return 'usage_count' not in columns
+
+def fill_keys(conn):
+    patterns = Pattern.__table__
+    statement = update(patterns).where(patterns.c.id == bindparam('pattern_id')).values(
+        pattern_key=bindparam('key')
+    )
+    filled = 0
+    while True:
+        rows = conn.execute(
+            select(patterns.c.id, patterns.c.pattern_type, patterns.c.pattern_value)
+            .where(patterns.c.pattern_key.is_(None)).limit(CHUNK_SIZE)
+        ).all()
+        if not rows:
+            return filled
+        conn.execute(statement, [
+            {'pattern_id': pattern_id, 'key': Pattern.make_key(pattern_type, pattern_value)}
+            for pattern_id, pattern_type, pattern_value in rows
+        ])
+        filled += len(rows)
+
+def merge_duplicates(conn, count_uses):
+    """Point links at each group's lowest id and delete the other rows."""
+    patterns = Pattern.__table__
+    groups = conn.execute(
+        select(patterns.c.pattern_key, func.min(patterns.c.id), func.count(), func.max(patterns.c.confidence_score))
+        .group_by(patterns.c.pattern_key)
+    ).all()
+    survivors = {key: (keep, uses, confidence) for key, keep, uses, confidence in groups}
+
+    remap = []
+    for pattern_id, key in conn.execute(select(patterns.c.id, patterns.c.pattern_key)):
+        keep = survivors[key][0]
+        if pattern_id != keep:
+            remap.append({'old_id': pattern_id, 'new_id': keep})
+    if remap:
+        conn.execute(
+            update(url_patterns).where(url_patterns.c.pattern_id == bindparam('old_id')).values(
+                pattern_id=bindparam('new_id')
+            ),
+            remap
+        )
+        for start in range(0, len(remap), CHUNK_SIZE):
+            conn.execute(delete(patterns).where(
+                patterns.c.id.in_([row['old_id'] for row in remap[start:start + CHUNK_SIZE]])
+            ))
+
+    if not count_uses:
+        return len(remap)
+    # Each pre-catalog row was one detection
+    conn.execute(
+        update(patterns).where(patterns.c.id == bindparam('keep_id')).values(
+            usage_count=bindparam('uses'), confidence_score=bindparam('confidence')
+        ),
+        [
+            {'keep_id': keep, 'uses': uses, 'confidence': confidence}
+            for keep, uses, confidence in survivors.values()
+        ]
+    )
+    return len(remap)
+
+def dedupe_links(conn):
+    """Rebuild url_patterns with one row per (url, pattern)."""
+    replacement = url_patterns.to_metadata(Base.metadata, name='url_patterns_dedup')
+    replacement.create(conn)
+    conn.execute(replacement.insert().from_select(
+        ['url_id', 'pattern_id'],
+        select(url_patterns.c.url_id, url_patterns.c.pattern_id).distinct()
+    ))
+    before = conn.execute(select(func.count()).select_from(url_patterns)).scalar()
+    after = conn.execute(select(func.count()).select_from(replacement)).scalar()
+    conn.execute(text('DROP TABLE url_patterns'))
+    conn.execute(text('ALTER TABLE url_patterns_dedup RENAME TO url_patterns'))
+    return before - after
+
+def create_indexes(conn):
+    existing = {index['name'] for index in inspect(conn).get_indexes('patterns')}
+    for index in Pattern.__table__.indexes:
+        if index.name not in existing:
+            index.create(conn)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', 'sqlite:///url_analyzer.db'))
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    with engine.begin() as conn:
+        link_indexes = {index['name'] for index in inspect(conn).get_indexes('url_patterns')}
+        first_run = add_columns(conn)
+        logger.info(f"Filled pattern_key for {fill_keys(conn)} patterns")
+        logger.info(f"Merged {merge_duplicates(conn, first_run)} duplicate patterns")
+        if 'uq_url_patterns_url_pattern' not in link_indexes:
+            logger.info(f"Removed {dedupe_links(conn)} duplicate url_patterns links")
+        create_indexes(conn)
+    logger.info("Pattern catalog migration complete")
+
+if __name__ == '__main__':
+    main()
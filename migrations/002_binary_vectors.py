@@ -0,0 +1,90 @@
+"""Convert JSON vector columns to the binary VectorType format.
+
+Rewrites ``urls.content_embedding`` and ``archive_metadata.feature_vector``
+from JSON float lists to packed float32 bytes (see vector_type.py). Each
+column is copied into a ``<column>_bin`` column in chunks, then swapped in
+for the JSON column.
+
+    python migrations/002_binary_vectors.py --database-url postgresql://...
+
+Safe to re-run: converted columns are skipped and an interrupted copy
+resumes where it stopped. Needs SQLite 3.35+ for DROP COLUMN.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+from sqlalchemy import JSON, LargeBinary, bindparam, column, create_engine, inspect, select, table, text, update
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vector_type import encode_vector
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 2000
+
+VECTOR_COLUMNS = [
+    ('urls', 'content_embedding'),
+    ('archive_metadata', 'feature_vector'),
+]
+
+def is_binary(column_info):
+    return isinstance(column_info['type'], LargeBinary) or \
+        column_info['type'].__class__.__name__.upper() in ('BYTEA', 'BLOB')
+
+def convert_column(conn, table_name, column_name):
+    columns = {info['name']: info for info in inspect(conn).get_columns(table_name)}
+    if column_name not in columns:
+        logger.info(f"{table_name}.{column_name} does not exist, skipping")
+        return
+    binary_name = f'{column_name}_bin'
+    if is_binary(columns[column_name]) and binary_name not in columns:
+        logger.info(f"{table_name}.{column_name} is already binary")
+        return
+    if binary_name not in columns:
+        binary_type = LargeBinary().compile(dialect=conn.dialect)
+        conn.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {binary_name} {binary_type}'))
+
+    source = table(table_name, column('id'), column(column_name, JSON), column(binary_name, LargeBinary))
+    statement = update(source).where(source.c.id == bindparam('row_id')).values(
+        {binary_name: bindparam('packed')}
+    )
+    converted = last_id = 0
+    while True:
+        rows = conn.execute(
+            select(source.c.id, source.c[column_name])
+            .where(source.c.id > last_id, source.c[column_name].isnot(None), source.c[binary_name].is_(None))
+            .order_by(source.c.id).limit(CHUNK_SIZE)
+        ).all()
+        if not rows:
+            break
+        conn.execute(statement, [
+            {'row_id': row_id, 'packed': encode_vector(json.loads(value) if isinstance(value, str) else value)}
+            for row_id, value in rows
+        ])
+        converted += len(rows)
+        last_id = rows[-1][0]
+        logger.info(f"{table_name}.{column_name}: {converted} rows converted")
+
+    conn.execute(text(f'ALTER TABLE {table_name} DROP COLUMN {column_name}'))
+    conn.execute(text(f'ALTER TABLE {table_name} RENAME COLUMN {binary_name} TO {column_name}'))
+    logger.info(f"{table_name}.{column_name} now stores binary vectors ({converted} rows)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', 'sqlite:///url_analyzer.db'))
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    for table_name, column_name in VECTOR_COLUMNS:
+        # One transaction per column; a failed copy leaves the JSON column untouched
+        with engine.begin() as conn:
+            convert_column(conn, table_name, column_name)
+    logger.info("Binary vector migration complete")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Move URL features from per-feature url_features rows to the wide table.
+
+Creates ``url_feature_values`` and ``feature_stats``. Each URL's latest value
+of every feature in ``url_features`` becomes one wide row. The running
+statistics are then rebuilt from those rows and ``url_features`` is dropped.
+
+    python migrations/003_wide_features.py --database-url postgresql://...
+
+Safe to re-run; once url_features is gone only the tables are checked.
+"""
+import argparse
+import logging
+import os
+import sys
+
+from sqlalchemy import DateTime, Float, column, create_engine, insert, inspect, select, table, text
+from sqlalchemy.orm import Session
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from feature_store import FeatureStore
+from models import FEATURE_NAMES, FeatureStat, URLFeature
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 5000
+
+def copy_features(conn):
+    """Pivot url_features into one row per URL, keeping each feature's latest value."""
+    old = table('url_features', column('id'), column('url_id'), column('feature_name'),
+                column('feature_value', Float), column('last_updated', DateTime))
+    rows = {}
+    result = conn.execution_options(yield_per=CHUNK_SIZE).execute(
+        select(old.c.url_id, old.c.feature_name, old.c.feature_value, old.c.last_updated)
+        .where(old.c.feature_name.in_(FEATURE_NAMES)).order_by(old.c.id)
+    )
+    for url_id, feature_name, feature_value, last_updated in result:
+        row = rows.setdefault(url_id, {'url_id': url_id})
+        row[feature_name] = feature_value
+        row['last_updated'] = last_updated
+    values = [
+        {name: row.get(name) for name in ('url_id', 'last_updated') + FEATURE_NAMES}
+        for row in rows.values()
+    ]
+    for start in range(0, len(values), CHUNK_SIZE):
+        conn.execute(insert(URLFeature), values[start:start + CHUNK_SIZE])
+    return len(values)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', 'sqlite:///url_analyzer.db'))
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    with engine.begin() as conn:
+        URLFeature.__table__.create(conn, checkfirst=True)
+        FeatureStat.__table__.create(conn, checkfirst=True)
+        if 'url_features' in inspect(conn).get_table_names():
+            logger.info(f"Copied features of {copy_features(conn)} URLs")
+            with Session(bind=conn) as session:
+                logger.info(f"Rebuilt statistics for {FeatureStore().rebuild(session)} features")
+            conn.execute(text('DROP TABLE url_features'))
+    logger.info("Wide feature migration complete")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""Add near-duplicate detection storage.
+
+Adds ``urls.content_minhash`` and the ``minhash_bands`` LSH table. Page
+text is not stored, so existing URLs get signatures the next time they are
+analyzed or archived.
+
+    python migrations/004_near_duplicates.py --database-url postgresql://...
+
+Safe to re-run.
+"""
+import argparse
+import logging
+import os
+import sys
+
+from sqlalchemy import LargeBinary, create_engine, inspect, text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import minhash_bands
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+logger = logging.getLogger(__name__)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', 'sqlite:///url_analyzer.db'))
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    with engine.begin() as conn:
+        columns = {column['name'] for column in inspect(conn).get_columns('urls')}
+        if 'content_minhash' not in columns:
+            binary_type = LargeBinary().compile(dialect=conn.dialect)
+            conn.execute(text(f'ALTER TABLE urls ADD COLUMN content_minhash {binary_type}'))
+            logger.info("Added urls.content_minhash")
+        minhash_bands.create(conn, checkfirst=True)
+    logger.info("Near-duplicate migration complete")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""Key URL rows by normalized URL and index the lookup columns.
+
+Adds ``urls.url_key`` (SHA-256 of the normalized URL) and fills it. Rows
+sharing a key are merged into the lowest id, which is the row analyze_urls
+always updated. The merged row sums the group's access counts and keeps the
+latest capture if it has none of its own. Features, metadata, pattern links
+and MinHash bands are pointed at the surviving row. Then the unique key index
+and the foreign key and filter indexes from models.py are created.
+
+    python migrations/005_url_keys.py --database-url postgresql://...
+
+Safe to re-run; steps that are already done are skipped.
+"""
+import argparse
+import logging
+import os
+import sys
+from collections import defaultdict
+
+from sqlalchemy import bindparam, create_engine, delete, func, inspect, select, text, update
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import URL, ArchiveMetadata, URLFeature, minhash_bands, url_patterns
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 5000
+
+INDEXED_TABLES = (URL.__table__, ArchiveMetadata.__table__, URLFeature.__table__, url_patterns)
+
+def fill_keys(conn):
+    urls = URL.__table__
+    if 'url_key' not in {column['name'] for column in inspect(conn).get_columns('urls')}:
+        conn.execute(text('ALTER TABLE urls ADD COLUMN url_key VARCHAR(64)'))
+    statement = update(urls).where(urls.c.id == bindparam('target_id')).values(url_key=bindparam('key'))
+    filled = 0
+    while True:
+        rows = conn.execute(
+            select(urls.c.id, urls.c.original_url).where(urls.c.url_key.is_(None)).limit(CHUNK_SIZE)
+        ).all()
+        if not rows:
+            return filled
+        conn.execute(statement, [{'target_id': url_id, 'key': URL.make_key(url)} for url_id, url in rows])
+        filled += len(rows)
+
+def merge_duplicates(conn):
+    """Fold every row into its key's lowest id; returns the number of rows removed."""
+    urls = URL.__table__
+    duplicate_keys = select(urls.c.url_key).group_by(urls.c.url_key).having(func.count() > 1)
+    groups = defaultdict(list)
+    for row in conn.execute(
+        select(urls.c.id, urls.c.url_key, urls.c.archive_url, urls.c.archive_date, urls.c.access_count)
+        .where(urls.c.url_key.in_(duplicate_keys)).order_by(urls.c.id)
+    ):
+        groups[row.url_key].append(row)
+    if not groups:
+        return 0
+
+    remap, survivors = [], []
+    for rows in groups.values():
+        keep = rows[0]
+        archived = [row for row in rows if row.archive_url]
+        latest = max(archived, key=lambda row: (row.archive_date is not None, row.archive_date, row.id)) \
+            if archived else None
+        survivors.append({
+            'keep_id': keep.id,
+            'visits': sum(row.access_count or 0 for row in rows),
+            'archived_url': keep.archive_url or (latest.archive_url if latest else None),
+            'archived_date': keep.archive_date if keep.archive_url else (latest.archive_date if latest else None)
+        })
+        remap.extend({'old_id': row.id, 'new_id': keep.id} for row in rows[1:])
+
+    conn.execute(
+        update(urls).where(urls.c.id == bindparam('keep_id')).values(
+            access_count=bindparam('visits'),
+            archive_url=bindparam('archived_url'),
+            archive_date=bindparam('archived_date')
+        ),
+        survivors
+    )
+    for table in (ArchiveMetadata.__table__, URLFeature.__table__):
+        conn.execute(
+            update(table).where(table.c.url_id == bindparam('old_id')).values(url_id=bindparam('new_id')),
+            remap
+        )
+    # Link tables are unique per URL: copy links the survivor lacks, then drop the old ones
+    for table, other in ((url_patterns, url_patterns.c.pattern_id), (minhash_bands, minhash_bands.c.band_key)):
+        new_ids = {row['old_id']: row['new_id'] for row in remap}
+        old_ids = list(new_ids)
+        for start in range(0, len(old_ids), CHUNK_SIZE):
+            chunk = old_ids[start:start + CHUNK_SIZE]
+            moved = {
+                (new_ids[url_id], value)
+                for url_id, value in conn.execute(select(table.c.url_id, other).where(table.c.url_id.in_(chunk)))
+            }
+            kept = {
+                tuple(row) for row in conn.execute(
+                    select(table.c.url_id, other).where(table.c.url_id.in_({url_id for url_id, _ in moved}))
+                )
+            } if moved else set()
+            rows = [{'url_id': url_id, other.name: value} for url_id, value in sorted(moved - kept)]
+            if rows:
+                conn.execute(table.insert(), rows)
+            conn.execute(delete(table).where(table.c.url_id.in_(chunk)))
+    old_ids = [row['old_id'] for row in remap]
+    for start in range(0, len(old_ids), CHUNK_SIZE):
+        conn.execute(delete(urls).where(urls.c.id.in_(old_ids[start:start + CHUNK_SIZE])))
+    return len(remap)
+
+def create_indexes(conn):
+    created = 0
+    for table in INDEXED_TABLES:
+        existing = {index['name'] for index in inspect(conn).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(conn)
+                created += 1
+    return created
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', 'sqlite:///url_analyzer.db'))
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    with engine.begin() as conn:
+        logger.info(f"Filled url_key for {fill_keys(conn)} URLs")
+        logger.info(f"Merged {merge_duplicates(conn)} duplicate URL rows")
+        logger.info(f"Created {create_indexes(conn)} indexes")
+    logger.info("URL key migration complete")
+
+if __name__ == '__main__':
+    main()
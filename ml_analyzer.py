@@ -1,26 +1,100 @@
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.base import clone
 from sklearn.cluster import DBSCAN
 from sklearn.preprocessing import StandardScaler
-from sklearn.metrics.pairwise import cosine_similarity
 import joblib
 from datetime import datetime
 import hashlib
-from typing import List, Dict, Any, Optional
-from sqlalchemy.orm import Session
-from models import URL, ArchiveMetadata, Pattern, URLFeature
 import json
+from typing import List, Dict, Any, Optional, Tuple, Union
+from sqlalchemy import bindparam, event, func, insert, select, update
+from sqlalchemy.orm import Session, scoped_session
+from database import insert_ignoring_conflicts
+from models import URL, ArchiveMetadata, Pattern, url_patterns
+from embedding_engine import EmbeddingEngine
+from feature_store import FeatureStore
+from clustering import CLUSTERING_CONFIG, NOISE, ClusterModel
+from near_duplicates import NearDuplicateIndex
+from pattern_index import PATTERN_INDEX_CONFIG, PatternIndex
+from pattern_catalog import PatternCatalog
+from url_classifier import classify_url
+from url_store import upsert_urls
+from metrics import ML_STAGE_SECONDS
+from model_store import MODEL_STORE_CONFIG, get_model_store
+import logging
 import re
-from collections import defaultdict
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# analyze_urls stage timers, bound once so timing a stage is a single observation
+STAGE_TIMERS = {
+    stage: ML_STAGE_SECONDS.labels(stage)
+    for stage in ('features', 'hash', 'dedup', 'embedding', 'patterns', 'persist', 'similarity', 'commit')
+}
+
+# URLs per IN (...) lookup, well under SQLite's bound parameter limit
+LOOKUP_CHUNK_SIZE = 500
+
+# Content scoring above this against a content pattern is known; anything else becomes a new one
+KNOWN_PATTERN_SCORE = 0.8
+CONTENT_PATTERN_TYPE = 'content_embedding'
+
+# Content structure checks in detect_patterns
+JSON_CONTENT = re.compile(r'^\s*{.*}\s*$', re.DOTALL)
+HTML_CONTENT = re.compile(r'<[^>]+>')
+MARKDOWN_CONTENT = re.compile(r'[#*_`]')
+
+# First matching pattern decides the category shown in the frontend
+CONTENT_CATEGORIES = [
+    ('url_structure_is_social_media', 'Social media'),
+    ('url_structure_is_archive', 'Archive'),
+    ('content_structure_has_json', 'Data'),
+    ('url_structure_has_date', 'News / blog post'),
+]
+
+def categorize(patterns: List[Dict[str, Any]]) -> str:
+    detected = {p['pattern_type'] for p in patterns}
+    for pattern_type, category in CONTENT_CATEGORIES:
+        if pattern_type in detected:
+            return category
+    return 'Web page'
+
+def summarize(content: str, max_chars: int = 300) -> str:
+    """Leading sentences of the content, cut at a word boundary."""
+    text = ' '.join((content or '').split())
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    sentence_end = cut.rfind('. ')
+    if sentence_end > max_chars // 2:
+        return cut[:sentence_end + 1]
+    return cut.rsplit(' ', 1)[0] + '…'
 
 class MLAnalyzer:
-    def __init__(self, session: Session):
+    def __init__(self, session: Union[Session, scoped_session], model_path: Optional[str] = None):
+        # A scoped_session registry gives each task or request its own session
         self.session = session
-        self.vectorizer = TfidfVectorizer(max_features=1000)
+        # Models are read from model_path on first use and again whenever the file is replaced
+        self.model_store = get_model_store(model_path) if model_path else None
+        self.models_version = None
+        self.embedder = EmbeddingEngine()
         self.scaler = StandardScaler()
         self.clusterer = DBSCAN(eps=0.3, min_samples=2)
+        self.cluster_model = ClusterModel(self.clusterer, self.scaler)
         self.feature_importance = {}
-        self.pattern_cache = {}
+        self.feature_store = FeatureStore()
+        self.near_duplicates = NearDuplicateIndex()
+        self.catalog = PatternCatalog()
+        self.pattern_index = PatternIndex(self.embedder.n_features)
+        self.pattern_index_loaded = None
+        # Requests on other threads share the models and index; each brings its own session
+        self._model_lock = threading.RLock()
+        # Keep the index in step with Pattern rows committed through these sessions
+        event.listen(session, 'after_flush', self._track_pattern_changes)
+        event.listen(session, 'after_commit', self._apply_pattern_changes)
+        event.listen(session, 'after_rollback', self._discard_pattern_changes)
         
     def compute_content_hash(self, content: str) -> str:
         """Generate a hash of the content for duplicate detection."""
@@ -50,28 +124,29 @@ class MLAnalyzer:
         """Compute vector embedding for content."""
         if not content:
             return []
-            
-        # Transform content to TF-IDF vector
-        try:
-            vector = self.vectorizer.transform([content]).toarray()[0]
-            return vector.tolist()
-        except Exception:
-            # If vectorizer not fitted, fit it first
-            self.vectorizer.fit([content])
-            vector = self.vectorizer.transform([content]).toarray()[0]
-            return vector.tolist()
+        return self.compute_embeddings([content])[0].tolist()
+
+    def compute_embeddings(self, contents: List[str]) -> np.ndarray:
+        """Embed a batch of documents into one fixed-dimension space.
+
+        Returns an (n, dimension) array with L2-normalized rows; the batch
+        also updates the IDF weights.
+        """
+        self.refresh_models()
+        return self.embedder.embed(contents)
             
     def detect_patterns(self, url: str, content: str) -> List[Dict[str, Any]]:
         """Detect patterns in URL and content."""
         patterns = []
         
         # URL structure patterns
+        info = classify_url(url)
         url_patterns = {
-            'has_date': bool(re.search(r'\d{4}[-/]\d{2}[-/]\d{2}', url)),
+            'has_date': info.date is not None,
             'has_query_params': '?' in url,
             'has_fragment': '#' in url,
-            'is_archive': bool(re.search(r'archive\.(ph|is|today)', url)),
-            'is_social_media': bool(re.search(r'(twitter|x|facebook|instagram)\.com', url))
+            'is_archive': info.kind == 'archive',
+            'is_social_media': info.kind in ('tweet', 'social')
         }
         
         for pattern_type, is_present in url_patterns.items():
@@ -86,9 +161,9 @@ class MLAnalyzer:
         if content:
             # Detect common content structures
             content_patterns = {
-                'has_json': bool(re.search(r'^\s*{.*}\s*$', content, re.DOTALL)),
-                'has_html': bool(re.search(r'<[^>]+>', content)),
-                'has_markdown': bool(re.search(r'[#*_`]', content))
+                'has_json': bool(JSON_CONTENT.search(content)),
+                'has_html': bool(HTML_CONTENT.search(content)),
+                'has_markdown': bool(MARKDOWN_CONTENT.search(content))
             }
             
             for pattern_type, is_present in content_patterns.items():
@@ -103,124 +178,400 @@ class MLAnalyzer:
         
     def compute_similarity_score(self, url: URL) -> float:
         """Compute similarity score against known patterns."""
-        if not url.content_embedding:
-            return 0.0
-            
-        # Get all patterns from cache or database
-        if not self.pattern_cache:
-            patterns = self.session.query(Pattern).filter_by(is_active=True).all()
-            self.pattern_cache = {p.id: p for p in patterns}
-        
-        if not self.pattern_cache:
+        if url.content_embedding is None or not len(url.content_embedding):
             return 0.0
-            
-        # Compute similarity against each pattern
-        similarities = []
-        for pattern in self.pattern_cache.values():
-            try:
-                pattern_embedding = json.loads(pattern.pattern_value) if isinstance(pattern.pattern_value, str) else pattern.pattern_value
-                if pattern_embedding and len(pattern_embedding) == len(url.content_embedding):
-                    similarity = cosine_similarity(
-                        [url.content_embedding],
-                        [pattern_embedding]
-                    )[0][0]
-                    similarities.append(similarity * pattern.confidence_score)
-            except Exception:
-                continue
-                
-        return max(similarities) if similarities else 0.0
+        return self.load_pattern_index().max_score(url.content_embedding)
+
+    def load_pattern_index(self) -> PatternIndex:
+        """Return the pattern index, rebuilding it when it is missing or stale.
+
+        Changes committed through this session are applied as they happen;
+        the periodic rebuild picks up changes made by other workers.
+        """
+        if self._pattern_index_fresh():
+            return self.pattern_index
+        with self._model_lock:
+            # Another thread may have rebuilt it while this one waited
+            if self._pattern_index_fresh():
+                return self.pattern_index
+            index = PatternIndex(self.embedder.n_features)
+            rows = self.session.execute(
+                select(Pattern.id, Pattern.pattern_value, Pattern.confidence_score).where(
+                    Pattern.is_active.is_(True),
+                    Pattern.pattern_value.like('[%')  # only embedding-valued patterns are scored
+                ).execution_options(yield_per=5000)
+            )
+            for chunk in rows.partitions():
+                index.add_many(*zip(*chunk))
+            self.pattern_index = index
+            self.pattern_index_loaded = time.monotonic()
+            return index
+
+    def _pattern_index_fresh(self) -> bool:
+        loaded = self.pattern_index_loaded
+        return loaded is not None and time.monotonic() - loaded < PATTERN_INDEX_CONFIG['refresh_seconds']
+
+    def invalidate_pattern_index(self):
+        """Force a rebuild, e.g. after a bulk UPDATE that bypassed the ORM."""
+        self.pattern_index_loaded = None
+
+    @staticmethod
+    def _transaction_state(session) -> Dict[str, Any]:
+        """Pattern bookkeeping for the session's open transaction.
+
+        Kept in ``session.info`` rather than on the analyzer, so concurrent
+        requests each track their own transaction.
+        """
+        return session.info.setdefault('ml_analyzer', {
+            'pattern_changes': {},
+            'catalog_pending': False  # catalog rows inserted in the open transaction
+        })
+
+    def _track_pattern_changes(self, session, flush_context):
+        changes = self._transaction_state(session)['pattern_changes']
+        for obj in list(session.new) + list(session.dirty):
+            if isinstance(obj, Pattern):
+                changes[obj.id] = (obj.is_active, obj.pattern_value, obj.confidence_score)
+        for obj in session.deleted:
+            if isinstance(obj, Pattern):
+                changes[obj.id] = None
+
+    def _apply_pattern_changes(self, session):
+        state = session.info.pop('ml_analyzer', None)
+        if not state:
+            return
+        index = self.pattern_index
+        for pattern_id, change in state['pattern_changes'].items():
+            # Deleted, deactivated, or no longer an embedding
+            if change is None or change[0] is False or not index.add(pattern_id, change[1], change[2]):
+                index.remove(pattern_id)
+
+    def _discard_pattern_changes(self, session):
+        state = session.info.pop('ml_analyzer', None)
+        # Catalog rows created in the rolled-back transaction no longer exist
+        if state and state['catalog_pending']:
+            self.catalog.forget()
         
     def update_feature_importance(self):
-        """Update feature importance scores based on URL clusters."""
-        features = self.session.query(URLFeature).all()
-        feature_values = defaultdict(list)
-        
-        for feature in features:
-            feature_values[feature.feature_name].append(feature.feature_value)
-            
-        for feature_name, values in feature_values.items():
-            if len(values) > 1:
-                # Compute importance based on variance and mean
-                variance = np.var(values)
-                mean = np.mean(values)
-                importance = variance / (mean if mean != 0 else 1)
-                self.feature_importance[feature_name] = importance
+        """Update feature importance scores from the running feature statistics."""
+        self.refresh_models()
+        self.feature_importance.update(self.feature_store.importance(self.session))
                 
-    def analyze_url(self, url: str, content: str) -> Dict[str, Any]:
-        """Analyze a URL and its content, updating the ML models."""
-        # Extract features
-        features = self.extract_features(url, content)
-        content_hash = self.compute_content_hash(content)
-        content_embedding = self.compute_embedding(content)
-        patterns = self.detect_patterns(url, content)
-        
-        # Create or update URL record
-        url_obj = self.session.query(URL).filter_by(original_url=url).first()
-        if not url_obj:
-            url_obj = URL(
-                original_url=url,
-                content_hash=content_hash,
-                content_embedding=content_embedding,
-                created_at=datetime.utcnow()
+    def cluster_inputs(self, rows) -> Tuple[List[int], np.ndarray, np.ndarray]:
+        """Embeddings and latest features for ``(url_id, content_embedding)`` rows.
+
+        Rows without a usable embedding are left out of the returned ids.
+        """
+        dimension = self.embedder.n_features
+        usable = [(url_id, embedding) for url_id, embedding in rows
+                  if embedding is not None and len(embedding) == dimension]
+        url_ids = [url_id for url_id, _ in usable]
+        if not usable:
+            return url_ids, np.zeros((0, dimension), dtype=np.float32), np.zeros((0, len(self.feature_store.feature_names)))
+        embeddings = np.stack([embedding for _, embedding in usable])
+        feature_ids, matrix = self.feature_store.feature_matrix(self.session, url_ids)
+        # Rows come oldest first, so each URL ends up with its latest analysis
+        latest = dict(zip(feature_ids.tolist(), matrix))
+        missing = np.full(matrix.shape[1], np.nan)
+        return url_ids, embeddings, np.array([latest.get(url_id, missing) for url_id in url_ids])
+
+    def fit_clusters(self, sample_size: Optional[int] = None) -> int:
+        """Fit the clusterer on a random sample of analyzed URLs; returns the sample size used."""
+        self.refresh_models()
+        sample_size = sample_size or CLUSTERING_CONFIG['fit_sample']
+        rows = self.session.execute(
+            select(URL.id, URL.content_embedding)
+            .where(URL.content_embedding.isnot(None))
+            .order_by(func.random()).limit(sample_size)
+        ).all()
+        url_ids, embeddings, features = self.cluster_inputs(rows)
+        if len(url_ids) < self.clusterer.min_samples:
+            return 0
+        self.cluster_model.fit(embeddings, features)
+        return len(url_ids)
+
+    def assign_clusters(self, reassign: bool = False) -> int:
+        """Write ``cluster_id`` for URLs in bulk, one chunk and commit at a time.
+
+        Only URLs without a cluster are labelled unless ``reassign``, which
+        relabels everything after a refit. Returns the number of URLs written.
+        """
+        self.refresh_models()
+        if not self.cluster_model.fitted:
+            return 0
+        chunk_size = CLUSTERING_CONFIG['assign_chunk_size']
+        written = last_id = 0
+        while True:
+            query = (
+                select(URL.id, URL.content_embedding)
+                .outerjoin(ArchiveMetadata, ArchiveMetadata.url_id == URL.id)
+                .where(URL.id > last_id, URL.content_embedding.isnot(None))
             )
-            self.session.add(url_obj)
-        else:
-            url_obj.last_accessed = datetime.utcnow()
-            url_obj.access_count += 1
-            url_obj.content_embedding = content_embedding
-            
-        # Update features
-        for feature_name, feature_value in features.items():
-            feature = URLFeature(
-                url=url_obj,
-                feature_name=feature_name,
-                feature_value=feature_value,
-                importance_score=self.feature_importance.get(feature_name, 0.0)
+            if not reassign:
+                query = query.where(ArchiveMetadata.cluster_id.is_(None))
+            rows = list(dict(self.session.execute(query.order_by(URL.id).limit(chunk_size)).all()).items())
+            if not rows:
+                return written
+            last_id = rows[-1][0]
+            url_ids, embeddings, features = self.cluster_inputs(rows)
+            labels = dict(zip(url_ids, self.cluster_model.predict(embeddings, features).tolist()))
+            try:
+                self.write_cluster_ids({url_id: labels.get(url_id, NOISE) for url_id, _ in rows})
+                self.session.commit()
+            except Exception:
+                self.session.rollback()
+                raise
+            written += len(rows)
+
+    def write_cluster_ids(self, labels: Dict[int, int]):
+        """Set ArchiveMetadata.cluster_id per URL with one executemany UPDATE, inserting missing rows."""
+        table = ArchiveMetadata.__table__
+        url_ids = list(labels)
+        existing = set()
+        for start in range(0, len(url_ids), LOOKUP_CHUNK_SIZE):
+            existing.update(self.session.scalars(
+                select(table.c.url_id).where(table.c.url_id.in_(url_ids[start:start + LOOKUP_CHUNK_SIZE]))
+            ))
+        if existing:
+            self.session.execute(
+                update(table).where(table.c.url_id == bindparam('target_url_id')).values(cluster_id=bindparam('label')),
+                [{'target_url_id': url_id, 'label': labels[url_id]} for url_id in existing]
             )
-            self.session.add(feature)
-            
-        # Update patterns
-        for pattern_data in patterns:
-            pattern = Pattern(
-                pattern_type=pattern_data['pattern_type'],
-                pattern_value=pattern_data['pattern_value'],
-                confidence_score=pattern_data['confidence_score']
+        missing = [url_id for url_id in url_ids if url_id not in existing]
+        if missing:
+            self.session.execute(insert(table), [{'url_id': url_id, 'cluster_id': labels[url_id]} for url_id in missing])
+
+    def analyze_url(self, url: str, content: str) -> Dict[str, Any]:
+        """Analyze a URL and its content, updating the ML models."""
+        return self.analyze_urls([(url, content)])[0]
+
+    def analyze_urls(self, batch: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """Analyze ``(url, content)`` pairs with batched database writes.
+
+        Existing URLs are looked up in one query per chunk, feature rows and
+        pattern links are inserted with executemany, detected patterns map
+        onto the shared catalog, and the batch commits once. Content that
+        is identical to an analyzed near-duplicate reuses that URL's
+        embedding and score and reports it as ``duplicate_of``. Content that
+        scores at most ``KNOWN_PATTERN_SCORE`` against every content pattern
+        is stored as a new one, so later pages like it score as known.
+        Results are returned in input order.
+        """
+        if not batch:
+            return []
+        urls = [url for url, _ in batch]
+        contents = [content or '' for _, content in batch]
+
+        with STAGE_TIMERS['features'].time():
+            features = [self.extract_features(url, content) for url, content in batch]
+        with STAGE_TIMERS['hash'].time():
+            hashes = [self.compute_content_hash(content) for content in contents]
+            # Fingerprint each distinct text once
+            fingerprints = {}
+            for content_hash, content in zip(hashes, contents):
+                if content_hash not in fingerprints:
+                    fingerprints[content_hash] = self.near_duplicates.signature(content)
+            signatures = [fingerprints[content_hash] for content_hash in hashes]
+        with STAGE_TIMERS['dedup'].time():
+            duplicates = self.find_analyzed_duplicates(signatures, hashes)
+        with STAGE_TIMERS['embedding'].time():
+            # Copies of analyzed content reuse its embedding and score
+            fresh = [i for i in range(len(batch)) if i not in duplicates]
+            vectors = self.compute_embeddings([contents[i] for i in fresh]) if fresh else []
+            embeddings = [None] * len(batch)
+            for i, vector in zip(fresh, vectors):
+                # Arrays go straight to the binary column; empty content keeps an empty vector
+                embeddings[i] = vector if contents[i] else vector[:0]
+        with STAGE_TIMERS['patterns'].time():
+            patterns = [self.detect_patterns(url, content) for url, content in batch]
+        with STAGE_TIMERS['similarity'].time():
+            scores = [0.0] * len(batch)
+            index = self.load_pattern_index()
+            novel = []  # embeddings of content patterns this batch creates
+            content_patterns = {}
+            for i, vector in zip(fresh, vectors):
+                if not contents[i]:
+                    continue
+                scores[i] = index.max_score(vector)
+                # Rows are unit vectors, so a dot product is their cosine similarity
+                if scores[i] <= KNOWN_PATTERN_SCORE and all(float(seen @ vector) <= KNOWN_PATTERN_SCORE for seen in novel):
+                    novel.append(vector)
+                    content_patterns[i] = self.content_pattern(vector)
+            for i, (_, embedding, score) in duplicates.items():
+                embeddings[i] = embedding
+                scores[i] = score or 0.0
+
+        persist_started = time.perf_counter()
+        now = datetime.utcnow()
+        try:
+            # Look up URL records by key, upserting the missing ones in one batch
+            url_objs, inserted = upsert_urls(self.session, list(dict.fromkeys(urls)), now)
+
+            reindex = {}  # URLs whose signature changed
+            for url, content_hash, signature, embedding, score in zip(urls, hashes, signatures, embeddings, scores):
+                url_obj = url_objs[url]
+                if url_obj.content_minhash != signature:
+                    reindex[url_obj.id] = signature
+                if url not in inserted:
+                    url_obj.last_accessed = now
+                    url_obj.access_count = (url_obj.access_count or 0) + 1
+                url_obj.content_hash = content_hash
+                url_obj.content_minhash = signature
+                url_obj.content_embedding = embedding
+                url_obj.similarity_score = score
+            self.session.flush()
+            url_ids = [url_objs[url].id for url in urls]
+            # A URL repeated in the batch keeps its last signature, like its row
+            self.near_duplicates.add_many(self.session, list(reindex), list(reindex.values()))
+
+            # One wide row per URL; the batch's statistics fold into feature_stats
+            self.feature_store.append(self.session, url_ids, features)
+
+            # Patterns resolve to shared catalog rows; only links and usage counts are written
+            # Content patterns are linked and counted like detected ones but not returned
+            linked = [
+                item_patterns + [content_patterns[i]] if i in content_patterns else item_patterns
+                for i, item_patterns in enumerate(patterns)
+            ]
+            pattern_ids, created = self.catalog.resolve(
+                self.session, [pattern for item_patterns in linked for pattern in item_patterns]
             )
-            self.session.add(pattern)
-            url_obj.patterns.append(pattern)
-            
-        # Compute similarity score
-        url_obj.similarity_score = self.compute_similarity_score(url_obj)
-        
-        # Commit changes
-        self.session.commit()
-        
+            links = {
+                (url_id, pattern_ids[(pattern['pattern_type'], pattern['pattern_value'])])
+                for url_id, item_patterns in zip(url_ids, linked)
+                for pattern in item_patterns
+            }
+            insert_ignoring_conflicts(self.session, url_patterns, [
+                {'url_id': url_id, 'pattern_id': pattern_id} for url_id, pattern_id in sorted(links)
+            ])
+            self.catalog.record_usage(self.session, [
+                pattern_ids[(pattern['pattern_type'], pattern['pattern_value'])]
+                for item_patterns in linked for pattern in item_patterns
+            ])
+            transaction = self._transaction_state(self.session)
+            transaction['catalog_pending'] = transaction['catalog_pending'] or bool(created)
+            # Core inserts bypass the flush hooks that keep the index current
+            for pattern_id, pattern in created:
+                if str(pattern['pattern_value']).startswith('['):
+                    transaction['pattern_changes'][pattern_id] = (
+                        True, pattern['pattern_value'], pattern['confidence_score']
+                    )
+            STAGE_TIMERS['persist'].observe(time.perf_counter() - persist_started)
+
+            with STAGE_TIMERS['commit'].time():
+                self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+
+        return [
+            {
+                'url': url,
+                'url_id': url_id,
+                'features': item_features,
+                'patterns': item_patterns,
+                'similarity_score': score,
+                'is_known_pattern': score > KNOWN_PATTERN_SCORE,
+                'duplicate_of': duplicates[i][0] if i in duplicates and duplicates[i][0] != url_id else None
+            }
+            for i, (url, url_id, item_features, item_patterns, score)
+            in enumerate(zip(urls, url_ids, features, patterns, scores))
+        ]
+
+    @staticmethod
+    def content_pattern(embedding: np.ndarray) -> Dict[str, Any]:
+        """Pattern dict storing a content embedding as the JSON value the pattern index reads."""
         return {
-            'url_id': url_obj.id,
-            'features': features,
-            'patterns': patterns,
-            'similarity_score': url_obj.similarity_score,
-            'is_known_pattern': url_obj.similarity_score > 0.8
+            'pattern_type': CONTENT_PATTERN_TYPE,
+            'pattern_value': json.dumps(np.round(np.asarray(embedding, dtype=np.float64), 6).tolist()),
+            'confidence_score': 1.0
+        }
+
+    def find_analyzed_duplicates(self, signatures: List[Optional[bytes]],
+                                 hashes: List[str]) -> Dict[int, Tuple[int, Any, float]]:
+        """Batch positions whose content matches an analyzed URL's.
+
+        Near-duplicate candidates are confirmed by an equal ``content_hash``,
+        as pages on one template can look similar and still differ. Maps
+        each position to the closest confirmed match's ``(url_id,
+        content_embedding, similarity_score)``; matches without a stored
+        embedding are skipped.
+        """
+        matches = self.near_duplicates.match_many(self.session, signatures)
+        candidate_ids = {url_id for item_matches in matches for url_id, _ in item_matches}
+        if not candidate_ids:
+            return {}
+        stored = {}
+        candidate_ids = sorted(candidate_ids)
+        for start in range(0, len(candidate_ids), LOOKUP_CHUNK_SIZE):
+            stored.update((row[0], row) for row in self.session.execute(
+                select(URL.id, URL.content_embedding, URL.similarity_score, URL.content_hash)
+                .where(URL.id.in_(candidate_ids[start:start + LOOKUP_CHUNK_SIZE]))
+            ))
+        duplicates = {}
+        for i, (item_matches, content_hash) in enumerate(zip(matches, hashes)):
+            for url_id, _ in item_matches:
+                row = stored.get(url_id)
+                if row is not None and row[1] is not None and row[3] == content_hash:
+                    duplicates[i] = tuple(row[:3])
+                    break
+        return duplicates
+
+    def content_analysis(self, content: str, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Describe one analyze_urls result in the shape the frontend renders."""
+        return {
+            'topics': self.embedder.top_terms(content),
+            'sentiment': {'score': None},  # no sentiment model yet
+            'category': categorize(result['patterns']),
+            'summary': summarize(content),
+            'similarity_score': result['similarity_score'],
+            'is_known_pattern': result['is_known_pattern']
         }
         
-    def save_models(self, path: str):
-        """Save ML models to disk."""
-        joblib.dump({
-            'vectorizer': self.vectorizer,
+    def refresh_models(self):
+        """Apply the model file on first use and whenever another process replaces it."""
+        if self.model_store is None:
+            return
+        try:
+            models, version = self.model_store.get()
+        except Exception:
+            logger.exception("Error loading models")
+            return
+        if models is not None and version != self.models_version:
+            with self._model_lock:
+                if version != self.models_version:
+                    self.apply_models(models)
+                    self.models_version = version
+
+    def save_models(self, path: Optional[str] = None):
+        """Save ML models to disk, atomically replacing the file other processes read."""
+        store = get_model_store(path) if path else self.model_store
+        version = store.save({
+            'embedder': self.embedder.state_dict(),
             'scaler': self.scaler,
-            'clusterer': self.clusterer,
+            # Unfitted copy: the fitted clusterer holds every core vector a second time
+            'clusterer': clone(self.clusterer),
+            'clusters': self.cluster_model.state_dict(),
             'feature_importance': self.feature_importance
-        }, path)
-        
+        })
+        if store is self.model_store:
+            self.models_version = version
+
     def load_models(self, path: str):
         """Load ML models from disk."""
         try:
-            models = joblib.load(path)
-            self.vectorizer = models['vectorizer']
-            self.scaler = models['scaler']
-            self.clusterer = models['clusterer']
-            self.feature_importance = models['feature_importance']
-        except Exception as e:
-            print(f"Error loading models: {e}")
-            # Initialize new models if loading fails
-            pass 
\ No newline at end of file
+            self.apply_models(joblib.load(path, mmap_mode=MODEL_STORE_CONFIG['mmap_mode']))
+        except Exception:
+            # Keep the fresh models from __init__ if loading fails
+            logger.exception(f"Error loading models from {path}")
+
+    def apply_models(self, models: Dict[str, Any]):
+        """Use loaded models; arrays may be read-only memory maps shared with other workers."""
+        if 'embedder' in models:
+            # Older model files carry a TfidfVectorizer instead; start the IDF fresh
+            self.embedder = EmbeddingEngine.from_state(models['embedder'])
+        self.scaler = models['scaler']
+        self.clusterer = models['clusterer']
+        self.cluster_model = ClusterModel(self.clusterer, self.scaler)
+        self.cluster_model.load_state(models.get('clusters'))
+        self.feature_importance = dict(models['feature_importance'])
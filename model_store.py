@@ -0,0 +1,102 @@
+"""Shared, lazily loaded ML model file with versioned hot reload.
+
+The model file is loaded on first use rather than at import. NumPy arrays
+are memory-mapped read-only (``joblib.load(mmap_mode='r')``), so forked
+workers share one copy through the page cache instead of each
+unpickling its own. A worker recycled by ``worker_max_tasks_per_child``
+maps pages that are already resident rather than reading the file again.
+
+A file's version is its inode, mtime and size. ``save`` writes a temporary
+file and renames it over the old one. Readers notice the new version
+within ``check_seconds`` and never see a half-written file.
+"""
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import joblib
+
+logger = logging.getLogger(__name__)
+
+MODEL_STORE_CONFIG = {
+    'check_seconds': 5,  # how often a reader stats the file for a new version
+    'mmap_mode': 'r'  # None loads arrays into process memory instead
+}
+
+class ModelStore:
+    def __init__(self, path):
+        self.path = path
+        self._models = None
+        self._version = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.stats = {'loads': 0, 'saves': 0}
+
+    def version(self):
+        """Identity of the file currently at ``path``, or None if there is none."""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def get(self):
+        """``(models, version)``, loading on first use and after the file is replaced.
+
+        ``(None, None)`` until a model file exists.
+        """
+        if self._models is not None and time.monotonic() - self._checked < MODEL_STORE_CONFIG['check_seconds']:
+            return self._models, self._version
+        with self._lock:
+            self._checked = time.monotonic()
+            version = self.version()
+            if version is not None and version != self._version:
+                started = time.perf_counter()
+                self._models = joblib.load(self.path, mmap_mode=MODEL_STORE_CONFIG['mmap_mode'])
+                self._version = version
+                self.stats['loads'] += 1
+                logger.info(f"Loaded models from {self.path} in {time.perf_counter() - started:.3f}s")
+            return self._models, self._version
+
+    def save(self, models):
+        """Atomically replace the model file; returns the new version."""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.models-', suffix='.joblib')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                joblib.dump(models, f)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        with self._lock:
+            self._models = models
+            self._version = self.version()
+            self._checked = time.monotonic()
+            self.stats['saves'] += 1
+            return self._version
+
+    def _after_fork(self):
+        # The parent's lock may have been held by another thread mid-fork
+        self._lock = threading.Lock()
+
+_stores = {}
+
+def get_model_store(path):
+    """The process-wide store for ``path``."""
+    key = os.path.abspath(path)
+    store = _stores.get(key)
+    if store is None:
+        store = _stores.setdefault(key, ModelStore(path))
+    return store
+
+def _reset_locks_after_fork():
+    for store in _stores.values():
+        store._after_fork()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_locks_after_fork)
@@ -1,21 +1,43 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, JSON, Float, ForeignKey, Table
+import hashlib
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Boolean, Text, JSON, LargeBinary, Float, ForeignKey, Table, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
+from url_classifier import normalize_url
+from vector_type import VectorType
 
 Base = declarative_base()
 
-# Association table for URL patterns
+# Association table for URL patterns; each URL links to a pattern once
 url_patterns = Table('url_patterns', Base.metadata,
     Column('url_id', Integer, ForeignKey('urls.id')),
-    Column('pattern_id', Integer, ForeignKey('patterns.id'))
+    Column('pattern_id', Integer, ForeignKey('patterns.id')),
+    Index('uq_url_patterns_url_pattern', 'url_id', 'pattern_id', unique=True),
+    Index('ix_url_patterns_pattern_id', 'pattern_id')
 )
 
+# MinHash LSH bands (see near_duplicates.py); URLs sharing a band_key are near-duplicate candidates
+minhash_bands = Table('minhash_bands', Base.metadata,
+    Column('url_id', Integer, ForeignKey('urls.id'), nullable=False),
+    Column('band_key', BigInteger, nullable=False),
+    Index('ix_minhash_bands_band_key', 'band_key'),
+    Index('uq_minhash_bands_url_band', 'url_id', 'band_key', unique=True)
+)
+
+def _default_url_key(context):
+    return URL.make_key(context.get_current_parameters()['original_url'])
+
 class URL(Base):
     __tablename__ = 'urls'
+    __table_args__ = (
+        Index('uq_urls_url_key', 'url_key', unique=True),
+        Index('ix_urls_content_hash', 'content_hash'),
+    )
     
     id = Column(Integer, primary_key=True)
     original_url = Column(String(2048), nullable=False)
+    # One row per normalized URL; URLs can be up to 2048 characters, so lookups go through a hash
+    url_key = Column(String(64), nullable=False, default=_default_url_key)
     archive_url = Column(String(2048))
     archive_date = Column(DateTime)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -24,8 +46,13 @@ class URL(Base):
     
     # ML-related fields
     content_hash = Column(String(64))  # For duplicate detection
-    content_embedding = Column(JSON)  # Vector representation of content
+    content_minhash = Column(LargeBinary)  # For near-duplicate detection, MinHash signature
+    content_embedding = Column(VectorType)  # Vector representation of content
     similarity_score = Column(Float)  # Similarity to known patterns
+
+    @staticmethod
+    def make_key(url):
+        return hashlib.sha256(normalize_url(url).encode()).hexdigest()
     
     # Relationships
     url_metadata = relationship("ArchiveMetadata", back_populates="url", uselist=False)
@@ -46,6 +73,9 @@ class URL(Base):
 
 class ArchiveMetadata(Base):
     __tablename__ = 'archive_metadata'
+    __table_args__ = (
+        Index('ix_archive_metadata_url_id', 'url_id'),
+    )
     
     id = Column(Integer, primary_key=True)
     url_id = Column(Integer, ForeignKey('urls.id'))
@@ -62,7 +92,7 @@ class ArchiveMetadata(Base):
     entities = Column(JSON)
     
     # ML features
-    feature_vector = Column(JSON)
+    feature_vector = Column(VectorType)
     cluster_id = Column(Integer)
     
     # Relationship
@@ -80,15 +110,29 @@ class ArchiveMetadata(Base):
             'entities': self.entities
         }
 
+def _default_pattern_key(context):
+    params = context.get_current_parameters()
+    return Pattern.make_key(params['pattern_type'], params['pattern_value'])
+
 class Pattern(Base):
     __tablename__ = 'patterns'
+    __table_args__ = (
+        Index('uq_patterns_pattern_key', 'pattern_key', unique=True),
+    )
     
     id = Column(Integer, primary_key=True)
     pattern_type = Column(String)  # URL structure, content type, etc.
     pattern_value = Column(String)
+    # One row per distinct (type, value); values can be long embeddings, so uniqueness is on a hash
+    pattern_key = Column(String(64), nullable=False, default=_default_pattern_key)
     confidence_score = Column(Float)
+    usage_count = Column(Integer, default=0, nullable=False)  # detections across all analyses
     last_updated = Column(DateTime, default=datetime.utcnow)
     is_active = Column(Boolean, default=True)
+
+    @staticmethod
+    def make_key(pattern_type, pattern_value):
+        return hashlib.sha256(f"{pattern_type}\x00{pattern_value}".encode()).hexdigest()
     
     # Relationships
     urls = relationship("URL", secondary=url_patterns, back_populates="patterns")
@@ -99,18 +143,35 @@ class Pattern(Base):
             'pattern_type': self.pattern_type,
             'pattern_value': self.pattern_value,
             'confidence_score': self.confidence_score,
+            'usage_count': self.usage_count,
             'last_updated': self.last_updated.isoformat() if self.last_updated else None,
             'is_active': self.is_active
         }
 
+# Numeric features from MLAnalyzer.extract_features, one column each in url_feature_values
+FEATURE_NAMES = (
+    'url_length', 'content_length', 'number_count', 'special_char_count', 'subdomain_count',
+    'path_depth', 'avg_word_length', 'word_count', 'unique_words'
+)
+
 class URLFeature(Base):
-    __tablename__ = 'url_features'
+    """One analysis of a URL: every feature in a single wide row."""
+    __tablename__ = 'url_feature_values'
+    __table_args__ = (
+        Index('ix_url_feature_values_url_id', 'url_id'),
+    )
     
     id = Column(Integer, primary_key=True)
     url_id = Column(Integer, ForeignKey('urls.id'))
-    feature_name = Column(String)
-    feature_value = Column(Float)
-    importance_score = Column(Float)
+    url_length = Column(Float)
+    content_length = Column(Float)
+    number_count = Column(Float)
+    special_char_count = Column(Float)
+    subdomain_count = Column(Float)
+    path_depth = Column(Float)
+    avg_word_length = Column(Float)
+    word_count = Column(Float)
+    unique_words = Column(Float)
     last_updated = Column(DateTime, default=datetime.utcnow)
     
     # Relationship
@@ -120,8 +181,29 @@ class URLFeature(Base):
         return {
             'id': self.id,
             'url_id': self.url_id,
+            'features': {name: getattr(self, name) for name in FEATURE_NAMES},
+            'last_updated': self.last_updated.isoformat() if self.last_updated else None
+        }
+
+class FeatureStat(Base):
+    """Running count, mean and sum of squared deviations (Welford) of one feature."""
+    __tablename__ = 'feature_stats'
+    
+    feature_name = Column(String(64), primary_key=True)
+    count = Column(Integer, default=0, nullable=False)
+    mean = Column(Float, default=0.0, nullable=False)
+    m2 = Column(Float, default=0.0, nullable=False)
+    last_updated = Column(DateTime, default=datetime.utcnow)
+    
+    @property
+    def variance(self):
+        return self.m2 / self.count if self.count else 0.0
+    
+    def to_dict(self):
+        return {
             'feature_name': self.feature_name,
-            'feature_value': self.feature_value,
-            'importance_score': self.importance_score,
+            'count': self.count,
+            'mean': self.mean,
+            'variance': self.variance,
             'last_updated': self.last_updated.isoformat() if self.last_updated else None
-        } 
\ No newline at end of file
+        }
@@ -0,0 +1,170 @@
+"""Near-duplicate content detection with MinHash and banded LSH.
+
+``content_hash`` only matches byte-identical text, so two archived copies
+of the same tweet with different page chrome never match. Each text is
+reduced to a MinHash signature over its word shingles instead: the
+fraction of equal signature slots estimates the Jaccard similarity of two
+texts' shingle sets. Unlike a single SimHash, that stays meaningful for
+tweet-sized pages where the chrome is a large share of the words.
+
+The signature is cut into ``bands`` groups of rows and each group is
+hashed to a ``minhash_bands`` key. Texts above the similarity threshold
+share a key with high probability, so a lookup is one indexed IN query
+over the query's keys, followed by an exact signature comparison on the
+candidates.
+"""
+import hashlib
+import re
+
+import numpy as np
+from sqlalchemy import delete, select
+
+from database import insert_ignoring_conflicts
+from models import URL, minhash_bands
+
+NEAR_DUPLICATE_CONFIG = {
+    'shingle_size': 3,  # words per shingle
+    'min_tokens': 10,  # shorter texts get no signature; a few words say little about the page
+    'num_perm': 96,  # signature slots, 4 bytes each
+    'bands': 32,  # 32 bands of 3 rows: ~99% of pairs at 0.5 Jaccard share a band, ~3% at 0.1
+    # Estimated Jaccard similarity reported as a near-duplicate. Two different
+    # tweets on one x.com page template score 0.5-0.75 from the shared chrome
+    'threshold': 0.9,
+    'block_size': 8192,  # shingles hashed per block, bounding memory on large pages
+    'lookup_chunk_size': 500
+}
+
+TOKEN_PATTERN = re.compile(r'\w+')
+# Odd multiplier for combining consecutive hashes
+COMBINE_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+def _mix(values):
+    """splitmix64 finalizer, so combined hashes spread over all 64 bits."""
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xBF58476D1CE4E5B9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+def _token_hash(token):
+    return int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), 'little')
+
+def _permutations(num_perm):
+    rng = np.random.default_rng(num_perm)
+    multipliers = rng.integers(0, 2 ** 63, num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    offsets = rng.integers(0, 2 ** 63, num_perm, dtype=np.uint64)
+    return multipliers, offsets
+
+_PERMUTATIONS = {}
+
+def shingle_hashes(text, shingle_size=None):
+    """Distinct 64-bit hashes of the text's word shingles (empty if it is too short)."""
+    shingle_size = shingle_size or NEAR_DUPLICATE_CONFIG['shingle_size']
+    tokens = TOKEN_PATTERN.findall((text or '').lower())
+    if len(tokens) < max(NEAR_DUPLICATE_CONFIG['min_tokens'], shingle_size):
+        return np.zeros(0, dtype=np.uint64)
+    # Hash each distinct token once, then combine neighbours arithmetically
+    vocabulary = {}
+    token_ids = np.fromiter((vocabulary.setdefault(t, len(vocabulary)) for t in tokens), dtype=np.int64, count=len(tokens))
+    token_hashes = np.fromiter((_token_hash(t) for t in vocabulary), dtype=np.uint64, count=len(vocabulary))[token_ids]
+    count = len(tokens) - shingle_size + 1
+    shingles = np.zeros(count, dtype=np.uint64)
+    for offset in range(shingle_size):
+        shingles = shingles * COMBINE_MULTIPLIER + token_hashes[offset:offset + count]
+    return np.unique(_mix(shingles))
+
+def minhash(text):
+    """MinHash signature of ``text`` as uint32 slots, or None when it is too short to fingerprint."""
+    shingles = shingle_hashes(text)
+    if not len(shingles):
+        return None
+    num_perm = NEAR_DUPLICATE_CONFIG['num_perm']
+    if num_perm not in _PERMUTATIONS:
+        _PERMUTATIONS[num_perm] = _permutations(num_perm)
+    multipliers, offsets = _PERMUTATIONS[num_perm]
+    signature = np.full(num_perm, np.iinfo(np.uint64).max, dtype=np.uint64)
+    block_size = NEAR_DUPLICATE_CONFIG['block_size']
+    for start in range(0, len(shingles), block_size):
+        # (a * x + b) mod 2**64 per slot; the high half is the better-mixed one
+        block = shingles[start:start + block_size, None] * multipliers + offsets
+        np.minimum(signature, (block >> np.uint64(32)).min(axis=0), out=signature)
+    return signature.astype('<u4')
+
+def similarity(a, b):
+    """Estimated Jaccard similarity of two signatures."""
+    a = np.frombuffer(a, dtype='<u4') if isinstance(a, bytes) else a
+    b = np.frombuffer(b, dtype='<u4') if isinstance(b, bytes) else b
+    return float(np.count_nonzero(a == b)) / len(a) if len(a) == len(b) and len(a) else 0.0
+
+def band_keys(signature):
+    """One signed 64-bit key per band, hashing the band number with its rows."""
+    bands = NEAR_DUPLICATE_CONFIG['bands']
+    rows = np.frombuffer(signature, dtype='<u4') if isinstance(signature, bytes) else signature
+    rows = rows.astype(np.uint64).reshape(bands, -1)
+    keys = np.arange(bands, dtype=np.uint64)
+    for column in rows.T:
+        keys = keys * COMBINE_MULTIPLIER + column
+    return _mix(keys).view(np.int64).tolist()
+
+class NearDuplicateIndex:
+    def signature(self, text):
+        """Signature bytes for the ``content_minhash`` column, or None."""
+        value = minhash(text)
+        return None if value is None else value.tobytes()
+
+    def add_many(self, session, url_ids, signatures):
+        """Index (or re-index) URLs under their signatures; a None signature just unindexes."""
+        url_ids = list(url_ids)
+        chunk_size = NEAR_DUPLICATE_CONFIG['lookup_chunk_size']
+        for start in range(0, len(url_ids), chunk_size):
+            session.execute(delete(minhash_bands).where(minhash_bands.c.url_id.in_(url_ids[start:start + chunk_size])))
+        insert_ignoring_conflicts(session, minhash_bands, [
+            {'url_id': url_id, 'band_key': key}
+            for url_id, signature in dict(zip(url_ids, signatures)).items()
+            if signature is not None
+            for key in band_keys(signature)
+        ])
+
+    def match_many(self, session, signatures, archived_only=False):
+        """For each signature, ``[(url_id, similarity)]`` of indexed URLs above the threshold, best first."""
+        signature_keys = [band_keys(signature) if signature is not None else [] for signature in signatures]
+        keys = sorted({key for item_keys in signature_keys for key in item_keys})
+        by_key = {}
+        chunk_size = NEAR_DUPLICATE_CONFIG['lookup_chunk_size']
+        for start in range(0, len(keys), chunk_size):
+            query = (
+                select(minhash_bands.c.band_key, URL.id, URL.content_minhash)
+                .join(URL, URL.id == minhash_bands.c.url_id)
+                .where(minhash_bands.c.band_key.in_(keys[start:start + chunk_size]))
+            )
+            if archived_only:
+                query = query.where(URL.archive_url.isnot(None))
+            for key, url_id, stored in session.execute(query):
+                if stored is not None:
+                    by_key.setdefault(key, []).append((url_id, stored))
+
+        threshold = NEAR_DUPLICATE_CONFIG['threshold']
+        matches = []
+        for signature, item_keys in zip(signatures, signature_keys):
+            found = {}
+            for key in item_keys:
+                for url_id, stored in by_key.get(key, ()):
+                    if url_id not in found:
+                        found[url_id] = similarity(signature, stored)
+            matches.append(sorted(
+                ((url_id, score) for url_id, score in found.items() if score >= threshold),
+                key=lambda match: (-match[1], match[0])
+            ))
+        return matches
+
+    def find(self, session, signature, exclude_url_id=None, archived_only=False, limit=10):
+        """``[(url_id, similarity)]`` near-duplicates of one signature, best first."""
+        if signature is None:
+            return []
+        found = self.match_many(session, [signature], archived_only=archived_only)[0]
+        return [match for match in found if match[0] != exclude_url_id][:limit]
+
+    def find_for_url(self, session, url_id, limit=10):
+        """Near-duplicates of an indexed URL, excluding itself."""
+        signature = session.scalar(select(URL.content_minhash).where(URL.id == url_id))
+        return self.find(session, signature, exclude_url_id=url_id, limit=limit)
@@ -0,0 +1,108 @@
+"""Canonical pattern rows: one Pattern per distinct (type, value).
+
+Detections no longer insert a Pattern each. The catalog resolves
+``(pattern_type, pattern_value)`` to the id of the shared row, creating it
+on first sight, and keeps the mapping in memory so steady-state analysis
+touches the patterns table only to bump ``usage_count``. Creation is
+race-safe across workers: rows are inserted with ON CONFLICT DO NOTHING
+against the unique ``pattern_key`` and then read back.
+"""
+import threading
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import bindparam, select, update
+
+from database import insert_ignoring_conflicts
+from models import Pattern
+
+PATTERN_CATALOG_CONFIG = {
+    'max_cached': 100000,  # ids kept in memory; the cache restarts empty beyond this
+    'lookup_chunk_size': 500
+}
+
+class PatternCatalog:
+    def __init__(self):
+        self._ids = {}  # (pattern_type, pattern_value) -> pattern id
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'created': 0}
+
+    def resolve(self, session, patterns):
+        """Map detected pattern dicts to catalog ids, creating missing rows.
+
+        Returns ``({(type, value): id}, created)`` where ``created`` lists the
+        ``(id, pattern dict)`` pairs this call inserted.
+        """
+        wanted = {}
+        for pattern in patterns:
+            wanted.setdefault((pattern['pattern_type'], pattern['pattern_value']), pattern)
+        with self._lock:
+            ids = {key: self._ids[key] for key in wanted if key in self._ids}
+        self.stats['hits'] += len(ids)
+        missing = {Pattern.make_key(*key): key for key in wanted if key not in ids}
+        if not missing:
+            return ids, []
+        self.stats['misses'] += len(missing)
+
+        found = self._lookup(session, list(missing))
+        new_keys = [pattern_key for pattern_key in missing if pattern_key not in found]
+        created = []
+        if new_keys:
+            insert_ignoring_conflicts(session, Pattern.__table__, [
+                {
+                    'pattern_type': missing[pattern_key][0],
+                    'pattern_value': missing[pattern_key][1],
+                    'pattern_key': pattern_key,
+                    'confidence_score': wanted[missing[pattern_key]]['confidence_score'],
+                    'usage_count': 0
+                }
+                for pattern_key in new_keys
+            ])
+            # Read back rather than rely on RETURNING: rows another worker won the race for have none
+            inserted = self._lookup(session, new_keys)
+            found.update(inserted)
+            created = [(inserted[k], wanted[missing[k]]) for k in new_keys if k in inserted]
+            self.stats['created'] += len(created)
+
+        resolved = {missing[pattern_key]: pattern_id for pattern_key, pattern_id in found.items()}
+        with self._lock:
+            if len(self._ids) + len(resolved) > PATTERN_CATALOG_CONFIG['max_cached']:
+                self._ids.clear()
+            self._ids.update(resolved)
+        ids.update(resolved)
+        return ids, created
+
+    def _lookup(self, session, pattern_keys):
+        found = {}
+        chunk_size = PATTERN_CATALOG_CONFIG['lookup_chunk_size']
+        for start in range(0, len(pattern_keys), chunk_size):
+            chunk = pattern_keys[start:start + chunk_size]
+            found.update(session.execute(
+                select(Pattern.pattern_key, Pattern.id).where(Pattern.pattern_key.in_(chunk))
+            ).all())
+        return found
+
+    def record_usage(self, session, pattern_ids):
+        """Add one use per occurrence in ``pattern_ids`` with a single executemany UPDATE."""
+        counts = Counter(pattern_ids)
+        if not counts:
+            return
+        table = Pattern.__table__
+        now = datetime.utcnow()
+        session.execute(
+            update(table)
+            .where(table.c.id == bindparam('pattern_id'))
+            .values(usage_count=table.c.usage_count + bindparam('uses'), last_updated=bindparam('seen_at')),
+            [
+                {'pattern_id': pattern_id, 'uses': uses, 'seen_at': now}
+                for pattern_id, uses in counts.items()
+            ]
+        )
+
+    def forget(self, pattern_id=None):
+        """Drop cached ids (one pattern's, or all), e.g. after deleting Pattern rows."""
+        with self._lock:
+            if pattern_id is None:
+                self._ids.clear()
+            else:
+                self._ids = {key: value for key, value in self._ids.items() if value != pattern_id}
@@ -0,0 +1,315 @@
+"""In-memory nearest-neighbour index over pattern embeddings.
+
+Active patterns whose ``pattern_value`` is an embedding are parsed once and
+kept as rows of a pre-normalized float32 matrix, so scoring a URL is one
+matrix-vector product instead of a json.loads and a cosine call per
+pattern. Scores are cosine similarity weighted by ``confidence_score``.
+
+Large sets switch to an approximate inverted-file search. Rows are also
+kept as short random projections, which are clustered around ``sqrt(n)``
+centroids. A query scores only the projected rows of its ``nprobe``
+nearest clusters, then re-ranks the best few with the full vectors.
+
+Rows can be added and removed in place; MLAnalyzer keeps the index in step
+with Pattern rows as sessions commit.
+"""
+import json
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PATTERN_INDEX_CONFIG = {
+    'mode': 'auto',  # 'exact', 'approximate', or 'auto' to switch at approximate_threshold
+    'approximate_threshold': 2000,  # exact scans stay under a millisecond up to about here
+    'nprobe': 8,  # clusters scanned per approximate query
+    'projection_dim': 128,  # dimension candidates are scored in before exact re-ranking
+    'rerank': 32,  # candidates re-ranked exactly per result requested
+    'train_sample': 20000,
+    'train_iterations': 8,
+    'retrain_growth': 2.0,  # retrain clusters once the index has grown this much since training
+    'refresh_seconds': 300  # rebuild from the database to pick up other workers' changes
+}
+
+def parse_embedding(value, dimension):
+    """Pattern value as a float32 vector of ``dimension``, or None if it isn't one."""
+    if isinstance(value, str):
+        if not value.startswith('['):
+            return None
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return None
+    if not isinstance(value, (list, tuple)) or len(value) != dimension:
+        return None
+    try:
+        return np.asarray(value, dtype=np.float32)
+    except (TypeError, ValueError):
+        return None
+
+class PatternIndex:
+    def __init__(self, dimension, mode=None):
+        self.dimension = dimension
+        self.mode = mode or PATTERN_INDEX_CONFIG['mode']
+        self._vectors = np.zeros((0, dimension), dtype=np.float32)
+        self._weights = np.zeros(0, dtype=np.float32)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._rows = {}  # pattern id -> row
+        self._size = 0
+        self._centroids = None
+        self._projection = None
+        self._projected = np.zeros((0, 0), dtype=np.float32)
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._lists = []  # cluster -> set of rows
+        self._blocks = {}  # cluster -> cached (rows, projected rows), dropped when the list changes
+        self._trained_size = 0
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_normalized(cls, vectors, mode=None):
+        """Index over unit-norm rows, ids ``0..n-1``, without copying ``vectors``.
+
+        A read-only memory-mapped matrix stays shared with other processes;
+        it is only copied if rows are later removed.
+        """
+        index = cls(vectors.shape[1], mode)
+        n = len(vectors)
+        index._vectors = vectors
+        index._weights = np.ones(n, dtype=np.float32)
+        index._ids = np.arange(n, dtype=np.int64)
+        index._assignments = np.zeros(n, dtype=np.int32)
+        index._projected = np.zeros((n, 0), dtype=np.float32)
+        index._rows = dict(zip(range(n), range(n)))
+        index._size = n
+        index._maybe_train()
+        return index
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, pattern_id):
+        return pattern_id in self._rows
+
+    @property
+    def approximate(self):
+        return self._centroids is not None
+
+    def _grow(self, needed):
+        capacity = len(self._ids)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 64)
+        for name in ('_vectors', '_weights', '_ids', '_assignments', '_projected'):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def add(self, pattern_id, embedding, confidence=1.0):
+        """Insert or replace a pattern; returns False if ``embedding`` isn't usable."""
+        return self.add_many([pattern_id], [embedding], [confidence]) == 1
+
+    def add_many(self, pattern_ids, embeddings, confidences=None):
+        """Insert or replace patterns in bulk, skipping unusable embeddings; returns the count added."""
+        ids, vectors, weights = [], [], []
+        for i, (pattern_id, embedding) in enumerate(zip(pattern_ids, embeddings)):
+            vector = embedding.astype(np.float32, copy=False) if isinstance(embedding, np.ndarray) \
+                else parse_embedding(embedding, self.dimension)
+            if vector is None or vector.shape != (self.dimension,):
+                continue
+            confidence = confidences[i] if confidences is not None else None
+            ids.append(pattern_id)
+            vectors.append(vector)
+            weights.append(1.0 if confidence is None else confidence)
+        if not ids:
+            return 0
+        matrix = np.stack(vectors)
+        norms = np.linalg.norm(matrix, axis=1)
+        usable = norms > 0
+        matrix = matrix[usable] / norms[usable, None]
+        ids = [pattern_id for pattern_id, ok in zip(ids, usable) if ok]
+        weights = np.asarray(weights, dtype=np.float32)[usable]
+
+        with self._lock:
+            for pattern_id in ids:
+                if pattern_id in self._rows:
+                    self.remove(pattern_id)
+            # Ids repeated within the batch: the last occurrence wins
+            last = {pattern_id: i for i, pattern_id in enumerate(ids)}
+            if len(last) < len(ids):
+                keep = sorted(last.values())
+                ids = [ids[i] for i in keep]
+                matrix, weights = matrix[keep], weights[keep]
+            start = self._size
+            self._grow(start + len(ids))
+            rows = np.arange(start, start + len(ids))
+            self._vectors[rows] = matrix
+            self._weights[rows] = weights
+            self._ids[rows] = ids
+            self._rows.update(zip(ids, rows.tolist()))
+            self._size += len(ids)
+            if self._centroids is not None:
+                self._assign(rows)
+            self._maybe_train()
+        return len(ids)
+
+    def remove(self, pattern_id):
+        """Drop a pattern; the last row moves into its slot."""
+        with self._lock:
+            row = self._rows.pop(pattern_id, None)
+            if row is None:
+                return False
+            self._unassign(row)
+            last = self._size - 1
+            if row != last:
+                if not self._vectors.flags.writeable:
+                    self._vectors = np.array(self._vectors)
+                moved = int(self._ids[last])
+                self._unassign(last)
+                self._vectors[row] = self._vectors[last]
+                self._weights[row] = self._weights[last]
+                self._ids[row] = moved
+                self._rows[moved] = row
+                if self._centroids is not None:
+                    self._assign(row)
+            self._size = last
+            if self._centroids is not None and self._size < PATTERN_INDEX_CONFIG['approximate_threshold'] // 2:
+                self._drop_clusters()
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+            self._size = 0
+            self._drop_clusters()
+
+    def search(self, vector, k=1):
+        """Top-``k`` ``(pattern_id, score)`` pairs for a query embedding, best first."""
+        query = np.asarray(vector, dtype=np.float32)
+        if query.shape != (self.dimension,):
+            return []
+        norm = float(np.linalg.norm(query))
+        if not norm:
+            return []
+        query = query / norm
+        with self._lock:
+            if not self._size:
+                return []
+            if self._centroids is not None:
+                rows = self._candidate_rows(query, k)
+                scores = (self._vectors[rows] @ query) * self._weights[rows]
+            else:
+                rows = None
+                scores = (self._vectors[:self._size] @ query) * self._weights[:self._size]
+            if not len(scores):
+                return []
+            k = min(k, len(scores))
+            if k == 1:
+                top = np.array([int(np.argmax(scores))])
+            else:
+                top = np.argpartition(-scores, k - 1)[:k]
+                top = top[np.argsort(-scores[top])]
+            ids = self._ids[rows[top] if rows is not None else top]
+            return [(int(i), float(s)) for i, s in zip(ids, scores[top])]
+
+    def max_score(self, vector):
+        best = self.search(vector, k=1)
+        return best[0][1] if best else 0.0
+
+    # Approximate mode
+
+    def _maybe_train(self):
+        if self.mode == 'exact':
+            return
+        threshold = 1 if self.mode == 'approximate' else PATTERN_INDEX_CONFIG['approximate_threshold']
+        if self._size < threshold:
+            return
+        if self._centroids is None or self._size >= self._trained_size * PATTERN_INDEX_CONFIG['retrain_growth']:
+            self.train()
+
+    def train(self):
+        """Cluster the projected rows (spherical k-means on a sample) and rebuild the inverted lists."""
+        with self._lock:
+            n = self._size
+            if not n:
+                return
+            rng = np.random.default_rng(0)
+            if self._projection is None:
+                dim = PATTERN_INDEX_CONFIG['projection_dim']
+                self._projection = (rng.standard_normal((self.dimension, dim)) / np.sqrt(dim)).astype(np.float32)
+                self._projected = np.zeros((len(self._ids), dim), dtype=np.float32)
+                self._projected[:n] = self._project(self._vectors[:n])
+            nlist = max(1, int(np.sqrt(n)))
+            projected = self._projected[:n]
+            sample = projected[rng.choice(n, min(n, max(nlist, PATTERN_INDEX_CONFIG['train_sample'])), replace=False)]
+            centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+            for _ in range(PATTERN_INDEX_CONFIG['train_iterations']):
+                labels = np.argmax(sample @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, labels, sample)
+                norms = np.linalg.norm(sums, axis=1, keepdims=True)
+                filled = norms[:, 0] > 0
+                centroids[filled] = sums[filled] / norms[filled]
+            self._centroids = centroids
+            self._assignments[:n] = np.argmax(projected @ centroids.T, axis=1)
+            order = np.argsort(self._assignments[:n], kind='stable')
+            bounds = np.searchsorted(self._assignments[:n][order], np.arange(nlist + 1))
+            self._lists = [set(order[bounds[c]:bounds[c + 1]].tolist()) for c in range(nlist)]
+            self._blocks = {}
+            for cluster in range(nlist):
+                rows = order[bounds[cluster]:bounds[cluster + 1]]
+                self._blocks[cluster] = (rows, projected[rows] * self._weights[rows, None])
+            self._trained_size = n
+            logger.info(f"Pattern index trained: {n} patterns in {nlist} clusters")
+
+    def _project(self, vectors):
+        projected = vectors @ self._projection
+        norms = np.linalg.norm(projected, axis=-1, keepdims=True)
+        norms[norms == 0] = 1
+        return projected / norms
+
+    def _drop_clusters(self):
+        self._centroids = None
+        self._projection = None
+        self._projected = np.zeros((len(self._ids), 0), dtype=np.float32)
+        self._lists = []
+        self._blocks = {}
+        self._trained_size = 0
+
+    def _assign(self, rows):
+        rows = np.atleast_1d(rows)
+        self._projected[rows] = self._project(self._vectors[rows])
+        clusters = np.argmax(self._projected[rows] @ self._centroids.T, axis=1)
+        self._assignments[rows] = clusters
+        for row, cluster in zip(rows.tolist(), clusters.tolist()):
+            self._lists[cluster].add(row)
+            self._blocks.pop(cluster, None)
+
+    def _unassign(self, row):
+        if self._centroids is None:
+            return
+        cluster = int(self._assignments[row])
+        self._lists[cluster].discard(row)
+        self._blocks.pop(cluster, None)
+
+    def _candidate_rows(self, query, k):
+        """Rows worth scoring exactly: the best projected matches in the nearest clusters."""
+        projected = self._project(query)
+        nprobe = min(PATTERN_INDEX_CONFIG['nprobe'], len(self._centroids))
+        closest = np.argpartition(-(self._centroids @ projected), nprobe - 1)[:nprobe]
+        blocks = []
+        for cluster in closest:
+            block = self._blocks.get(cluster)
+            if block is None:
+                # Contiguous copies; gathering scattered rows per query is what makes scans slow
+                rows = np.fromiter(self._lists[cluster], dtype=np.int64)
+                block = self._blocks[cluster] = (rows, self._projected[rows] * self._weights[rows, None])
+            blocks.append(block)
+        rows = np.concatenate([block[0] for block in blocks])
+        keep = k * PATTERN_INDEX_CONFIG['rerank']
+        if len(rows) <= keep:
+            return rows
+        scores = np.concatenate([block[1] @ projected for block in blocks])
+        return rows[np.argpartition(-scores, keep - 1)[:keep]]
@@ -0,0 +1,182 @@
+"""Per-client sliding-window rate limiting shared by both servers.
+
+Each client is tracked with a sliding-window counter: the request count of
+the current fixed window plus the previous window's count weighted by how
+much of it still overlaps the sliding window. That is two integers per
+client, constant work per request, and within a fraction of a request of an
+exact sliding log.
+
+With Redis (USE_REDIS=true) the counters live in Redis and are updated by
+one Lua script, so the limit holds across every gunicorn worker and async
+process instead of multiplying with them. If Redis is unreachable the
+limiter falls back to per-process counters.
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from metadata_cache import CACHE_CONFIG, RedisAvailability
+from metrics import RATE_LIMITED
+
+RATE_LIMIT = {
+    'window': int(os.environ.get('RATE_LIMIT_WINDOW', 60)),  # 1 minute window
+    'max_requests': int(os.environ.get('RATE_LIMIT_MAX_REQUESTS', 30)),  # max requests per window
+    'max_clients': 100000,  # local tier evicts the least recently seen client beyond this
+    'key_prefix': 'rate-limit:'
+}
+
+# Returns {allowed, current count, previous count}; only counts allowed requests
+SLIDING_WINDOW_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local elapsed = tonumber(ARGV[3])
+local curr = tonumber(redis.call('GET', KEYS[1]) or '0')
+local prev = tonumber(redis.call('GET', KEYS[2]) or '0')
+if prev * (window - elapsed) / window + curr + 1 > limit then
+    return {0, curr, prev}
+end
+curr = redis.call('INCR', KEYS[1])
+if curr == 1 then
+    redis.call('EXPIRE', KEYS[1], window * 2)
+end
+return {1, curr, prev}
+"""
+
+class RateLimitExceeded(Exception):
+    def __init__(self, retry_after):
+        super().__init__("Rate limit exceeded")
+        self.retry_after = retry_after
+
+def retry_after(prev, curr, elapsed, window, limit):
+    """Whole seconds until one more request fits under ``limit``."""
+    if curr + 1 <= limit and prev > 0:
+        # The previous window's weight decays enough within this window
+        wait = window * (1 - (limit - curr - 1) / prev) - elapsed
+    elif curr:
+        # Wait for the next window, where this window's count decays instead
+        wait = (window - elapsed) + max(0.0, window * (1 - (limit - 1) / curr))
+    else:
+        wait = window - elapsed
+    return max(1, math.ceil(wait))
+
+class LocalWindowCounters:
+    """Per-process counters: ``client -> [window index, current, previous]``."""
+
+    def __init__(self, max_clients):
+        self.max_clients = max_clients
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, client, index, elapsed, window, limit):
+        with self._lock:
+            state = self._clients.get(client)
+            if state is None:
+                state = self._clients[client] = [index, 0, 0]
+                while len(self._clients) > self.max_clients:
+                    self._clients.popitem(last=False)
+            else:
+                self._clients.move_to_end(client)
+            if state[0] != index:
+                # Roll forward; a gap of more than one window leaves nothing behind
+                state[2] = state[1] if state[0] == index - 1 else 0
+                state[0], state[1] = index, 0
+            _, curr, prev = state
+            if prev * (window - elapsed) / window + curr + 1 > limit:
+                return False, curr, prev
+            state[1] += 1
+            return True, state[1], prev
+
+    def __len__(self):
+        return len(self._clients)
+
+class _BaseRateLimiter:
+    def __init__(self):
+        self.local = LocalWindowCounters(RATE_LIMIT['max_clients'])
+
+    @property
+    def backend(self):
+        return 'redis' if self.redis is not None else 'local'
+
+    def _window(self, now):
+        window = RATE_LIMIT['window']
+        index = int(now // window)
+        return window, index, now - index * window
+
+    def _keys(self, client, index):
+        # Hash tag keeps both windows in one slot for Redis Cluster
+        prefix = f"{RATE_LIMIT['key_prefix']}{{{client}}}:"
+        return [f'{prefix}{index}', f'{prefix}{index - 1}']
+
+    def _result(self, allowed, curr, prev, window, elapsed):
+        if allowed:
+            return True, 0
+        RATE_LIMITED.labels(self.backend).inc()
+        return False, retry_after(prev, curr, elapsed, window, RATE_LIMIT['max_requests'])
+
+class RateLimiter(_BaseRateLimiter):
+    """Blocking limiter for the Flask server.
+
+    ``hit(client)`` counts one request and returns ``(allowed, retry_after)``.
+    """
+
+    def __init__(self, redis_url=None):
+        super().__init__()
+        self.redis = None
+        if redis_url:
+            import redis
+
+            self.errors = (redis.RedisError,)
+            self.redis = redis.Redis.from_url(
+                redis_url,
+                socket_timeout=CACHE_CONFIG['redis_timeout'],
+                socket_connect_timeout=CACHE_CONFIG['redis_timeout']
+            )
+            self._script = self.redis.register_script(SLIDING_WINDOW_SCRIPT)
+            self.status = RedisAvailability()
+
+    def hit(self, client):
+        window, index, elapsed = self._window(time.time())
+        limit = RATE_LIMIT['max_requests']
+        if self.redis is not None and self.status.available():
+            try:
+                allowed, curr, prev = self._script(
+                    keys=self._keys(client, index), args=[limit, window, elapsed]
+                )
+                return self._result(bool(allowed), int(curr), int(prev), window, elapsed)
+            except self.errors as e:
+                self.status.failed(e)
+        return self._result(*self.local.hit(client, index, elapsed, window, limit), window, elapsed)
+
+class AsyncRateLimiter(_BaseRateLimiter):
+    """Non-blocking limiter for async_server; same counters and semantics."""
+
+    def __init__(self, redis_url=None):
+        super().__init__()
+        self.redis = None
+        if redis_url:
+            import redis
+            import redis.asyncio
+
+            self.errors = (redis.RedisError,)
+            self.redis = redis.asyncio.Redis.from_url(
+                redis_url,
+                socket_timeout=CACHE_CONFIG['redis_timeout'],
+                socket_connect_timeout=CACHE_CONFIG['redis_timeout']
+            )
+            self._script = self.redis.register_script(SLIDING_WINDOW_SCRIPT)
+            self.status = RedisAvailability()
+
+    async def hit(self, client):
+        window, index, elapsed = self._window(time.time())
+        limit = RATE_LIMIT['max_requests']
+        if self.redis is not None and self.status.available():
+            try:
+                allowed, curr, prev = await self._script(
+                    keys=self._keys(client, index), args=[limit, window, elapsed]
+                )
+                return self._result(bool(allowed), int(curr), int(prev), window, elapsed)
+            except self.errors as e:
+                self.status.failed(e)
+        return self._result(*self.local.hit(client, index, elapsed, window, limit), window, elapsed)
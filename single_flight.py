@@ -0,0 +1,313 @@
+"""Single-flight coalescing of identical upstream calls.
+
+When many requests ask for the same archive ID (or submit the same URL) at
+once, only one of them calls archive.ph; the others wait for it and share its
+result. Within a process callers wait on the leader directly. Across
+processes the leader holds a short Redis lease (``SET NX PX``) and callers in
+other workers poll until the lease goes away, then pick up the result the
+leader published (or, for metadata, the entry it wrote to the shared cache).
+
+If the leader fails, waiting callers in the same process get the same error;
+waiters elsewhere take the lease themselves and retry, one at a time. Without
+Redis (USE_REDIS unset) only in-process coalescing applies.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+
+from metadata_cache import CACHE_CONFIG, RedisAvailability
+
+logger = logging.getLogger(__name__)
+
+SINGLE_FLIGHT_CONFIG = {
+    'key_prefix': 'single-flight:',
+    'lease_ttl': 45,  # seconds; must outlast one call including its retries
+    'result_ttl': 15,  # published results only need to outlive the waiters' next poll
+    'poll_interval': 0.05
+}
+
+# Delete the lease only if we still own it; it may have expired and been retaken
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+def new_stats():
+    return {'leaders': 0, 'coalesced': 0, 'remote_waits': 0}
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+class SingleFlight:
+    """Blocking coalescer used by the Flask server and Celery tasks.
+
+    ``do(key, fn, load=None)`` returns ``fn()``, running it at most once per
+    key across concurrent callers. ``load`` reads a result another process
+    has stored elsewhere (returning None until it exists); without it the
+    leader publishes its JSON result under the single-flight namespace.
+    """
+
+    def __init__(self, redis_url=None, namespace='default', lease_ttl=None):
+        self.namespace = namespace
+        self.lease_ttl = lease_ttl or SINGLE_FLIGHT_CONFIG['lease_ttl']
+        self.stats = new_stats()
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.redis = None
+        if redis_url:
+            import redis
+
+            self.errors = (redis.RedisError,)
+            self.redis = redis.Redis.from_url(
+                redis_url,
+                socket_timeout=CACHE_CONFIG['redis_timeout'],
+                socket_connect_timeout=CACHE_CONFIG['redis_timeout']
+            )
+            self._release = self.redis.register_script(RELEASE_SCRIPT)
+            self.status = RedisAvailability()
+
+    def _key(self, kind, key):
+        return f"{SINGLE_FLIGHT_CONFIG['key_prefix']}{self.namespace}:{kind}:{key}"
+
+    def do(self, key, fn, load=None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            self.stats['coalesced'] += 1
+            return call.wait()
+
+        self.stats['leaders'] += 1
+        try:
+            call.result = self._run(key, fn, load)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def _run(self, key, fn, load):
+        if self.redis is None:
+            return fn()
+        publish = load is None
+        load = load or (lambda: self._load_published(key))
+        deadline = time.monotonic() + self.lease_ttl
+        waited = False
+        while True:
+            token = self._acquire(key)
+            if token:
+                try:
+                    value = fn()
+                    if publish:
+                        self._publish(key, value)
+                    return value
+                finally:
+                    self._release_lease(key, token)
+
+            if not waited:
+                waited = True
+                self.stats['remote_waits'] += 1
+            # Another worker is calling upstream; wait for its result
+            while self._lease_held(key) and time.monotonic() < deadline:
+                time.sleep(SINGLE_FLIGHT_CONFIG['poll_interval'])
+            value = load()
+            if value is not None:
+                return value
+            if time.monotonic() >= deadline:
+                logger.warning(f"Gave up waiting on single-flight leader for {key}")
+                return fn()
+            # The leader failed without a result; try to take over
+
+    def _acquire(self, key):
+        """Take the lease, returning its token, or None if another worker holds it."""
+        if not self.status.available():
+            return True
+        token = uuid.uuid4().hex
+        try:
+            if self.redis.set(self._key('lease', key), token, nx=True, px=int(self.lease_ttl * 1000)):
+                return token
+            return None
+        except self.errors as e:
+            self.status.failed(e)
+            return True
+
+    def _lease_held(self, key):
+        if not self.status.available():
+            return False
+        try:
+            return bool(self.redis.exists(self._key('lease', key)))
+        except self.errors as e:
+            self.status.failed(e)
+            return False
+
+    def _release_lease(self, key, token):
+        if token is True or not self.status.available():
+            return
+        try:
+            self._release(keys=[self._key('lease', key)], args=[token])
+        except self.errors as e:
+            self.status.failed(e)
+
+    def _publish(self, key, value):
+        if value is None or not self.status.available():
+            return
+        try:
+            self.redis.set(self._key('result', key), json.dumps(value), ex=SINGLE_FLIGHT_CONFIG['result_ttl'])
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Single-flight result for {key} is not JSON serializable: {str(e)}")
+        except self.errors as e:
+            self.status.failed(e)
+
+    def _load_published(self, key):
+        if not self.status.available():
+            return None
+        try:
+            raw = self.redis.get(self._key('result', key))
+        except self.errors as e:
+            self.status.failed(e)
+            return None
+        return json.loads(raw) if raw else None
+
+class AsyncSingleFlight:
+    """Non-blocking coalescer used by async_server; same keys and semantics.
+
+    The leader's call runs in its own task, so a client disconnecting does
+    not cancel the upstream call the other waiters depend on.
+    """
+
+    def __init__(self, redis_url=None, namespace='default', lease_ttl=None):
+        self.namespace = namespace
+        self.lease_ttl = lease_ttl or SINGLE_FLIGHT_CONFIG['lease_ttl']
+        self.stats = new_stats()
+        self._calls = {}
+        self.redis = None
+        if redis_url:
+            import redis
+            import redis.asyncio
+
+            self.errors = (redis.RedisError,)
+            self.redis = redis.asyncio.Redis.from_url(
+                redis_url,
+                socket_timeout=CACHE_CONFIG['redis_timeout'],
+                socket_connect_timeout=CACHE_CONFIG['redis_timeout']
+            )
+            self._release = self.redis.register_script(RELEASE_SCRIPT)
+            self.status = RedisAvailability()
+
+    def _key(self, kind, key):
+        return f"{SINGLE_FLIGHT_CONFIG['key_prefix']}{self.namespace}:{kind}:{key}"
+
+    async def do(self, key, fn, load=None):
+        task = self._calls.get(key)
+        if task is not None:
+            self.stats['coalesced'] += 1
+        else:
+            self.stats['leaders'] += 1
+            task = asyncio.get_running_loop().create_task(self._run(key, fn, load))
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._finished(key, t))
+        return await asyncio.shield(task)
+
+    def _finished(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # retrieved here in case every waiter went away
+
+    async def _run(self, key, fn, load):
+        if self.redis is None:
+            return await fn()
+        publish = load is None
+        load = load or (lambda: self._load_published(key))
+        deadline = time.monotonic() + self.lease_ttl
+        waited = False
+        while True:
+            token = await self._acquire(key)
+            if token:
+                try:
+                    value = await fn()
+                    if publish:
+                        await self._publish(key, value)
+                    return value
+                finally:
+                    await self._release_lease(key, token)
+
+            if not waited:
+                waited = True
+                self.stats['remote_waits'] += 1
+            while await self._lease_held(key) and time.monotonic() < deadline:
+                await asyncio.sleep(SINGLE_FLIGHT_CONFIG['poll_interval'])
+            value = await load()
+            if value is not None:
+                return value
+            if time.monotonic() >= deadline:
+                logger.warning(f"Gave up waiting on single-flight leader for {key}")
+                return await fn()
+
+    async def _acquire(self, key):
+        if not self.status.available():
+            return True
+        token = uuid.uuid4().hex
+        try:
+            if await self.redis.set(self._key('lease', key), token, nx=True, px=int(self.lease_ttl * 1000)):
+                return token
+            return None
+        except self.errors as e:
+            self.status.failed(e)
+            return True
+
+    async def _lease_held(self, key):
+        if not self.status.available():
+            return False
+        try:
+            return bool(await self.redis.exists(self._key('lease', key)))
+        except self.errors as e:
+            self.status.failed(e)
+            return False
+
+    async def _release_lease(self, key, token):
+        if token is True or not self.status.available():
+            return
+        try:
+            await self._release(keys=[self._key('lease', key)], args=[token])
+        except self.errors as e:
+            self.status.failed(e)
+
+    async def _publish(self, key, value):
+        if value is None or not self.status.available():
+            return
+        try:
+            await self.redis.set(self._key('result', key), json.dumps(value), ex=SINGLE_FLIGHT_CONFIG['result_ttl'])
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Single-flight result for {key} is not JSON serializable: {str(e)}")
+        except self.errors as e:
+            self.status.failed(e)
+
+    async def _load_published(self, key):
+        if not self.status.available():
+            return None
+        try:
+            raw = await self.redis.get(self._key('result', key))
+        except self.errors as e:
+            self.status.failed(e)
+            return None
+        return json.loads(raw) if raw else None
@@ -1,17 +1,28 @@
-from celery import Celery
-from celery.exceptions import MaxRetriesExceededError
+from celery import Celery, chain, chord, group
+from celery.signals import task_postrun
 import logging
 from logging.handlers import RotatingFileHandler
 import os
 from datetime import datetime
+import random
+import time
 import requests
+import http_client
+from upstream_governor import UpstreamUnavailable, get_governor
 from urllib.parse import urlparse
 import archiveis
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import select
 from models import URL, ArchiveMetadata
+from database import get_engine, scoped_sessions
 from config import Config
+from archive_parser import html_to_text
 from ml_analyzer import MLAnalyzer
+from clustering import CLUSTERING_CONFIG
+from near_duplicates import NearDuplicateIndex
+from url_store import URL_STORE_CONFIG, upsert_urls
+from batch_progress import BatchProgress
+from metadata_cache import CACHE_CONFIG
+from metrics import instrument_celery
 
 # Configure logging
 if not os.path.exists(Config.LOG_DIR):
@@ -32,6 +43,16 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+PIPELINE_CONFIG = {
+    'queues': ('validate', 'fetch', 'capture', 'analyze', 'persist'),
+    # Per worker process, on top of the archive.ph governor; Celery syntax such as '30/m'
+    'rate_limits': {
+        'validate': os.environ.get('VALIDATE_RATE_LIMIT'),
+        'fetch': os.environ.get('FETCH_RATE_LIMIT'),
+        'capture': os.environ.get('CAPTURE_RATE_LIMIT', '30/m')
+    }
+}
+
 # Initialize Celery
 celery = Celery('tasks',
                 broker=Config.CELERY_BROKER_URL,
@@ -47,127 +68,453 @@ celery.conf.update(
     task_time_limit=3600,  # 1 hour
     task_soft_time_limit=3300,  # 55 minutes
     worker_max_tasks_per_child=200,
-    worker_prefetch_multiplier=1
+    worker_prefetch_multiplier=1,
+    # One queue per archive stage; workers pick theirs with -Q
+    # Batch chunks (archive_chunk) run every stage inline and stay on the default queue
+    task_routes={f'tasks.{stage}_stage': {'queue': stage} for stage in PIPELINE_CONFIG['queues']},
+    task_annotations={
+        f'tasks.{stage}_stage': {'rate_limit': rate_limit}
+        for stage, rate_limit in PIPELINE_CONFIG['rate_limits'].items() if rate_limit
+    },
+    # Run with `celery -A tasks beat`
+    beat_schedule={
+        'assign-clusters': {
+            'task': 'tasks.assign_clusters',
+            'schedule': CLUSTERING_CONFIG['assign_minutes'] * 60
+        },
+        'refit-clusters': {
+            'task': 'tasks.refit_clusters',
+            'schedule': CLUSTERING_CONFIG['refit_hours'] * 3600
+        }
+    }
 )
 
-# Initialize SQLAlchemy
-engine = create_engine(Config.SQLALCHEMY_DATABASE_URI)
-Session = sessionmaker(bind=engine)
+# Task duration histograms, queue depth and worker /metrics on CELERY_METRICS_PORT
+instrument_celery()
+
+# Initialize SQLAlchemy: the shared pooled engine, and one session per task that is
+# removed when the task ends, so no transaction or loaded rows outlive it
+engine = get_engine(Config.SQLALCHEMY_DATABASE_URI)
+Session = scoped_sessions(Config.SQLALCHEMY_DATABASE_URI)
 
-# Initialize ML Analyzer
-ml_analyzer = MLAnalyzer(Session())
+@task_postrun.connect(weak=False)
+def remove_task_session(**kwargs):
+    Session.remove()
+
+# Initialize ML Analyzer; the model file is memory-mapped on first use, shared between
+# workers through the page cache, and reloaded when another worker replaces it
+ML_MODEL_PATH = os.environ.get('ML_MODEL_PATH', 'models/url_analyzer.joblib')
+ml_analyzer = MLAnalyzer(Session, model_path=ML_MODEL_PATH)
+near_duplicates = NearDuplicateIndex()
+
+class InvalidURL(ValueError):
+    """A URL that can never be archived, so it is rejected without retrying."""
+
+# requests errors that retrying the same URL cannot fix
+MALFORMED_URL_ERRORS = (
+    requests.exceptions.InvalidSchema,
+    requests.exceptions.InvalidURL,
+    requests.exceptions.MissingSchema
+)
 
 def validate_url(url):
     """Validate URL format and accessibility"""
     try:
         result = urlparse(url)
         if not all([result.scheme, result.netloc]):
-            raise ValueError("Invalid URL format")
+            raise InvalidURL("Invalid URL format")
         
-        response = requests.head(url, timeout=Config.REQUEST_TIMEOUT, 
-                               allow_redirects=True, verify=Config.SSL_VERIFY)
+        # Batch URLs come from clients; internal addresses are never contacted
+        response = http_client.head_public(url, timeout=Config.REQUEST_TIMEOUT, verify=Config.SSL_VERIFY)
         response.raise_for_status()
         return True
+    except http_client.UnsafeURL as e:
+        raise InvalidURL(str(e))
+    except MALFORMED_URL_ERRORS as e:
+        raise InvalidURL(f"Invalid URL: {str(e)}")
     except requests.exceptions.RequestException as e:
         raise ValueError(f"URL validation failed: {str(e)}")
+    except InvalidURL:
+        raise
+    except ValueError as e:
+        # urlparse rejects some malformed hosts, e.g. an unclosed IPv6 bracket
+        raise InvalidURL(f"Invalid URL: {str(e)}")
 
-@celery.task(bind=True, max_retries=3, default_retry_delay=60)
-def archive_url(self, url):
-    """Archive a single URL with retries and proper error handling"""
-    logger.info(f"Starting archive task for URL: {url}")
-    session = Session()
-    
+# archiveis.capture talks to archive.md, the same service as archive.ph
+ARCHIVE_SERVICE_HOST = 'archive.md'
+TASK_RETRY_CAP = 15 * 60
+DEDUP_MAX_PAGE_BYTES = 2 * 1024 * 1024  # pages are fingerprinted from their first 2 MB
+
+def retry_countdown(task, error):
+    """Seconds before the next attempt.
+
+    Honours archive.ph's Retry-After (or the open circuit) when there is one,
+    otherwise backs off exponentially from ``default_retry_delay`` with jitter
+    so a burst of failed tasks does not come back in lockstep.
+    """
+    if isinstance(error, UpstreamUnavailable):
+        return error.retry_after + random.uniform(0, 5)
+    ceiling = min(TASK_RETRY_CAP, task.default_retry_delay * 2 ** task.request.retries)
+    return random.uniform(ceiling / 2, ceiling)
+
+def capture_archive(url):
+    """archiveis.capture paced by the archive.ph governor."""
+    governor = get_governor(ARCHIVE_SERVICE_HOST)
+    governor.acquire()
     try:
-        # Validate URL
-        validate_url(url)
-        
-        # Create archive
         archive_url = archiveis.capture(url)
-        archive_id = archive_url.split('/')[-1]
-        archive_date = archiveis.extract_date(archive_id)
-        
-        # Store in database
-        url_obj = URL(
-            original_url=url,
-            archive_url=archive_url,
-            archive_date=archive_date,
-            status='completed',
-            created_at=datetime.utcnow()
-        )
-        session.add(url_obj)
-        
-        # Analyze with ML
+    except requests.HTTPError as e:
+        if e.response is not None:
+            governor.observe(e.response.status_code, e.response.headers, e.response.content)
+        raise
+    except requests.RequestException:
+        governor.record_failure()
+        raise
+    governor.record_success()
+    return archive_url
+
+def fetch_page_text(url):
+    """Text of the page's first ``DEDUP_MAX_PAGE_BYTES``, or None if it can't be fetched."""
+    try:
+        response = http_client.get_public(url, timeout=Config.REQUEST_TIMEOUT, verify=Config.SSL_VERIFY, stream=True)
         try:
-            ml_results = ml_analyzer.analyze_url(url)
-            metadata = ArchiveMetadata(
-                url_id=url_obj.id,
-                ml_category=ml_results.get('category'),
-                ml_confidence=ml_results.get('confidence'),
-                created_at=datetime.utcnow()
-            )
+            response.raise_for_status()
+            body = response.raw.read(DEDUP_MAX_PAGE_BYTES, decode_content=True)
+        finally:
+            response.close()
+    except (requests.RequestException, http_client.UnsafeURL) as e:
+        logger.warning(f"Could not fetch {url} for analysis: {str(e)}")
+        return None
+    return html_to_text(body)
+
+def find_archived_duplicate(session, signature, content_hash):
+    """An already archived URL with the same content as a fetched page.
+
+    Near-duplicate candidates must also match ``content_hash``: two tweets on
+    one page template can score close and still be different content.
+    """
+    matches = near_duplicates.find(session, signature, archived_only=True)
+    if not matches:
+        return None
+    confirmed = {
+        url_obj.id: url_obj for url_obj in session.scalars(
+            select(URL).where(URL.id.in_([url_id for url_id, _ in matches]), URL.content_hash == content_hash)
+        )
+    }
+    return next((confirmed[url_id] for url_id, _ in matches if url_id in confirmed), None)
+
+# Archive pipeline: validate -> fetch -> (capture | analyze) -> persist. Every
+# stage has its own queue, so slow archive.ph captures don't hold up analysis
+# and each stage's workers are sized separately, e.g.
+# `celery -A tasks worker -Q capture --concurrency 2`. Stages pass JSON dicts.
+# The fetch stage replaces itself with the capture/analyze group, so only the
+# analysis message carries the page text.
+
+def archive_pipeline(url):
+    """Canvas archiving one URL; the capture and analysis stages run in parallel."""
+    return chain(
+        validate_stage.s(url),
+        fetch_stage.s(),
+        persist_stage.s(url)
+    )
+
+@celery.task(bind=True, max_retries=3, default_retry_delay=60)
+def validate_stage(self, url):
+    """Check the URL is well formed and reachable."""
+    logger.info(f"Starting archive pipeline for URL: {url}")
+    try:
+        validate_url(url)
+    except InvalidURL as e:
+        # Every retry would fail the same way
+        logger.warning(f"Rejected {url}: {str(e)}")
+        raise
+    except Exception as e:
+        logger.warning(f"Validation failed for {url}: {str(e)}")
+        raise self.retry(exc=e, countdown=retry_countdown(self, e))
+    return url
+
+def fetch_page(url):
+    """Fetch the page text and look for an archived copy of it.
+
+    Content we already hold an archive of is not captured or analyzed again.
+    """
+    text = fetch_page_text(url)
+    signature = near_duplicates.signature(text) if text is not None else None
+    content_hash = ml_analyzer.compute_content_hash(text) if text is not None else None
+    page = {
+        'url': url,
+        'text': text,
+        'signature': signature.hex() if signature else None,
+        'content_hash': content_hash,
+        'duplicate': None
+    }
+    duplicate = find_archived_duplicate(Session(), signature, content_hash)
+    if duplicate is not None:
+        logger.info(f"Skipping archive of {url}: same content as {duplicate.original_url}")
+        page['text'] = None
+        page['duplicate'] = {
+            'status': 'duplicate',
+            'archive_url': duplicate.archive_url,
+            'archive_date': duplicate.archive_date.isoformat() if duplicate.archive_date else None,
+            'url_id': duplicate.id
+        }
+    return page
+
+def without_text(page):
+    """The page as the capture stage needs it; the text can run to megabytes."""
+    return {key: value for key, value in page.items() if key != 'text'}
+
+@celery.task(bind=True)
+def fetch_stage(self, url):
+    """Fetch the page, then hand it to the capture and analysis stages in parallel."""
+    page = fetch_page(url)
+    # The group's [capture, analysis] results go on to the rest of the chain
+    return self.replace(group(capture_stage.si(without_text(page)), analyze_stage.si(page)))
+
+def capture_page(page):
+    """Capture a fetched page, returning what the persist stage records."""
+    archive_url = capture_archive(page['url'])
+    archive_date = archiveis.extract_date(archive_url.split('/')[-1])
+    return {
+        'archive_url': archive_url,
+        'archive_date': archive_date.isoformat() if archive_date else None,
+        'signature': page['signature'],
+        'content_hash': page['content_hash']
+    }
+
+@celery.task(bind=True, max_retries=3, default_retry_delay=60)
+def capture_stage(self, page):
+    """Capture the page on archive.ph, paced by the governor."""
+    if page['duplicate']:
+        return page['duplicate']
+    try:
+        return capture_page(page)
+    except Exception as e:
+        logger.error(f"Failed to capture {page['url']}: {str(e)}")
+        raise self.retry(exc=e, countdown=retry_countdown(self, e))
+
+@celery.task
+def analyze_stage(page):
+    """Run the ML analysis; a failure is logged and leaves the archive without it."""
+    if page['duplicate'] or page['text'] is None:
+        return None
+    try:
+        result = ml_analyzer.analyze_urls([(page['url'], page['text'])])[0]
+        analysis = ml_analyzer.content_analysis(page['text'], result)
+    except Exception as e:
+        logger.warning(f"ML analysis failed for {page['url']}: {str(e)}")
+        return None
+    return {
+        'url_id': result['url_id'],
+        'category': analysis['category'],
+        'topics': analysis['topics'],
+        'content_length': len(page['text']),
+        'similarity_score': result['similarity_score']
+    }
+
+@celery.task
+def persist_stage(results, url):
+    """Record the capture on the URL's row, which the analysis stage may have created."""
+    capture, analysis = results
+    if capture.get('status') == 'duplicate':
+        return capture
+    archive_date = datetime.fromisoformat(capture['archive_date']) if capture['archive_date'] else None
+    session = Session()
+    try:
+        url_obj = session.get(URL, analysis['url_id']) if analysis else None
+        if url_obj is None:
+            url_obj = upsert_urls(session, [url])[0][url]
+        url_obj.archive_url = capture['archive_url']
+        url_obj.archive_date = archive_date
+        session.flush()
+        if url_obj.content_minhash is None and capture['signature']:
+            # Captures without an analysis are still indexed for archive deduplication
+            url_obj.content_minhash = bytes.fromhex(capture['signature'])
+            url_obj.content_hash = capture['content_hash']
+            near_duplicates.add_many(session, [url_obj.id], [url_obj.content_minhash])
+
+        metadata = session.scalars(select(ArchiveMetadata).where(ArchiveMetadata.url_id == url_obj.id)).first()
+        if metadata is None:
+            metadata = ArchiveMetadata(url_id=url_obj.id)
             session.add(metadata)
-        except Exception as e:
-            logger.warning(f"ML analysis failed for {url}: {str(e)}")
-        
+        metadata.archive_date = archive_date
+        if analysis:
+            metadata.topics = analysis['topics']
+            metadata.content_length = analysis['content_length']
         session.commit()
         logger.info(f"Successfully archived URL: {url}")
-        
         return {
             'status': 'success',
-            'archive_url': archive_url,
-            'archive_date': archive_date.isoformat() if archive_date else None,
-            'url_id': url_obj.id
+            'archive_url': capture['archive_url'],
+            'archive_date': capture['archive_date'],
+            'url_id': url_obj.id,
+            'category': analysis['category'] if analysis else None
         }
-        
     except Exception as e:
         session.rollback()
-        logger.error(f"Failed to archive URL {url}: {str(e)}", exc_info=True)
-        
-        try:
-            self.retry(exc=e)
-        except MaxRetriesExceededError:
-            # Update status in database after max retries
-            try:
-                url_obj = URL(
-                    original_url=url,
-                    status='failed',
-                    error_message=str(e),
-                    created_at=datetime.utcnow()
-                )
-                session.add(url_obj)
-                session.commit()
-            except Exception as db_error:
-                logger.error(f"Failed to update database status: {str(db_error)}")
-            
-            raise Exception(f"Failed to archive URL after {self.max_retries} retries: {str(e)}")
-    
+        logger.error(f"Failed to record archive of {url}: {str(e)}", exc_info=True)
+        raise
+
+@celery.task(bind=True, max_retries=3, default_retry_delay=60)
+def archive_url(self, url):
+    """Archive ``url`` in this worker and return the result of recording it.
+
+    Returns ``{'status': 'success', 'archive_url', 'archive_date', 'url_id',
+    'category'}``, or the existing archive with ``status='duplicate'``. To
+    run the stages on their own queues instead, use start_archive_pipeline.
+    """
+    try:
+        return archive_one(url)
+    except InvalidURL:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to archive URL {url}: {str(e)}")
+        raise self.retry(exc=e, countdown=retry_countdown(self, e))
     finally:
-        session.close()
+        Session.remove()
 
-@celery.task(bind=True)
-def batch_archive_urls(self, urls):
-    """Process a batch of URLs"""
-    logger.info(f"Starting batch archive for {len(urls)} URLs")
-    results = []
-    
+@celery.task
+def start_archive_pipeline(url):
+    """Start the staged pipeline for ``url``; returns the id of its final (persist) task."""
+    return archive_pipeline(url).apply_async().id
+
+# Batch archiving: URLs already archived are dropped up front. The rest are split
+# into chunks, and the chunks are dealt round-robin into at most max_concurrent
+# lanes. Each lane is a chain that archives its chunks one after another. The
+# lanes run as one chord, so a batch has at most max_concurrent captures in
+# flight and puts a few messages on the broker, not five per URL.
+BATCH_ARCHIVE_CONFIG = {
+    'chunk_size': 10,  # URLs archived in series per task
+    'max_concurrent': int(os.environ.get('BATCH_MAX_CONCURRENT', 4)),  # captures in flight per batch
+    'capture_attempts': 3,
+    'max_retry_wait': 120  # longer archive.ph backoffs fail the URL instead of holding its lane
+}
+
+batch_progress = BatchProgress(CACHE_CONFIG['redis_url'])
+
+def unique_unarchived(session, urls):
+    """``(to_archive, already_archived)``: one URL per url_key, minus keys that already have an archive."""
+    by_key = {}
+    for url in urls:
+        by_key.setdefault(URL.make_key(url), url)
+    keys = list(by_key)
+    archived = set()
+    for start in range(0, len(keys), URL_STORE_CONFIG['lookup_chunk_size']):
+        archived.update(session.scalars(
+            select(URL.url_key).where(
+                URL.url_key.in_(keys[start:start + URL_STORE_CONFIG['lookup_chunk_size']]),
+                URL.archive_url.isnot(None)
+            )
+        ))
+    return [url for key, url in by_key.items() if key not in archived], len(archived)
+
+def capture_with_retries(page):
+    """capture_page, retried in place with backoff; the lane waits rather than requeueing."""
+    attempts = BATCH_ARCHIVE_CONFIG['capture_attempts']
+    for attempt in range(attempts):
+        try:
+            return capture_page(page)
+        except Exception as e:
+            if isinstance(e, UpstreamUnavailable):
+                delay = e.retry_after
+            else:
+                delay = random.uniform(0.5, 1) * min(TASK_RETRY_CAP, 10 * 2 ** attempt)
+            if attempt == attempts - 1 or delay > BATCH_ARCHIVE_CONFIG['max_retry_wait']:
+                raise
+            logger.warning(f"Capture of {page['url']} failed, retrying in {delay:.0f}s: {str(e)}")
+            time.sleep(delay)
+
+def archive_one(url):
+    """Run every pipeline stage for ``url`` in this process; returns the persist result."""
+    validate_url(url)
+    page = fetch_page(url)
+    if page['duplicate']:
+        return page['duplicate']
+    capture = capture_with_retries(page)
+    return persist_stage([capture, analyze_stage(page)], url)
+
+@celery.task
+def archive_chunk(urls, batch_id):
+    """Archive a batch's chunk of URLs in series, counting each outcome in its progress."""
+    outcomes = {}
     for url in urls:
         try:
-            result = archive_url.delay(url)
-            results.append({
-                'url': url,
-                'task_id': result.id,
-                'status': 'submitted'
-            })
+            outcome = 'archived' if archive_one(url)['status'] == 'success' else 'duplicate'
         except Exception as e:
-            logger.error(f"Failed to submit archive task for {url}: {str(e)}")
-            results.append({
-                'url': url,
-                'status': 'failed',
-                'error': str(e)
-            })
-    
+            logger.error(f"Batch {batch_id}: failed to archive {url}: {str(e)}")
+            outcome = 'failed'
+        finally:
+            # One URL's rows never leak into the next URL's session
+            Session.remove()
+        batch_progress.record(batch_id, outcome)
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    return outcomes
+
+@celery.task
+def finish_batch(batch_id):
+    batch_progress.finish(batch_id)
+    progress = batch_progress.get(batch_id)
+    logger.info(f"Batch {batch_id} complete: {progress}")
+    return progress
+
+@celery.task
+def batch_failed(request, exc, traceback, batch_id):
+    """Chord error callback: a lane failed, so finish_batch will never run."""
+    logger.error(f"Batch {batch_id} failed in task {request.id}: {str(exc)}")
+    batch_progress.finish(batch_id, status='failed', error=str(exc))
+
+def batch_canvas(urls, batch_id, max_concurrent=None):
+    """Chord of at most ``max_concurrent`` lanes of chunks; None when there is nothing to do."""
+    chunk_size = BATCH_ARCHIVE_CONFIG['chunk_size']
+    chunks = [urls[start:start + chunk_size] for start in range(0, len(urls), chunk_size)]
+    if not chunks:
+        return None
+    lanes = min(len(chunks), max(1, max_concurrent or BATCH_ARCHIVE_CONFIG['max_concurrent']))
+    return chord(
+        group(chain(archive_chunk.si(chunk, batch_id) for chunk in chunks[lane::lanes]) for lane in range(lanes)),
+        finish_batch.si(batch_id).on_error(batch_failed.s(batch_id))
+    )
+
+@celery.task(bind=True)
+def batch_archive_urls(self, urls, batch_id=None, max_concurrent=None):
+    """Archive a batch of URLs with bounded concurrency; progress is kept under ``batch_id``."""
+    batch_id = batch_id or self.request.id
+    logger.info(f"Starting batch archive {batch_id} for {len(urls)} URLs")
+    if batch_progress.get(batch_id) is None:
+        batch_progress.start(batch_id, len(set(URL.make_key(url) for url in urls)))
+    try:
+        to_archive, already_archived = unique_unarchived(Session(), urls)
+        batch_progress.running(batch_id, already_archived, len(to_archive))
+        canvas = batch_canvas(to_archive, batch_id, max_concurrent)
+        if canvas is not None:
+            canvas.apply_async()
+    except Exception as e:
+        logger.error(f"Failed to start batch archive {batch_id}: {str(e)}", exc_info=True)
+        batch_progress.finish(batch_id, status='failed', error=str(e))
+        raise
     return {
         'status': 'success',
+        'batch_id': batch_id,
         'total_urls': len(urls),
-        'results': results
-    } 
\ No newline at end of file
+        'already_archived': already_archived,
+        'submitted': len(to_archive)
+    }
+
+@celery.task
+def refit_clusters():
+    """Refit the clusterer on a sample, publish it, and relabel every URL."""
+    sampled = ml_analyzer.fit_clusters()
+    if not sampled:
+        logger.info("Not enough analyzed URLs to fit clusters")
+        return {'status': 'skipped', 'sampled': 0}
+    ml_analyzer.save_models()
+    labelled = ml_analyzer.assign_clusters(reassign=True)
+    logger.info(f"Refit clusters on {sampled} URLs and relabelled {labelled}")
+    return {'status': 'success', 'sampled': sampled, 'labelled': labelled}
+
+@celery.task
+def assign_clusters():
+    """Label URLs analyzed since the last run with the current clusters."""
+    labelled = ml_analyzer.assign_clusters()
+    logger.info(f"Assigned clusters to {labelled} URLs")
+    return {'status': 'success', 'labelled': labelled}
@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+from archive_parser import ArchivePhParser, capture_archive_id
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'fixtures')
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), encoding='utf-8') as f:
+        return f.read()
+
+PARSER_PAGES = [load_fixture(name) for name in (
+    'archive_ph_x_status.html',
+    'archive_ph_twitter_legacy.html',
+    'archive_ph_non_twitter.html',
+    'x_com_status.html',
+)] + [
+    # Text after a child element is the element's tail in lxml
+    '<html><body><div class="archive-date"><script>var t = 1;</script>2021-10-18T16:12:09Z</div></body></html>',
+    '<html><body><div class="archive-date"><b>Archived</b> <style>b {}</style>2021-10-18T16:12:09Z</div></body></html>',
+    '<html><body><div class="archive-date"><!-- note --><template>x</template>2021-10-18T16:12:09Z</div></body></html>',
+    '<html><head><link rel="alternate canonical" href="https://x.com/a/status/1"></head>'
+    '<body><span data-time="2023-06-14T09:12:41Z"></span></body></html>',
+    '',
+]
+
+@pytest.mark.parametrize('url, base_url, expected', [
+    ('https://archive.ph/AbC12', 'https://archive.ph', 'AbC12'),
+    ('https://archive.today/wip/AbC12', 'https://archive.today', 'AbC12'),
+    # A capture on another archive.* mirror is still a capture
+    ('https://archive.is/AbC12', 'https://archive.today', 'AbC12'),
+    ('https://archive.mirror.example/AbC12', 'https://archive.mirror.example', 'AbC12'),
+    ('https://archive.mirror.example/AbC12', 'https://archive.ph', None),
+    # Still on the submit form: not archived yet
+    ('https://archive.ph/submit/?url=https://example.com', 'https://archive.ph', None),
+    ('https://archive.ph/', 'https://archive.ph', None),
+    ('https://example.com/archive.ph/AbC12', 'https://archive.ph', None),
+])
+def test_capture_archive_id(url, base_url, expected):
+    assert capture_archive_id(url, base_url) == expected
+
+@pytest.mark.parametrize('page', PARSER_PAGES, ids=range(len(PARSER_PAGES)))
+def test_parser_modes_agree(page):
+    bs4_parser = ArchivePhParser(page, mode='bs4')
+    lxml_parser = ArchivePhParser(page, mode='lxml')
+    for method in ('get_original_url', 'get_archive_date', 'get_tweet_date'):
+        assert getattr(lxml_parser, method)() == getattr(bs4_parser, method)(), method
+
+def test_class_probe_reads_text_after_child_elements():
+    page = PARSER_PAGES[4]
+    for mode in ('bs4', 'lxml'):
+        assert ArchivePhParser(page, mode=mode).get_archive_date().isoformat() == '2021-10-18T16:12:09'
@@ -0,0 +1,108 @@
+import io
+import socket
+
+import pytest
+import requests
+
+import archive_server1
+import http_client
+import upstream_governor
+
+class FakeRaw(io.BytesIO):
+    def read(self, size=-1, decode_content=False):
+        return super().read(size)
+
+class FakeResponse:
+    headers = {}
+    is_redirect = False
+
+    def __init__(self, body, status_code=200):
+        self.raw = FakeRaw(body)
+        self.status_code = status_code
+
+    def close(self):
+        pass
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'{self.status_code} Error', response=self)
+
+@pytest.fixture
+def client(monkeypatch):
+    def getaddrinfo(host, port, *args, **kwargs):
+        address = '127.0.0.1' if host == 'localhost' else host if host[0].isdigit() else '93.184.215.14'
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', (address, port))]
+
+    requested = []
+    failures = {}  # url -> FakeResponse or exception to return instead of the page
+
+    def request(method, url, **kwargs):
+        requested.append(url)
+        failure = failures.get(url)
+        if isinstance(failure, Exception):
+            raise failure
+        return failure or FakeResponse(b'<html><body><p>Some page text</p></body></html>')
+
+    monkeypatch.setattr(socket, 'getaddrinfo', getaddrinfo)
+    monkeypatch.setattr(http_client, 'request', request)
+    monkeypatch.setattr(archive_server1, 'analyze_contents', lambda batch: {
+        url: {'category': 'Web page'} for url, _ in batch
+    })
+    client = archive_server1.app.test_client()
+    client.requested = requested
+    client.failures = failures
+    return client
+
+def test_internal_addresses_are_not_fetched(client):
+    urls = ['http://169.254.169.254/latest/meta-data/', 'http://localhost:6379/', 'http://10.0.0.1/']
+    response = client.post('/batch-analyze', json={'urls': urls})
+    assert response.status_code == 200
+    assert [result['url'] for result in response.json] == urls
+    assert all('not a public address' in result['error'] for result in response.json)
+    assert client.requested == []
+
+def test_every_host_is_paced(client):
+    response = client.post('/batch-analyze', json={'urls': ['https://pages.example/a', 'https://pages.example/b']})
+    assert [result['analysis'] for result in response.json] == [{'category': 'Web page'}] * 2
+    assert sorted(client.requested) == ['https://pages.example/a', 'https://pages.example/b']
+    assert upstream_governor.get_governor('pages.example').stats['requests'] == 2
+
+def test_hosts_per_batch_are_capped(client):
+    urls = [f'https://host{i}.example/' for i in range(archive_server1.ANALYZE_CONFIG['max_hosts'] + 1)]
+    response = client.post('/batch-analyze', json={'urls': urls})
+    assert response.status_code == 400
+    assert response.json['error'] == 'Too many hosts'
+    assert client.requested == []
+
+def test_failed_fetches_are_reported_per_url(client):
+    client.failures.update({
+        'https://down.example/a': FakeResponse(b'', status_code=503),
+        'https://missing.example/a': FakeResponse(b'', status_code=404),
+        'https://gone.example/a': requests.ConnectionError('connection refused'),
+    })
+    urls = ['https://down.example/a', 'https://up.example/a', 'https://missing.example/a', 'https://gone.example/a']
+    response = client.post('/batch-analyze', json={'urls': urls})
+    assert response.status_code == 200
+    assert response.json == [
+        {'url': 'https://down.example/a', 'error': 'Page host temporarily unavailable'},
+        {'url': 'https://up.example/a', 'analysis': {'category': 'Web page'}},
+        {'url': 'https://missing.example/a', 'error': 'Page returned HTTP 404'},
+        {'url': 'https://gone.example/a', 'error': 'Failed to fetch page'},
+    ]
+    assert upstream_governor.get_governor('gone.example').stats['failures'] == 1
+
+def test_failed_analysis_fails_the_batch(client, monkeypatch):
+    def analyze_contents(batch):
+        raise RuntimeError('database is locked')
+
+    monkeypatch.setattr(archive_server1, 'analyze_contents', analyze_contents)
+    response = client.post('/batch-analyze', json={'urls': ['https://pages.example/a']})
+    assert response.status_code == 500
+    assert response.json == {'error': 'Internal server error', 'details': 'database is locked'}
+
+def test_oversized_batch_is_rejected(client):
+    urls = [f'https://pages.example/{i}' for i in range(archive_server1.ANALYZE_CONFIG['max_urls'] + 1)]
+    response = client.post('/batch-analyze', json={'urls': urls})
+    assert response.status_code == 400
+    assert response.json['error'] == 'Too many URLs'
+    assert client.requested == []
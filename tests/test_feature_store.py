@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from feature_store import FeatureStore
+from models import Base
+
+@pytest.fixture
+def session():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+def feature_rows(rng, n):
+    return [{'url_length': float(x), 'word_count': float(y)} for x, y in rng.normal(50, 10, size=(n, 2))]
+
+def test_merged_batches_match_the_full_statistics(session):
+    store = FeatureStore(('url_length', 'word_count'))
+    rng = np.random.default_rng(0)
+    batches = [feature_rows(rng, n) for n in (1, 7, 30)]
+    next_id = 1
+    for batch in batches:
+        store.append(session, list(range(next_id, next_id + len(batch))), batch)
+        next_id += len(batch)
+
+    values = np.array([[row['url_length'], row['word_count']] for batch in batches for row in batch])
+    stats = store.stats(session)
+    for column, name in enumerate(store.feature_names):
+        count, mean, m2 = stats[name]
+        assert count == len(values)
+        assert mean == pytest.approx(values[:, column].mean())
+        assert m2 / count == pytest.approx(values[:, column].var())
+
+    merged = dict(stats)
+    assert store.rebuild(session) == 2
+    for name, (count, mean, m2) in store.stats(session).items():
+        assert (count, mean, m2) == pytest.approx(merged[name])
+
+def test_missing_features_are_not_counted(session):
+    store = FeatureStore(('url_length', 'word_count'))
+    store.append(session, [1, 2, 3], [{'url_length': 10.0}, {'url_length': 20.0, 'word_count': 4.0}, {}])
+    stats = store.stats(session)
+    assert stats['url_length'][:2] == (2, 15.0)
+    assert stats['word_count'][:2] == (1, 4.0)
+    # Importance needs two observations
+    assert set(store.importance(session)) == {'url_length'}
+    ids, matrix = store.feature_matrix(session)
+    assert ids.tolist() == [1, 2, 3]
+    assert np.isnan(matrix[2]).all()
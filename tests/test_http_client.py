@@ -0,0 +1,76 @@
+import socket
+
+import pytest
+import requests
+
+import http_client
+from http_client import UnsafeURL, check_public_url, get_public
+
+PUBLIC_ADDRESS = '93.184.215.14'
+
+@pytest.fixture
+def resolver(monkeypatch):
+    """Resolve names from a fixed table instead of DNS."""
+    table = {'public.example': PUBLIC_ADDRESS, 'internal.example': '10.0.0.5'}
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        address = table.get(host, host)
+        if address == 'localhost':
+            address = '127.0.0.1'
+        family = socket.AF_INET6 if ':' in address else socket.AF_INET
+        return [(family, socket.SOCK_STREAM, 6, '', (address, port))]
+
+    monkeypatch.setattr(socket, 'getaddrinfo', getaddrinfo)
+
+@pytest.mark.parametrize('url', [
+    'http://169.254.169.254/latest/meta-data/',
+    'http://localhost:6379/',
+    'http://127.0.0.1/',
+    'http://10.1.2.3/',
+    'http://192.168.0.1/',
+    'http://[::1]/',
+    'http://[fe80::1]/',
+    'http://[::ffff:127.0.0.1]/',
+    'http://0.0.0.0/',
+    'http://internal.example/',
+    'ftp://public.example/',
+    'file:///etc/passwd',
+])
+def test_internal_addresses_are_rejected(resolver, url):
+    with pytest.raises(UnsafeURL):
+        check_public_url(url)
+
+def test_public_address_is_allowed(resolver):
+    check_public_url('https://public.example/page')
+
+class FakeResponse:
+    def __init__(self, status_code, location=None):
+        self.status_code = status_code
+        self.headers = {'location': location} if location else {}
+        self.is_redirect = location is not None
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+def test_redirect_to_internal_address_is_not_followed(resolver, monkeypatch):
+    requested = []
+
+    def request(method, url, **kwargs):
+        requested.append(url)
+        assert kwargs['allow_redirects'] is False
+        return FakeResponse(302, 'http://169.254.169.254/latest/meta-data/')
+
+    monkeypatch.setattr(http_client, 'request', request)
+    with pytest.raises(UnsafeURL):
+        get_public('http://public.example/start')
+    assert requested == ['http://public.example/start']
+
+def test_redirects_are_followed_and_bounded(resolver, monkeypatch):
+    monkeypatch.setattr(http_client, 'request', lambda method, url, **kwargs: FakeResponse(302, '/again'))
+    with pytest.raises(requests.TooManyRedirects):
+        get_public('http://public.example/start')
+
+    responses = iter([FakeResponse(301, '/final'), FakeResponse(200)])
+    monkeypatch.setattr(http_client, 'request', lambda method, url, **kwargs: next(responses))
+    assert get_public('http://public.example/start').status_code == 200
@@ -0,0 +1,95 @@
+import pytest
+from sqlalchemy import create_engine, event, func, select
+from sqlalchemy.orm import sessionmaker
+
+from ml_analyzer import CONTENT_PATTERN_TYPE, MLAnalyzer
+from models import URL, Base, Pattern, url_patterns
+
+CLIMATE = 'climate policy energy markets carbon tax renewable grid storage solar wind turbines'
+RECIPES = 'sourdough starter flour water salt proofing basket oven crust crumb hydration'
+
+@pytest.fixture
+def analyzer():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield MLAnalyzer(session)
+    session.close()
+
+def content_patterns(session):
+    return session.execute(
+        select(Pattern.id, Pattern.usage_count).where(Pattern.pattern_type == CONTENT_PATTERN_TYPE)
+    ).all()
+
+def test_similar_content_scores_against_stored_content_pattern(analyzer):
+    [first] = analyzer.analyze_urls([('https://example.com/a', CLIMATE)])
+    assert not first['is_known_pattern']
+    [(pattern_id, _)] = content_patterns(analyzer.session)
+
+    # Same words in another order: a different page, but the same content pattern
+    reordered = ' '.join(reversed(CLIMATE.split()))
+    [second] = analyzer.analyze_urls([('https://example.com/b', reordered)])
+    assert second['is_known_pattern'] and second['duplicate_of'] is None
+    assert second['similarity_score'] > 0.8
+    url = analyzer.session.get(URL, second['url_id'])
+    assert analyzer.load_pattern_index().search(url.content_embedding)[0][0] == pattern_id
+    assert len(content_patterns(analyzer.session)) == 1
+    # Content patterns stay out of the reported patterns
+    assert all(p['pattern_type'] != CONTENT_PATTERN_TYPE for p in second['patterns'])
+
+def test_unrelated_content_adds_a_content_pattern(analyzer):
+    analyzer.analyze_urls([('https://example.com/a', CLIMATE)])
+    [other] = analyzer.analyze_urls([('https://example.com/c', RECIPES)])
+    assert not other['is_known_pattern']
+    assert len(content_patterns(analyzer.session)) == 2
+
+def test_batch_creates_one_content_pattern_per_novel_content(analyzer):
+    results = analyzer.analyze_urls([
+        ('https://example.com/a', CLIMATE),
+        ('https://example.com/b', CLIMATE),
+        ('https://example.com/c', RECIPES),
+        ('https://example.com/d', ''),
+    ])
+    assert [r['url_id'] for r in results] == sorted({r['url_id'] for r in results})
+    patterns = content_patterns(analyzer.session)
+    assert len(patterns) == 2 and all(uses == 1 for _, uses in patterns)
+    links = analyzer.session.execute(
+        select(url_patterns.c.url_id).where(url_patterns.c.pattern_id.in_([pid for pid, _ in patterns]))
+    ).scalars().all()
+    assert sorted(links) == [results[0]['url_id'], results[2]['url_id']]
+
+def test_batch_looks_up_urls_together_and_commits_once(analyzer):
+    analyzer.analyze_urls([(f'https://example.com/{i}', CLIMATE) for i in range(3)])
+    statements = []
+    commits = []
+    event.listen(analyzer.session.get_bind(), 'before_cursor_execute',
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    event.listen(analyzer.session, 'after_commit', lambda session: commits.append(session))
+
+    batch = [(f'https://example.com/{i}', f'{RECIPES} {i}') for i in range(6)]
+    results = analyzer.analyze_urls(batch)
+
+    url_selects = [s for s in statements if s.lstrip().startswith('SELECT') and 'FROM urls' in s
+                   and 'urls.url_key IN' in s]
+    # One lookup for the batch and one read-back of the rows it inserted
+    assert len(url_selects) == 2
+    assert len(commits) == 1
+    assert [r['url'] for r in results] == [url for url, _ in batch]
+    assert analyzer.session.scalar(select(func.count()).select_from(URL)) == 6
+
+def test_failed_batch_is_rolled_back(analyzer, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError('disk full')
+
+    monkeypatch.setattr(analyzer.feature_store, 'append', fail)
+    with pytest.raises(RuntimeError):
+        analyzer.analyze_urls([('https://example.com/a', CLIMATE)])
+    assert analyzer.session.scalar(select(func.count()).select_from(URL)) == 0
+    assert analyzer.session.scalar(select(func.count()).select_from(Pattern)) == 0
+    assert len(analyzer.load_pattern_index()) == 0
+
+    # The rolled-back catalog ids are forgotten, so the next batch recreates its rows
+    monkeypatch.undo()
+    [result] = analyzer.analyze_urls([('https://example.com/a', CLIMATE)])
+    assert result['url_id'] is not None
+    assert len(content_patterns(analyzer.session)) == 1
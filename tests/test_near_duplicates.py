@@ -0,0 +1,82 @@
+import os
+
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+import near_duplicates
+from archive_parser import html_to_text
+from ml_analyzer import MLAnalyzer
+from models import URL, Base
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'fixtures')
+
+@pytest.fixture
+def x_status_pages():
+    """Two different tweets from one account, captured on the same x.com page template."""
+    with open(os.path.join(FIXTURES, 'archive_ph_x_status.html'), encoding='utf-8') as f:
+        html = f.read()
+    other = html.replace('held through the dip', 'held through the rally').replace(
+        '1450164274303803396', '1450164274303803397'
+    )
+    return html_to_text(html), html_to_text(other)
+
+@pytest.fixture
+def analyzer():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield MLAnalyzer(session)
+    session.close()
+
+def test_same_template_tweets_are_below_threshold(x_status_pages):
+    first, second = x_status_pages
+    score = near_duplicates.similarity(near_duplicates.minhash(first), near_duplicates.minhash(second))
+    # The shared page chrome alone puts them well above chance
+    assert 0.5 <= score < near_duplicates.NEAR_DUPLICATE_CONFIG['threshold']
+
+def test_same_template_tweets_are_not_merged(analyzer, x_status_pages, monkeypatch):
+    first, second = x_status_pages
+    # Even when the index reports them as near-duplicates, different content is analyzed afresh
+    monkeypatch.setitem(near_duplicates.NEAR_DUPLICATE_CONFIG, 'threshold', 0.5)
+    original = analyzer.analyze_urls([('https://x.com/StrangeHandsNFT/status/1450164274303803396', first)])[0]
+    other = analyzer.analyze_urls([('https://x.com/StrangeHandsNFT/status/1450164274303803397', second)])[0]
+    assert other['url_id'] != original['url_id']
+    assert other['duplicate_of'] is None
+
+def test_identical_content_is_reused(analyzer, x_status_pages):
+    first, _ = x_status_pages
+    original = analyzer.analyze_urls([('https://archive.ph/FexMt', first)])[0]
+    copy = analyzer.analyze_urls([('https://archive.today/FexMt', first)])[0]
+    assert copy['duplicate_of'] == original['url_id']
+    assert copy['similarity_score'] == original['similarity_score']
+
+def test_reused_copy_skips_the_embedding(analyzer, x_status_pages, monkeypatch):
+    first, _ = x_status_pages
+    original = analyzer.analyze_urls([('https://archive.ph/FexMt', first)])[0]
+    embedded = []
+    embed = analyzer.embedder.embed
+    monkeypatch.setattr(analyzer.embedder, 'embed', lambda contents: embedded.append(contents) or embed(contents))
+    copy = analyzer.analyze_urls([('https://archive.today/FexMt', first)])[0]
+    assert copy['duplicate_of'] == original['url_id']
+    assert embedded == []
+    rows = {row.id: row for row in analyzer.session.scalars(select(URL))}
+    assert rows[copy['url_id']].content_hash == rows[original['url_id']].content_hash
+    assert list(rows[copy['url_id']].content_embedding) == list(rows[original['url_id']].content_embedding)
+
+def test_match_whose_content_changed_is_not_reused(analyzer, x_status_pages):
+    first, second = x_status_pages
+    original = analyzer.analyze_urls([('https://archive.ph/FexMt', first)])[0]
+    # The matched URL was re-analyzed since; its signature and hash now describe other content
+    analyzer.analyze_urls([('https://archive.ph/FexMt', second)])
+    copy = analyzer.analyze_urls([('https://archive.today/FexMt', first)])[0]
+    assert copy['duplicate_of'] is None
+    assert copy['url_id'] != original['url_id']
+
+def test_find_for_url_lists_near_duplicates(analyzer, x_status_pages):
+    first, _ = x_status_pages
+    original = analyzer.analyze_urls([('https://archive.ph/FexMt', first)])[0]
+    copy = analyzer.analyze_urls([('https://archive.today/FexMt', first + ' Translate post')])[0]
+    matches = analyzer.near_duplicates.find_for_url(analyzer.session, copy['url_id'], limit=5)
+    assert [match_id for match_id, _ in matches] == [original['url_id']]
+    assert matches[0][1] >= near_duplicates.NEAR_DUPLICATE_CONFIG['threshold']
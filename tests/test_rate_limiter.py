@@ -0,0 +1,45 @@
+import pytest
+
+import rate_limiter
+from rate_limiter import RATE_LIMIT, LocalWindowCounters, RateLimiter, retry_after
+
+@pytest.fixture
+def limits(monkeypatch):
+    monkeypatch.setitem(RATE_LIMIT, 'window', 60)
+    monkeypatch.setitem(RATE_LIMIT, 'max_requests', 3)
+
+def test_local_counters_limit_each_client():
+    counters = LocalWindowCounters(max_clients=10)
+    assert [counters.hit('a', 0, 0, 60, 3)[0] for _ in range(4)] == [True, True, True, False]
+    assert counters.hit('b', 0, 0, 60, 3)[0]
+
+def test_previous_window_is_weighted_by_overlap():
+    counters = LocalWindowCounters(max_clients=10)
+    for _ in range(3):
+        counters.hit('a', 0, 30, 60, 3)
+    # A sixth of the way into the next window, 2.5 of the 3 requests still count
+    assert counters.hit('a', 1, 10, 60, 3) == (False, 0, 3)
+    assert counters.hit('a', 1, 20, 60, 3) == (True, 1, 3)
+    assert counters.hit('a', 1, 40, 60, 3) == (True, 2, 3)
+    # A gap of more than one window leaves nothing behind
+    assert counters.hit('a', 3, 0, 60, 3) == (True, 1, 0)
+
+def test_least_recently_seen_clients_are_evicted():
+    counters = LocalWindowCounters(max_clients=2)
+    for client in ('a', 'b', 'a', 'c'):
+        counters.hit(client, 0, 0, 60, 3)
+    assert len(counters) == 2 and list(counters._clients) == ['a', 'c']
+
+def test_retry_after_waits_for_the_next_slot():
+    assert retry_after(prev=0, curr=3, elapsed=10, window=60, limit=3) == 50 + 20
+    assert retry_after(prev=4, curr=0, elapsed=0, window=60, limit=3) == 30
+    assert retry_after(prev=0, curr=0, elapsed=59.5, window=60, limit=3) == 1
+
+def test_unreachable_redis_falls_back_to_local_counters(limits, monkeypatch):
+    monkeypatch.setattr(rate_limiter.time, 'time', lambda: 600.0)
+    limiter = RateLimiter('redis://127.0.0.1:1/0')
+    assert [limiter.hit('client')[0] for _ in range(3)] == [True] * 3
+    allowed, wait = limiter.hit('client')
+    # Next window, once the 3 requests' weight has decayed to make room for one more
+    assert not allowed and wait == 60 + 20
+    assert not limiter.status.available()
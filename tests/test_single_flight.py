@@ -0,0 +1,62 @@
+import threading
+
+from single_flight import SingleFlight
+
+def run_concurrently(flight, key, fn, callers):
+    results = [None] * callers
+    threads = []
+
+    def call(i):
+        try:
+            results[i] = flight.do(key, fn)
+        except Exception as e:
+            results[i] = e
+
+    for i in range(callers):
+        threads.append(threading.Thread(target=call, args=(i,)))
+        threads[-1].start()
+    return threads, results
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return {'archiveId': 'AbC12'}
+
+    threads, results = run_concurrently(flight, 'AbC12', fetch, 4)
+    while flight.stats['coalesced'] < 3:
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert results == [{'archiveId': 'AbC12'}] * 4
+
+def test_leader_failure_reaches_waiters_and_releases_the_key():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def fetch():
+        release.wait(5)
+        raise ConnectionError('archive.ph unreachable')
+
+    threads, results = run_concurrently(flight, 'AbC12', fetch, 3)
+    while flight.stats['coalesced'] < 2:
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert all(isinstance(result, ConnectionError) for result in results)
+    assert len({id(result) for result in results}) == 1
+
+    # The failed call is not cached; the next caller runs afresh
+    assert flight.do('AbC12', lambda: 'ok') == 'ok'
+    assert flight.stats['leaders'] == 2
+
+def test_unreachable_redis_still_runs_the_call():
+    flight = SingleFlight('redis://127.0.0.1:1/0', namespace='test')
+    assert flight.do('AbC12', lambda: {'archiveId': 'AbC12'}) == {'archiveId': 'AbC12'}
@@ -0,0 +1,70 @@
+import time
+
+import pytest
+
+import upstream_governor
+from upstream_governor import GOVERNOR_CONFIG, CircuitOpen, UpstreamGovernor, UpstreamThrottled
+
+@pytest.fixture
+def governor(monkeypatch):
+    monkeypatch.setitem(GOVERNOR_CONFIG, 'failure_threshold', 3)
+    monkeypatch.setitem(GOVERNOR_CONFIG, 'open_seconds', 30)
+    return UpstreamGovernor('pages.example')
+
+def open_circuit(governor):
+    for _ in range(GOVERNOR_CONFIG['failure_threshold']):
+        governor.reserve()
+        governor.observe(502)
+
+def test_consecutive_failures_open_the_circuit(governor):
+    open_circuit(governor)
+    assert governor.state == 'open'
+    with pytest.raises(CircuitOpen) as raised:
+        governor.reserve()
+    assert 0 < raised.value.retry_after <= GOVERNOR_CONFIG['open_seconds']
+    assert governor.stats['circuit_opens'] == 1 and governor.stats['rejected'] == 1
+
+def test_successful_probe_closes_the_circuit(governor):
+    open_circuit(governor)
+    governor.opened_until = time.monotonic() - 1
+    governor.reserve()
+    assert governor.state == 'half_open'
+    # Only one probe at a time
+    with pytest.raises(CircuitOpen):
+        governor.reserve()
+    governor.observe(200)
+    assert governor.state == 'closed'
+    governor.reserve()
+
+def test_failed_probe_reopens_the_circuit(governor):
+    open_circuit(governor)
+    governor.opened_until = time.monotonic() - 1
+    governor.reserve()
+    governor.record_failure()
+    assert governor.state == 'open'
+    assert governor.stats['circuit_opens'] == 2
+
+def test_throttling_halves_the_rate_and_honours_retry_after(governor):
+    rate = governor.rate
+    with pytest.raises(UpstreamThrottled) as raised:
+        governor.observe(429, {'Retry-After': '20'})
+    assert raised.value.retry_after == 20 and raised.value.hinted
+    assert governor.rate == pytest.approx(rate * GOVERNOR_CONFIG['decrease_factor'])
+    # Waiting out the Retry-After would exceed max_queue_wait, so callers fail fast
+    with pytest.raises(UpstreamThrottled):
+        governor.reserve()
+
+def test_captcha_page_counts_as_throttling(governor):
+    with pytest.raises(UpstreamThrottled, match='CAPTCHA'):
+        governor.observe(200, {}, b'<div class="g-recaptcha"></div>')
+    assert governor.stats['throttled'] == 1
+
+def test_least_recently_used_governors_are_evicted(monkeypatch):
+    monkeypatch.setitem(GOVERNOR_CONFIG, 'max_hosts', 2)
+    monkeypatch.setattr(upstream_governor, '_governors', upstream_governor.OrderedDict())
+    first = upstream_governor.get_governor('https://one.example/a')
+    upstream_governor.get_governor('two.example')
+    assert upstream_governor.get_governor('ONE.example') is first
+    upstream_governor.get_governor('three.example')
+    assert list(upstream_governor._governors) == ['one.example', 'three.example']
+    assert upstream_governor.get_governor('archive.today') is upstream_governor.get_governor('archive.ph')
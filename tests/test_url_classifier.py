@@ -0,0 +1,22 @@
+from archive_parser import extract_archive_id, extract_tweet_id
+from url_classifier import classify_text, classify_url
+
+EMBEDDED_QUERY = 'x.com/a/status/9?ref=https://t.co'
+EMBEDDED_PATH = 'archive.ph/o/abc/https://twitter.com/a/status/1'
+
+def test_scheme_is_only_read_at_the_start():
+    info = classify_url(EMBEDDED_QUERY)
+    assert (info.host, info.kind, info.tweet_id) == ('x.com', 'tweet', '9')
+    assert extract_tweet_id(EMBEDDED_QUERY) == '9'
+
+def test_archive_link_wrapping_a_url():
+    info = classify_url(EMBEDDED_PATH)
+    assert (info.host, info.kind, info.archive_id) == ('archive.ph', 'archive', 'abc')
+    assert extract_archive_id(EMBEDDED_PATH) == 'abc'
+
+def test_classify_text_with_embedded_urls():
+    infos = classify_text(f'See {EMBEDDED_QUERY} and {EMBEDDED_PATH}.')
+    assert [(info.kind, info.tweet_id, info.archive_id) for info in infos] == [
+        ('tweet', '9', None),
+        ('archive', None, 'abc'),
+    ]
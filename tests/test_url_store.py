@@ -0,0 +1,54 @@
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+
+import url_store
+from models import URL, Base
+from url_store import upsert_urls
+
+@pytest.fixture
+def session():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+def url_count(session):
+    return session.scalar(select(func.count()).select_from(URL))
+
+def test_missing_urls_are_inserted_once(session):
+    urls = ['https://example.com/a', 'https://example.com/b']
+    rows, inserted = upsert_urls(session, urls)
+    assert inserted == set(urls)
+    assert [rows[url].original_url for url in urls] == urls
+
+    again, inserted = upsert_urls(session, urls + ['https://example.com/c'])
+    assert inserted == {'https://example.com/c'}
+    assert [again[url].id for url in urls] == [rows[url].id for url in urls]
+    assert url_count(session) == 3
+
+def test_urls_that_normalize_alike_share_a_row(session):
+    rows, inserted = upsert_urls(session, ['https://example.com/a', 'HTTPS://Example.com:443/a#top'])
+    assert rows['https://example.com/a'] is rows['HTTPS://Example.com:443/a#top']
+    assert len(inserted) == 2  # both spellings map onto the row this call created
+    assert url_count(session) == 1
+    assert rows['https://example.com/a'].original_url == 'https://example.com/a'
+
+def test_row_inserted_concurrently_is_reused(session, monkeypatch):
+    session.add(URL(original_url='https://example.com/a', url_key=URL.make_key('https://example.com/a')))
+    session.flush()
+    existing = session.scalar(select(URL.id))
+
+    # Another worker inserted the row between this worker's lookup and its insert
+    load_urls = url_store.load_urls
+    calls = []
+
+    def stale_then_fresh(session, keys):
+        calls.append(keys)
+        return {} if len(calls) == 1 else load_urls(session, keys)
+
+    monkeypatch.setattr(url_store, 'load_urls', stale_then_fresh)
+    rows, _ = upsert_urls(session, ['https://example.com/a'])
+    assert rows['https://example.com/a'].id == existing
+    assert url_count(session) == 1
@@ -0,0 +1,41 @@
+import pytest
+
+from utils import extractArchiveInfo, extractTwitterInfo, isArchivedUrl
+
+def test_extract_archive_info_keeps_raw_netloc_and_path():
+    assert extractArchiveInfo('https://Archive.ph:443') == {
+        'archiveId': None,
+        'domain': 'Archive.ph:443',
+        'isWIP': False,
+        'fullPath': ''
+    }
+
+def test_extract_archive_info():
+    assert extractArchiveInfo('https://archive.ph/wip/AbC12') == {
+        'archiveId': 'AbC12',
+        'domain': 'archive.ph',
+        'isWIP': True,
+        'fullPath': '/wip/AbC12'
+    }
+    assert extractArchiveInfo('https://archive.ph/o/AbC12/https://x.com/a/status/1')['archiveId'] == 'AbC12'
+
+@pytest.mark.parametrize('url, expected', [
+    ('https://archive.ph/AbC12', True),
+    ('https://archive.today/AbC12', True),
+    ('https://x.com/a/status/1', False),
+    ('https://example.com/archive.ph/AbC12', False),
+])
+def test_is_archived_url(url, expected):
+    assert isArchivedUrl(url) is expected
+
+@pytest.mark.parametrize('url, tweet_id', [
+    ('https://twitter.com/a/status/123', '123'),
+    ('https://x.com/i/status/123', '123'),
+    ('https://twitter.com/a/statuses/123', '123'),
+    ('https://archive.ph/o/AbC12/https://twitter.com/a/status/123', '123'),
+    ('https://example.com/share?u=x.com/a/status/123', '123'),
+    ('https://x.com/a', None),
+    ('not a url', None),
+])
+def test_extract_twitter_info(url, tweet_id):
+    assert extractTwitterInfo(url) == {'tweetId': tweet_id, 'isTwitterUrl': tweet_id is not None}
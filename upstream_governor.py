@@ -0,0 +1,277 @@
+"""Adaptive throttling, circuit breaking and retry backoff for archive.ph.
+
+Every call to an upstream host goes through that host's governor:
+
+* Requests are spaced at an adaptive rate (AIMD): each healthy response
+  raises the rate a little, each 429/503/CAPTCHA halves it, and a
+  ``Retry-After`` pauses the host for everyone at once.
+* After ``failure_threshold`` consecutive failures the circuit opens and
+  calls fail fast with CircuitOpen for ``open_seconds``. One probe is then
+  let through; if it succeeds the circuit closes again.
+* Callers that would have to queue longer than ``max_queue_wait`` for a
+  slot fail fast with UpstreamThrottled instead of tying up a worker.
+* Retries use full-jitter exponential backoff, or the upstream's
+  ``Retry-After`` when it sent one.
+
+State is per process and per host, shared by the Flask server, the async
+service and Celery tasks running in that process. Pages fetched for
+analysis can name any host, so only the ``max_hosts`` most recently used
+governors are kept, and hosts other than archive.ph share one metrics label.
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+from metrics import UPSTREAM_EVENTS, UPSTREAM_RATE, upstream_host
+
+logger = logging.getLogger(__name__)
+
+GOVERNOR_CONFIG = {
+    'initial_rate': float(os.environ.get('UPSTREAM_INITIAL_RATE', 10)),  # requests per second per process
+    'min_rate': 0.2,
+    'max_rate': float(os.environ.get('UPSTREAM_MAX_RATE', 50)),
+    'increase_step': 0.2,  # added to the rate per healthy response
+    'decrease_factor': 0.5,  # rate multiplier on throttling
+    'max_queue_wait': 10,  # seconds a caller may wait for a slot before failing fast
+    'failure_threshold': int(os.environ.get('UPSTREAM_FAILURE_THRESHOLD', 5)),
+    'open_seconds': int(os.environ.get('UPSTREAM_OPEN_SECONDS', 30)),
+    'backoff_base': 1,
+    'backoff_cap': 30,
+    'max_retry_wait': 60,  # give up rather than honour a longer Retry-After
+    'throttle_statuses': (429, 503),
+    'captcha_markers': ('g-recaptcha', 'h-captcha', 'cf-challenge', 'Please complete the security check'),
+    'captcha_max_bytes': 50000,  # CAPTCHA interstitials are small; archived pages are not
+    # archive.today mirrors are one service and share one governor
+    'host_aliases': {'archive.is': 'archive.ph', 'archive.md': 'archive.ph', 'archive.today': 'archive.ph'},
+    'max_hosts': int(os.environ.get('UPSTREAM_MAX_HOSTS', 1024))  # governors kept, least recently used evicted
+}
+
+class UpstreamUnavailable(Exception):
+    """The upstream cannot be called right now; ``retry_after`` is in seconds.
+
+    ``hinted`` is False when the upstream sent no Retry-After and the value
+    is only our own estimate.
+    """
+
+    def __init__(self, message, retry_after, hinted=True):
+        super().__init__(message)
+        self.retry_after = max(1, int(round(retry_after)))
+        self.hinted = hinted
+
+class CircuitOpen(UpstreamUnavailable):
+    pass
+
+class UpstreamThrottled(UpstreamUnavailable):
+    pass
+
+def parse_retry_after(value):
+    """Seconds from a Retry-After header (delta-seconds or HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def is_captcha_page(body):
+    """True for a small interstitial page carrying a CAPTCHA; ``body`` is str or bytes."""
+    if not body or len(body) > GOVERNOR_CONFIG['captcha_max_bytes']:
+        return False
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', errors='replace')
+    return any(marker in body for marker in GOVERNOR_CONFIG['captcha_markers'])
+
+def full_jitter(attempt, base, cap):
+    """Uniform wait in [0, min(cap, base * 2**attempt)]."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+class UpstreamGovernor:
+    def __init__(self, host):
+        self.host = host
+        self.rate = GOVERNOR_CONFIG['initial_rate']
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_until = 0.0
+        self.probing = False
+        self.probe_started = 0.0
+        self.next_slot = 0.0
+        self.stats = {
+            'requests': 0,
+            'successes': 0,
+            'failures': 0,
+            'throttled': 0,
+            'rejected': 0,
+            'circuit_opens': 0
+        }
+        self._lock = threading.Lock()
+        self._label = upstream_host(f'//{host}')
+        # One rate gauge per archive host; other hosts' rates would overwrite each other
+        self._rate_gauge = UPSTREAM_RATE.labels(self._label) if self._label != 'other' else None
+        self._publish_rate()
+
+    def _publish_rate(self):
+        if self._rate_gauge is not None:
+            self._rate_gauge.set(self.rate)
+
+    def _event(self, event):
+        self.stats[event] += 1
+        UPSTREAM_EVENTS.labels(self._label, event).inc()
+
+    def snapshot(self):
+        return dict(self.stats, host=self.host, rate=round(self.rate, 3), state=self.state)
+
+    def reserve(self):
+        """Claim the next request slot and return the seconds to wait for it.
+
+        Raises CircuitOpen while the circuit is open and UpstreamThrottled
+        when the wait would exceed ``max_queue_wait``.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self.state == 'open':
+                if now < self.opened_until:
+                    self._event('rejected')
+                    raise CircuitOpen(f"{self.host} circuit open", self.opened_until - now)
+                self.state = 'half_open'
+            if self.state == 'half_open':
+                # A probe that never reported back must not wedge the circuit
+                if self.probing and now - self.probe_started < GOVERNOR_CONFIG['open_seconds']:
+                    self._event('rejected')
+                    raise CircuitOpen(f"{self.host} circuit half-open, probe in flight",
+                                      GOVERNOR_CONFIG['backoff_base'])
+                self.probing = True
+                self.probe_started = now
+
+            slot = max(now, self.next_slot)
+            delay = slot - now
+            if delay > GOVERNOR_CONFIG['max_queue_wait']:
+                self.probing = False
+                self._event('rejected')
+                raise UpstreamThrottled(f"{self.host} is throttling requests", delay)
+            self.next_slot = slot + 1.0 / self.rate
+            self.stats['requests'] += 1
+            return delay
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def observe(self, status_code, headers=None, body=None):
+        """Record an upstream response, raising UpstreamThrottled for 429/503/CAPTCHA."""
+        if status_code in GOVERNOR_CONFIG['throttle_statuses'] or \
+                (status_code == 200 and is_captcha_page(body)):
+            retry_after = parse_retry_after((headers or {}).get('Retry-After'))
+            self.record_throttle(retry_after)
+            reason = 'CAPTCHA' if status_code == 200 else f'HTTP {status_code}'
+            raise UpstreamThrottled(
+                f"{self.host} throttled the request ({reason})",
+                retry_after if retry_after is not None else GOVERNOR_CONFIG['backoff_base'],
+                hinted=retry_after is not None
+            )
+        if status_code >= 500:
+            self.record_failure()
+        else:
+            # 2xx-4xx means the upstream itself is healthy
+            self.record_success()
+
+    def record_success(self):
+        with self._lock:
+            self.stats['successes'] += 1
+            self.consecutive_failures = 0
+            self.probing = False
+            if self.state != 'closed':
+                logger.info(f"Upstream {self.host} recovered, closing circuit")
+                self.state = 'closed'
+            self.rate = min(GOVERNOR_CONFIG['max_rate'], self.rate + GOVERNOR_CONFIG['increase_step'])
+            self._publish_rate()
+
+    def record_failure(self):
+        with self._lock:
+            self.stats['failures'] += 1
+            self._failed()
+
+    def record_throttle(self, retry_after=None):
+        with self._lock:
+            self._event('throttled')
+            self.rate = max(GOVERNOR_CONFIG['min_rate'], self.rate * GOVERNOR_CONFIG['decrease_factor'])
+            self._publish_rate()
+            if retry_after:
+                # Nobody in this process calls the host again before Retry-After
+                self.next_slot = max(self.next_slot, time.monotonic() + retry_after)
+            self._failed()
+
+    def _failed(self):
+        self.consecutive_failures += 1
+        self.probing = False
+        if self.state == 'half_open' or (
+                self.state == 'closed' and self.consecutive_failures >= GOVERNOR_CONFIG['failure_threshold']):
+            self.state = 'open'
+            self.opened_until = time.monotonic() + GOVERNOR_CONFIG['open_seconds']
+            self._event('circuit_opens')
+            logger.warning(
+                f"Upstream {self.host} degraded after {self.consecutive_failures} failures, "
+                f"failing fast for {GOVERNOR_CONFIG['open_seconds']}s"
+            )
+
+    def backoff(self, attempt, retry_after=None, max_wait=None):
+        """Seconds to wait before retry ``attempt`` (0-based), or None to give up.
+
+        Honours ``retry_after`` with a little jitter so waiting callers do not
+        return in lockstep, and refuses waits beyond ``max_wait`` (default
+        ``max_retry_wait``); request handlers pass a few seconds here.
+        """
+        max_wait = GOVERNOR_CONFIG['max_retry_wait'] if max_wait is None else max_wait
+        if retry_after is not None:
+            delay = retry_after + random.uniform(0, GOVERNOR_CONFIG['backoff_base'])
+        else:
+            delay = full_jitter(attempt, GOVERNOR_CONFIG['backoff_base'], GOVERNOR_CONFIG['backoff_cap'])
+        return delay if delay <= max_wait else None
+
+_lock = threading.Lock()
+_governors = OrderedDict()
+
+def get_governor(url_or_host):
+    """Governor for the host of a URL (or a bare host name)."""
+    host = urlparse(url_or_host).hostname if '://' in url_or_host else url_or_host
+    host = (host or url_or_host).lower()
+    host = GOVERNOR_CONFIG['host_aliases'].get(host, host)
+    with _lock:
+        governor = _governors.get(host)
+        if governor is None:
+            governor = _governors[host] = UpstreamGovernor(host)
+            if len(_governors) > GOVERNOR_CONFIG['max_hosts']:
+                _governors.popitem(last=False)
+        else:
+            _governors.move_to_end(host)
+    return governor
+
+def snapshot():
+    """Governor state for the archive hosts, as shown by /health."""
+    return {
+        host: governor.snapshot() for host, governor in list(_governors.items())
+        if upstream_host(f'//{host}') != 'other'
+    }
+
+def _reset_after_fork():
+    global _lock
+    _lock = threading.Lock()
+    _governors.clear()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -164,7 +164,7 @@ const URLAnalyzer = (() => {
                 }
             }
         },
-        batchSize: 50,
+        batchSize: 5000,  // URLs per streamed /batch-metadata request (server max_stream_urls)
         maxConcurrentRequests: 20,
         retryAttempts: 3,
         retryDelay: 1000,
@@ -325,7 +325,7 @@ const URLAnalyzer = (() => {
             return config.archiveUrlPattern.test(url);
         },
 
-        processUrls: async (urls) => {
+        processUrls: async (urls, onResult) => {
             const archiveUrls = [];
             const nonArchiveUrls = [];
             const dates = new Set();
@@ -345,30 +345,18 @@ const URLAnalyzer = (() => {
                 }
             });
 
-            // Process archive URLs in batches
+            // Stream archive URL metadata, handling each URL as the server resolves it
             const archiveResults = [];
             for (let i = 0; i < archiveUrls.length; i += config.batchSize) {
                 const batch = archiveUrls.slice(i, i + config.batchSize);
                 try {
-                    const response = await fetch(`${config.apiBaseUrl}/batch-metadata`, {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json',
-                        },
-                        body: JSON.stringify({ urls: batch })
-                    });
-
-                    if (!response.ok) {
-                        throw new Error('Failed to fetch metadata');
-                    }
-
-                    const data = await response.json();
-                    data.archived_urls.forEach(result => {
+                    await api.streamBatchMetadata(batch, result => {
                         if (result.archive_url && result.archive_date) {
                             archiveDates[result.archive_url] = result.archive_date;
                             dates.add(result.archive_date);
                         }
                         archiveResults.push(result);
+                        if (onResult) onResult(result);
                     });
                 } catch (error) {
                     console.error('Error processing batch:', error);
@@ -708,6 +696,7 @@ const URLAnalyzer = (() => {
 
         updateProgress(progress) {
             const progressBar = document.querySelector('.progress-bar');
+            if (!progressBar) return;
             const progressFill = progressBar.querySelector('.progress-fill');
             const progressText = progressBar.querySelector('.progress-text');
             progressFill.style.width = progress + '%';
@@ -737,6 +726,21 @@ const URLAnalyzer = (() => {
             if (errors) errors.remove();
         },
 
+        // Show each archive URL as its metadata streams in; the full results
+        // replace the list once the analysis finishes
+        appendStreamedResult(result) {
+            let list = elements.output.querySelector('.streamed-results');
+            if (!list) {
+                elements.output.innerHTML = '<ul class="streamed-results"></ul>';
+                list = elements.output.querySelector('.streamed-results');
+            }
+            const item = document.createElement('li');
+            item.textContent = result.error
+                ? `${result.archive_url}: ${result.error}`
+                : `${result.archive_url}: archived ${result.archive_date || 'unknown date'}`;
+            list.appendChild(item);
+        },
+
         updateResults(results) {
             const output = elements.output;
             output.innerHTML = ui.generateResultsHTML(results);
@@ -1145,6 +1149,58 @@ const URLAnalyzer = (() => {
 
     // API functions
     const api = {
+        // POST URLs to /batch-metadata as one NDJSON stream, calling onResult with each
+        // URL's entry as soon as the server resolves it. Returns the batch stats.
+        async streamBatchMetadata(urls, onResult) {
+            const response = await fetch(`${config.apiBaseUrl}/batch-metadata`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'Accept': 'application/x-ndjson'
+                },
+                body: JSON.stringify({ urls })
+            });
+
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+
+            // Servers without streaming answer with one JSON body
+            const contentType = response.headers.get('Content-Type') || '';
+            if (!response.body || !contentType.includes('application/x-ndjson')) {
+                const data = await response.json();
+                data.archived_urls.forEach(onResult);
+                return data.stats;
+            }
+
+            let stats = null;
+            const handleLine = (line) => {
+                if (!line.trim()) return;
+                const { type, ...record } = JSON.parse(line);
+                if (type === 'result') {
+                    onResult(record);
+                } else if (type === 'stats') {
+                    stats = record.stats;
+                } else if (type === 'error') {
+                    throw new Error(record.details || record.error);
+                }
+            };
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                const lines = buffer.split('\n');
+                buffer = lines.pop();  // keep the partial last line for the next chunk
+                lines.forEach(handleLine);
+            }
+            handleLine(buffer + decoder.decode());
+            return stats;
+        },
+
         async fetchArchiveMetadata(archiveId) {
             try {
                 const response = await fetch(`${config.apiBaseUrl}/archive-metadata/${archiveId}`);
@@ -1186,32 +1242,21 @@ const URLAnalyzer = (() => {
                 `;
                 elements.loading.appendChild(progressBar);
 
-                // Process URLs in batches
+                // Stream URLs, updating progress as each one resolves
                 for (let i = 0; i < urls.length; i += batchSize) {
                     const batch = urls.slice(i, i + batchSize);
                     try {
-                        const response = await fetch(`${config.apiBaseUrl}/batch-metadata`, {
-                            method: 'POST',
-                            headers: {
-                                'Content-Type': 'application/json',
-                            },
-                            body: JSON.stringify({ urls: batch })
+                        await api.streamBatchMetadata(batch, result => {
+                            results[result.archive_url] = result;
+
+                            // Update progress
+                            processedUrls += 1;
+                            const progress = (processedUrls / totalUrls) * 100;
+                            progressBar.querySelector('.progress-fill').style.width = `${progress}%`;
+                            progressBar.querySelector('.progress-text').textContent =
+                                `Processing URLs: ${processedUrls}/${totalUrls}`;
                         });
 
-                        if (!response.ok) {
-                            throw new Error(`HTTP error! status: ${response.status}`);
-                        }
-
-                        const data = await response.json();
-                        Object.assign(results, data.results);
-
-                        // Update progress
-                        processedUrls += batch.length;
-                        const progress = (processedUrls / totalUrls) * 100;
-                        progressBar.querySelector('.progress-fill').style.width = `${progress}%`;
-                        progressBar.querySelector('.progress-text').textContent = 
-                            `Processing URLs: ${processedUrls}/${totalUrls}`;
-
                     } catch (error) {
                         console.error('Batch processing error:', error);
                         // Continue with next batch despite errors
@@ -1484,13 +1529,6 @@ const URLAnalyzer = (() => {
 
         console.log('Processing URLs...');
         
-        // Process URLs in batches of 50
-        const batchSize = 50;
-        const batches = [];
-        for (let i = 0; i < urls.length; i += batchSize) {
-            batches.push(urls.slice(i, i + batchSize));
-        }
-
         const results = {
             archivedUrls: [],
             nonArchivedUrls: [],
@@ -1500,25 +1538,23 @@ const URLAnalyzer = (() => {
         let processedCount = 0;
         const totalUrls = urls.length;
 
-        // Process each batch
-        for (const batch of batches) {
-            try {
-                const batchResults = await utils.processUrls(batch);
-                
-                // Merge results
-                results.archivedUrls.push(...(batchResults.archivedUrls || []));
-                results.nonArchivedUrls.push(...(batchResults.nonArchivedUrls || []));
-                Object.assign(results.archiveDates, batchResults.archiveDates || {});
+        // Archive URLs stream in one request; show each as it resolves
+        try {
+            const batchResults = await utils.processUrls(urls, result => {
+                ui.appendStreamedResult(result);
 
                 // Update progress
-                processedCount += batch.length;
-                const progress = (processedCount / totalUrls) * 100;
-                ui.updateProgress(progress);
+                processedCount += 1;
+                ui.updateProgress((processedCount / totalUrls) * 100);
+            });
 
-            } catch (error) {
-                console.error('Batch processing error:', error);
-                // Continue with next batch despite errors
-            }
+            results.archivedUrls.push(...(batchResults.archivedUrls || []));
+            results.nonArchivedUrls.push(...(batchResults.nonArchivedUrls || []));
+            Object.assign(results.archiveDates, batchResults.archiveDates || {});
+            ui.updateProgress(100);
+
+        } catch (error) {
+            console.error('Batch processing error:', error);
         }
 
         return {
@@ -0,0 +1,120 @@
+"""Extraction and classification of archive, tweet and social URLs.
+
+One precompiled pattern finds every URL in a text blob. A second pattern,
+a single alternation anchored at the host, classifies each URL in one
+match:
+
+- archive.* hosts, with the archive ID and the WIP flag
+- Twitter/X status links, with the tweet ID
+- other social hosts
+
+Dates in the URL come from one more precompiled search. Classifications
+are memoized in an LRU, so a URL repeated across a paste, a batch or a
+worker's tasks is parsed once.
+"""
+import os
+import re
+from collections import namedtuple
+from functools import lru_cache
+from urllib.parse import urlsplit, urlunsplit
+
+URL_CLASSIFIER_CONFIG = {
+    'cache_size': int(os.environ.get('URL_CLASSIFIER_CACHE_SIZE', 65536))  # memoized URLs per process
+}
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+ARCHIVE_TLDS = ('ph', 'is', 'today', 'fo', 'li', 'vn', 'md')
+
+# Hosts that start a URL even without a scheme, as pasted from a browser bar
+_BARE_HOSTS = r'(?:www\.)?(?:archive\.(?:' + '|'.join(ARCHIVE_TLDS) + r')|twitter\.com|x\.com)/'
+
+URL_IN_TEXT = re.compile(
+    r'(?:https?://|(?<![\w.@/-])' + _BARE_HOSTS + r')[^\s<>"\'`]+',
+    re.IGNORECASE
+)
+
+# Path of an archive page: /ID, /wip/ID while capturing, or /o/ID/<original URL>
+_ARCHIVE_PATH = r'/(?:(?P<wip>wip)/|o/)?(?P<archive_id>[A-Za-z0-9]+)'
+ARCHIVE_PATH = re.compile(_ARCHIVE_PATH)
+
+# Matched against "host/path" of a normalized URL; the first branch that fits wins
+URL_ROUTES = re.compile(r'''
+    (?:[\w-]+\.)*?
+    (?:
+        (?P<archive>archive\.(?:''' + '|'.join(ARCHIVE_TLDS) + r'''))(?![\w.-])
+        (?:''' + _ARCHIVE_PATH + r''')?
+      | (?P<twitter>twitter\.com|x\.com)(?![\w.-])
+        (?:/\w+/status(?:es)?/(?P<tweet_id>\d+))?
+      | (?P<social>facebook\.com|instagram\.com)(?![\w.-])
+    )
+''', re.VERBOSE)
+
+URL_DATE = re.compile(r'(\d{4})[-/](\d{2})[-/](\d{2})')
+
+# A scheme at the start; "://" later on may belong to a URL embedded in the path or query
+URL_SCHEME = re.compile(r'^[a-zA-Z][a-zA-Z0-9+.-]*://')
+
+# Characters that end a sentence rather than the URL inside it
+TRAILING_PUNCTUATION = '.,;:!?)]}\'"'
+
+# kind is 'archive', 'tweet', 'social', 'web', or None for a URL that does not parse
+URLInfo = namedtuple('URLInfo', 'url normalized host path kind archive_id is_wip tweet_id date')
+
+def normalize_url(url):
+    """Canonical form of a URL for lookups: lower-case scheme and host, no
+    default port or fragment, and ``/`` for an empty path."""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    try:
+        port = parts.port
+    except ValueError:
+        return urlunsplit((scheme, parts.netloc.lower(), parts.path or '/', parts.query, ''))
+    host = parts.hostname or ''
+    if ':' in host:
+        host = f'[{host}]'
+    if port is not None and DEFAULT_PORTS.get(scheme) != port:
+        host = f'{host}:{port}'
+    userinfo = parts.netloc.rpartition('@')[0]
+    netloc = f'{userinfo}@{host}' if userinfo else host
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+@lru_cache(maxsize=URL_CLASSIFIER_CONFIG['cache_size'])
+def classify_url(url):
+    """``URLInfo`` for one URL (scheme optional), memoized per process."""
+    url = url.strip()
+    absolute = url if URL_SCHEME.match(url) else f'https://{url}'
+    try:
+        parts = urlsplit(absolute)
+        host = parts.hostname or ''
+        normalized = normalize_url(absolute)
+    except ValueError:
+        host = ''
+    if not host:
+        return URLInfo(url, None, None, None, None, None, False, None, None)
+
+    path = parts.path or '/'
+    date = URL_DATE.search(url)
+    date = f'{date.group(1)}-{date.group(2)}-{date.group(3)}' if date else None
+    route = URL_ROUTES.match(f'{host}{path}')
+    if route is None:
+        return URLInfo(url, normalized, host, path, 'web', None, False, None, date)
+    if route.group('archive'):
+        return URLInfo(url, normalized, host, path, 'archive', route.group('archive_id'),
+                       route.group('wip') is not None, None, date)
+    tweet_id = route.group('tweet_id')
+    if tweet_id:
+        return URLInfo(url, normalized, host, path, 'tweet', None, False, tweet_id, date)
+    return URLInfo(url, normalized, host, path, 'social', None, False, None, date)
+
+def classify_urls(urls):
+    """``URLInfo`` for each of ``urls``, in order."""
+    return list(map(classify_url, urls))
+
+def extract_urls(text):
+    """The URLs in a text blob, in order, without trailing punctuation."""
+    return [match.rstrip(TRAILING_PUNCTUATION) for match in URL_IN_TEXT.findall(text or '')]
+
+def classify_text(text):
+    """Extract and classify every URL in ``text`` in one pass."""
+    return [classify_url(match.rstrip(TRAILING_PUNCTUATION)) for match in URL_IN_TEXT.findall(text or '')]
@@ -0,0 +1,50 @@
+"""URL rows looked up and created by normalized-URL key.
+
+``urls.url_key`` is the SHA-256 of the normalized URL behind a unique index,
+so a lookup is one index probe however long the URL or large the table.
+New rows are inserted with ON CONFLICT DO NOTHING (or the dialect's
+equivalent), so workers inserting the same URL concurrently end up with one
+row rather than an IntegrityError or a duplicate.
+"""
+from datetime import datetime
+
+from sqlalchemy import select
+
+from database import insert_ignoring_conflicts
+from models import URL
+
+URL_STORE_CONFIG = {
+    'lookup_chunk_size': 500  # keys per IN (...), well under SQLite's bound parameter limit
+}
+
+def load_urls(session, keys):
+    """``{url_key: URL}`` for the existing rows among ``keys``."""
+    keys = list(keys)
+    found = {}
+    chunk_size = URL_STORE_CONFIG['lookup_chunk_size']
+    for start in range(0, len(keys), chunk_size):
+        for url_obj in session.scalars(select(URL).where(URL.url_key.in_(keys[start:start + chunk_size]))):
+            found[url_obj.url_key] = url_obj
+    return found
+
+def upsert_urls(session, urls, now=None):
+    """URL rows for ``urls``, inserting the missing ones.
+
+    Returns ``({url: URL}, inserted)`` where ``inserted`` holds the URLs
+    whose rows this call created. URLs that normalize alike share a row.
+    """
+    keys = {url: URL.make_key(url) for url in urls}
+    found = load_urls(session, set(keys.values()))
+    missing = {}
+    for url, key in keys.items():
+        if key not in found:
+            missing.setdefault(key, url)
+    if missing:
+        now = now or datetime.utcnow()
+        insert_ignoring_conflicts(session, URL.__table__, [
+            {'original_url': url, 'url_key': key, 'created_at': now, 'access_count': 0}
+            for key, url in missing.items()
+        ])
+        found.update(load_urls(session, missing))
+    inserted = {url for url, key in keys.items() if key in missing}
+    return {url: found[key] for url, key in keys.items()}, inserted
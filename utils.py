@@ -1,46 +1,38 @@
-import re
-from urllib.parse import urlparse
+from urllib.parse import urlparse, urlsplit
+
+from url_classifier import classify_text, classify_url
 
 def isArchivedUrl(url):
     """Check if a URL is from an archive service."""
-    archive_domains = ['archive.ph', 'archive.is', 'archive.today', 'archive.fo']
-    parsed = urlparse(url)
-    return any(domain in parsed.netloc for domain in archive_domains)
+    return classify_url(url).kind == 'archive'
 
 def extractArchiveInfo(url):
     """Extract archive ID and other info from an archive URL."""
+    info = classify_url(url)
+    # domain and fullPath are reported as written, not normalized
     parsed = urlparse(url)
-    
-    # Remove 'wip/' if present
-    path = parsed.path.replace('wip/', '')
-    
-    # Extract archive ID (everything after the last slash)
-    archive_id = path.split('/')[-1] if path else None
-    
     return {
-        'archiveId': archive_id,
+        'archiveId': info.archive_id,
         'domain': parsed.netloc,
-        'isWIP': 'wip' in parsed.path,
+        'isWIP': info.is_wip,
         'fullPath': parsed.path
     }
 
 def extractTwitterInfo(url):
     """Extract tweet ID and other info from a Twitter/X URL."""
-    patterns = [
-        r'(?:twitter|x)\.com/\w+/status/(\d+)',
-        r'(?:twitter|x)\.com/i/status/(\d+)',
-        r'(?:twitter|x)\.com/\w+/statuses/(\d+)',
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, url)
-        if match:
-            return {
-                'tweetId': match.group(1),
-                'isTwitterUrl': True
-            }
-    
+    tweet_id = _tweet_id(url)
     return {
-        'tweetId': None,
-        'isTwitterUrl': False
-    } 
\ No newline at end of file
+        'tweetId': tweet_id,
+        'isTwitterUrl': tweet_id is not None
+    }
+
+def _tweet_id(url):
+    info = classify_url(url)
+    if info.tweet_id or info.normalized is None:
+        return info.tweet_id
+    # A status link wrapped by another URL, as in archive.ph/o/ID/<original URL>
+    parts = urlsplit(info.normalized)
+    for embedded in classify_text(f'{parts.path} {parts.query}'):
+        if embedded.tweet_id:
+            return embedded.tweet_id
+    return None
@@ -0,0 +1,84 @@
+"""Binary column type for embeddings and feature vectors.
+
+Vectors are stored as raw little-endian bytes instead of JSON float lists:
+a 12-byte header, then either the dense values or, when that is smaller,
+the non-zero values followed by their uint16/uint32 indices. Dense values
+load with ``np.frombuffer`` straight from the driver's buffer, without a
+copy; hashed TF-IDF embeddings are mostly zeros and usually take the
+sparse layout.
+
+Columns accept lists, tuples or arrays and return read-only NumPy arrays
+(empty for a stored empty vector, None for NULL).
+"""
+import os
+import struct
+
+import numpy as np
+from sqlalchemy.types import LargeBinary, TypeDecorator
+
+VECTOR_CONFIG = {
+    'dtype': os.environ.get('VECTOR_DTYPE', 'float32'),  # 'float16' halves storage at ~3 significant digits
+    'sparse': True  # store non-zeros only when that is smaller
+}
+
+# kind (0 dense, 1 sparse), dtype code, padding, dimension, stored value count
+HEADER = struct.Struct('<BBxxII')
+DENSE, SPARSE = 0, 1
+DTYPES = {0: np.dtype('<f4'), 1: np.dtype('<f2')}
+DTYPE_CODES = {dtype: code for code, dtype in DTYPES.items()}
+
+def encode_vector(values, dtype=None):
+    """Pack a 1-D vector into the binary column format."""
+    dtype = np.dtype(dtype or VECTOR_CONFIG['dtype']).newbyteorder('<')
+    vector = np.asarray(values, dtype=dtype).ravel()
+    dim = len(vector)
+    if VECTOR_CONFIG['sparse']:
+        nonzero = np.flatnonzero(vector)
+        index_dtype = np.dtype('<u2') if dim <= 0xFFFF else np.dtype('<u4')
+        if len(nonzero) * (dtype.itemsize + index_dtype.itemsize) < dim * dtype.itemsize:
+            # Values first so they stay aligned for frombuffer; indices follow
+            return b''.join((
+                HEADER.pack(SPARSE, DTYPE_CODES[dtype], dim, len(nonzero)),
+                vector[nonzero].tobytes(),
+                nonzero.astype(index_dtype).tobytes()
+            ))
+    return HEADER.pack(DENSE, DTYPE_CODES[dtype], dim, dim) + vector.tobytes()
+
+def decode_vector(data):
+    """Unpack bytes (or a memoryview) written by ``encode_vector``."""
+    kind, code, dim, count = HEADER.unpack_from(data)
+    dtype = DTYPES[code]
+    values = np.frombuffer(data, dtype=dtype, count=count, offset=HEADER.size)
+    if kind == DENSE:
+        return values
+    index_dtype = np.dtype('<u2') if dim <= 0xFFFF else np.dtype('<u4')
+    indices = np.frombuffer(data, dtype=index_dtype, count=count, offset=HEADER.size + count * dtype.itemsize)
+    vector = np.zeros(dim, dtype=dtype)
+    vector[indices] = values
+    vector.flags.writeable = False
+    return vector
+
+class VectorType(TypeDecorator):
+    """LargeBinary column holding one vector per row."""
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def __init__(self, dtype=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dtype = dtype
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return encode_vector(value, self.dtype)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return decode_vector(value)
+
+    def compare_values(self, x, y):
+        if x is None or y is None:
+            return x is y
+        return np.array_equal(np.asarray(x), np.asarray(y))